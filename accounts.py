@@ -0,0 +1,116 @@
+# accounts.py
+"""
+Tracked accounts (SQLite). Each account keeps a watermark (newest post id and its timestamp) and
+the ids of the posts already seen, so a sync (downloader.sync_account) only pages through what was
+posted since the previous one. Posts found by a sync stay "new" until they are queued for download.
+"""
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional, Set
+
+from metacache import normalize_url
+
+SEEN, NEW, QUEUED = "seen", "new", "queued"
+
+
+class AccountStore:
+    def __init__(self, db_path: Path):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS accounts ("
+            " key TEXT PRIMARY KEY, url TEXT NOT NULL, title TEXT, cookiefile TEXT,"
+            " auto_download INTEGER NOT NULL DEFAULT 0, newest_id TEXT, newest_ts REAL,"
+            " last_sync REAL, added REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS posts ("
+            " account TEXT NOT NULL, id TEXT NOT NULL, url TEXT, title TEXT, thumbnail TEXT, timestamp REAL,"
+            " first_seen REAL NOT NULL, state TEXT NOT NULL, PRIMARY KEY (account, id))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS posts_state ON posts (account, state, first_seen)")
+
+    def track(self, url: str, title: Optional[str] = None, cookiefile: Optional[str] = None,
+              auto_download: bool = False) -> None:
+        """Starts tracking url (or updates its settings); its first sync records a baseline."""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO accounts (key, url, title, cookiefile, auto_download, added) VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET title = COALESCE(excluded.title, title),"
+                " cookiefile = COALESCE(excluded.cookiefile, cookiefile), auto_download = excluded.auto_download",
+                (normalize_url(url), url, title, cookiefile, int(auto_download), time.time()),
+            )
+
+    def untrack(self, url: str) -> None:
+        key = normalize_url(url)
+        with self._lock:
+            self._db.execute("DELETE FROM posts WHERE account = ?", (key,))
+            self._db.execute("DELETE FROM accounts WHERE key = ?", (key,))
+
+    def get(self, url: str) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self._db.execute("SELECT * FROM accounts WHERE key = ?", (normalize_url(url),)).fetchone()
+
+    def accounts(self) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._db.execute("SELECT * FROM accounts ORDER BY added").fetchall()
+
+    def due(self, interval: float) -> List[sqlite3.Row]:
+        """Accounts not synced for interval seconds (or never), least recently synced first."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT * FROM accounts WHERE last_sync IS NULL OR last_sync < ? ORDER BY COALESCE(last_sync, 0)",
+                (time.time() - interval,),
+            ).fetchall()
+
+    def seen_ids(self, url: str) -> Set[str]:
+        with self._lock:
+            rows = self._db.execute("SELECT id FROM posts WHERE account = ?", (normalize_url(url),)).fetchall()
+        return {r["id"] for r in rows}
+
+    def record(self, url: str, entries: List[dict], state: str = NEW) -> None:
+        """
+        Stores a sync's entries (newest first) in state and moves the watermark to the newest of
+        them; the sync time is updated even when nothing was found.
+        """
+        key, now = normalize_url(url), time.time()
+        rows = [
+            (key, str(e.get("id") or e.get("webpage_url") or e.get("url")), e.get("webpage_url") or e.get("url"),
+             e.get("title"), e.get("thumbnail"), e.get("timestamp"), now, state)
+            for e in entries
+        ]
+        stamped = [e for e in entries if e.get("timestamp")]
+        newest = max(stamped, key=lambda e: e["timestamp"]) if stamped else (entries[0] if entries else None)
+        with self._lock:
+            self._db.executemany("INSERT OR IGNORE INTO posts VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            if newest is not None:
+                self._db.execute(
+                    "UPDATE accounts SET newest_id = ?, newest_ts = MAX(COALESCE(newest_ts, 0), COALESCE(?, 0)),"
+                    " last_sync = ? WHERE key = ?",
+                    (str(newest.get("id") or newest.get("url")), newest.get("timestamp"), now, key),
+                )
+            else:
+                self._db.execute("UPDATE accounts SET last_sync = ? WHERE key = ?", (now, key))
+
+    def new_posts(self, url: str) -> List[dict]:
+        """Posts found by syncs and not queued yet, newest first, as grid entries."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, url, title, thumbnail, timestamp FROM posts WHERE account = ? AND state = ?"
+                " ORDER BY first_seen DESC, COALESCE(timestamp, 0) DESC",
+                (normalize_url(url), NEW),
+            ).fetchall()
+        return [{"id": r["id"], "webpage_url": r["url"], "url": r["url"], "title": r["title"],
+                 "thumbnail": r["thumbnail"], "timestamp": r["timestamp"]} for r in rows]
+
+    def mark(self, url: str, ids: Iterable[str], state: str = QUEUED) -> None:
+        with self._lock:
+            self._db.executemany(
+                "UPDATE posts SET state = ? WHERE account = ? AND id = ?",
+                [(state, normalize_url(url), str(i)) for i in ids],
+            )
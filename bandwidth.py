@@ -0,0 +1,322 @@
+# bandwidth.py
+"""
+Bandwidth scheduling across every download of the app, its queue workers and batch runs.
+
+Each job is a flow, split per site into sub-flows with their own token bucket. A flow's progress
+hook (Flow.progress_hook) takes the bytes each download reports from its buckets and sleeps off
+any overdraft, so a throttled download simply reads its socket more slowly. Twice a second every
+process publishes its sub-flows (weight, recent throughput) to a small SQLite table and computes
+weighted max-min fair rates over all of them under the global and per-host limits (allocate());
+rates unused by a sub-flow are handed to the others.
+
+Weights: every session gets an equal share per priority class (INTERACTIVE jobs weigh
+PRIORITY_WEIGHTS times more than BULK ones), split between its sub-flows and scaled by the job's
+own weight, which can be changed while it runs (Flow.set_weight). With no limits configured
+(VD_RATE_LIMIT_MB / VD_HOST_RATE_LIMIT_MB unset) hooks only count bytes and nothing is shared.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+# bytes/s; 0 = unlimited. Fair sharing only has an effect below a limit, so set the global one a
+# little under the link's real capacity.
+GLOBAL_RATE = float(os.environ.get("VD_RATE_LIMIT_MB", "0")) * 1024 * 1024
+HOST_RATE = float(os.environ.get("VD_HOST_RATE_LIMIT_MB", "0")) * 1024 * 1024
+
+INTERACTIVE, BULK = "interactive", "bulk"
+PRIORITY_WEIGHTS = {INTERACTIVE: 4.0, BULK: 1.0}
+
+REBALANCE_INTERVAL = 0.5
+STALE = 5.0  # sub-flows not refreshed for this long (dead process) are dropped
+BURST = 0.25  # seconds of rate a bucket may bank
+MAX_SLEEP = 0.2  # waits are re-evaluated this often, so a new rate applies at once
+UNDERUSE = 0.8  # a sub-flow below this share of its rate is capped near its own throughput
+MIN_DEMAND = 64 * 1024
+
+
+def _host(url: Optional[str]) -> str:
+    try:
+        host = urlparse(url or "").hostname or ""
+    except ValueError:
+        return ""
+    return host[4:] if host.startswith("www.") else host
+
+
+class TokenBucket:
+    """rate bytes/s (0 = unlimited). take() may overdraw; wait() is how long until the debt is paid."""
+
+    def __init__(self, rate: float = 0.0, burst: float = BURST):
+        self._lock = threading.Lock()
+        self.rate = rate
+        self.burst = burst
+        self._tokens = rate * burst
+        self._stamp = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.rate > 0:
+            self._tokens = min(self.rate * self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            if rate <= 0:
+                self._tokens = 0.0
+
+    def take(self, n: int) -> None:
+        with self._lock:
+            self._refill()
+            if self.rate > 0:
+                self._tokens -= n
+
+    def wait(self) -> float:
+        with self._lock:
+            self._refill()
+            return -self._tokens / self.rate if self.rate > 0 and self._tokens < 0 else 0.0
+
+
+def allocate(flows: Dict[Hashable, Tuple[str, float, float]], capacity: float = 0.0,
+             host_capacity: float = 0.0) -> Dict[Hashable, float]:
+    """
+    Weighted max-min fair rates by progressive filling. flows: key -> (host, weight, demand), demand
+    math.inf when the sub-flow would take all it gets. capacity / host_capacity are the global and
+    per-host limits (0 = none). Returns key -> rate, math.inf for sub-flows nothing limits.
+    """
+    rate = {k: 0.0 for k in flows}
+    active = {k for k, (_, w, _) in flows.items() if w > 0}
+    for k in set(flows) - active:
+        rate[k] = math.inf
+    groups: List[Tuple[float, List[Hashable]]] = []
+    if capacity > 0:
+        groups.append((capacity, list(flows)))
+    if host_capacity > 0:
+        by_host: Dict[str, List[Hashable]] = defaultdict(list)
+        for k, (host, _, _) in flows.items():
+            by_host[host].append(k)
+        groups.extend((host_capacity, members) for members in by_host.values())
+    while active:
+        # the largest per-unit-weight increase before a limit or a demand is reached
+        step, limiting = math.inf, []
+        for cap, members in groups:
+            weight = sum(flows[k][1] for k in members if k in active)
+            if weight:
+                # unlimited (zero-weight) flows are outside every limit
+                room = (cap - sum(rate[k] for k in members if not math.isinf(rate[k]))) / weight
+                if room < step - 1e-9:
+                    step, limiting = room, [members]
+                elif room <= step + 1e-9:
+                    limiting.append(members)
+        for k in active:
+            room = (flows[k][2] - rate[k]) / flows[k][1]
+            if room < step - 1e-9:
+                step, limiting = room, [[k]]
+            elif room <= step + 1e-9:
+                limiting.append([k])
+        if step == math.inf:
+            for k in active:
+                rate[k] = math.inf
+            break
+        step = max(step, 0.0)
+        for k in active:
+            rate[k] += step * flows[k][1]
+        for members in limiting:
+            active.difference_update(members)
+    return rate
+
+
+class Flow:
+    """One job's share: use progress_hook as a yt-dlp progress hook for all of the job's downloads."""
+
+    def __init__(self, scheduler: "Scheduler", flow_id: str, session: str, priority: str, weight: float):
+        self._scheduler = scheduler
+        self.id = flow_id
+        self.session = session
+        self.priority = priority if priority in PRIORITY_WEIGHTS else BULK
+        self.weight = weight
+        self._lock = threading.Lock()
+        self._seen: Dict[str, int] = {}  # download (tmp file) -> bytes reported so far
+        self.buckets: Dict[str, TokenBucket] = {}  # host -> bucket
+        self.moved: Dict[str, int] = defaultdict(int)  # host -> bytes since the last rebalance
+
+    def set_weight(self, weight: float) -> None:
+        """Changes the job's share; applied at the next rebalance (within REBALANCE_INTERVAL)."""
+        self.weight = max(0.01, float(weight))
+
+    def progress_hook(self, d: dict) -> None:
+        if not self._scheduler.enabled or d.get("status") not in ("downloading", "finished"):
+            return
+        name = d.get("tmpfilename") or d.get("filename") or ""
+        done = d.get("downloaded_bytes") or 0
+        info = d.get("info_dict") or {}
+        host = _host(info.get("webpage_url") or info.get("url"))
+        with self._lock:
+            delta = max(0, done - self._seen.get(name, 0))
+            if d["status"] == "finished":
+                self._seen.pop(name, None)
+                return  # "finished" repeats the total: nothing new was read
+            self._seen[name] = max(done, self._seen.get(name, 0))
+            self.moved[host] += delta
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self._scheduler.first_rate())
+                self._scheduler.wake()
+        if delta:
+            self._scheduler.throttle(bucket, delta)
+
+    def close(self) -> None:
+        self._scheduler._close(self)
+
+
+class Scheduler:
+    """Process-wide; flows of other processes are seen through the shared table at db_path."""
+
+    def __init__(self, db_path: Path, capacity: float = GLOBAL_RATE, host_capacity: float = HOST_RATE):
+        self.db_path = Path(db_path)
+        self.capacity = capacity
+        self.host_capacity = host_capacity
+        self._lock = threading.Lock()
+        self._flows: Dict[str, Flow] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        self._thread: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+        self.rates: Dict[Tuple[str, str], float] = {}  # (flow, host) -> current rate, this process
+        self._published = False
+        self._known = 0  # sub-flows (all processes) at the last rebalance
+        self.throttled_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0 or self.host_capacity > 0
+
+    def flow(self, flow_id: str, session: str = "", priority: str = BULK, weight: float = 1.0) -> Flow:
+        f = Flow(self, flow_id, session or flow_id, priority, weight)
+        with self._lock:
+            self._flows[flow_id] = f
+            if self.enabled and self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="bandwidth", daemon=True)
+                self._thread.start()
+        self.wake()
+        return f
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def first_rate(self) -> float:
+        """Rate of a new sub-flow until the next rebalance: an even split, so it cannot burst past the limit."""
+        limit = min(c for c in (self.capacity, self.host_capacity) if c > 0) if self.enabled else 0.0
+        return limit / (self._known + 1)
+
+    def throttle(self, bucket: TokenBucket, n: int) -> None:
+        bucket.take(n)
+        t0 = time.monotonic()
+        while True:
+            delay = bucket.wait()
+            if delay <= 0:
+                break
+            time.sleep(min(delay, MAX_SLEEP))
+        waited = time.monotonic() - t0
+        if waited:
+            with self._lock:
+                self.throttled_seconds += waited
+
+    def _close(self, flow: Flow) -> None:
+        with self._lock:
+            if self._flows.get(flow.id) is flow:
+                del self._flows[flow.id]
+        self.wake()
+
+    # --------- rebalancing ----------
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.db_path), timeout=10, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS flows ("
+                " pid INTEGER NOT NULL, flow TEXT NOT NULL, host TEXT NOT NULL, session TEXT NOT NULL,"
+                " priority TEXT NOT NULL, weight REAL NOT NULL, demand REAL, updated REAL NOT NULL,"
+                " PRIMARY KEY (flow, host))"
+            )
+        return self._db
+
+    def _loop(self) -> None:
+        last = time.monotonic()
+        while True:
+            self._wake.wait(REBALANCE_INTERVAL)
+            self._wake.clear()
+            now = time.monotonic()
+            try:
+                self.rebalance(max(now - last, 1e-3))
+            except sqlite3.Error:
+                pass  # keep the current rates; next round
+            last = now
+
+    def rebalance(self, elapsed: float) -> None:
+        """Publishes this process's sub-flows and applies its share of the fair allocation."""
+        pid, now = os.getpid(), time.time()
+        rows = []
+        with self._lock:
+            flows = list(self._flows.values())
+        for f in flows:
+            with f._lock:
+                moved, f.moved = dict(f.moved), defaultdict(int)
+                buckets = dict(f.buckets)
+            for host, bucket in buckets.items():
+                used = moved.get(host, 0) / elapsed
+                # a sub-flow that leaves part of its rate unused (slow server, almost done) keeps
+                # a little headroom over what it used; the rest goes to the others
+                demand = max(used * 1.5, MIN_DEMAND) if bucket.rate > 0 and used < bucket.rate * UNDERUSE else None
+                rows.append((pid, f.id, host, f.session, f.priority, f.weight, demand, now))
+        if not rows and not self._published:
+            return  # idle: nothing to publish or withdraw
+        self._published = bool(rows)
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM flows WHERE pid = ? OR updated < ?", (pid, now - STALE))
+            db.executemany("INSERT OR REPLACE INTO flows VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            everyone = db.execute("SELECT flow, host, session, priority, weight, demand FROM flows").fetchall()
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        self._known = len(everyone)
+        rates = allocate(self.shares(everyone), self.capacity, self.host_capacity)
+        applied = {}
+        for f in flows:
+            for host, bucket in list(f.buckets.items()):
+                rate = rates.get((f.id, host), math.inf)
+                bucket.set_rate(0.0 if math.isinf(rate) else rate)
+                applied[(f.id, host)] = rate
+        self.rates = applied
+
+    @staticmethod
+    def shares(rows: Iterable[tuple]) -> Dict[Tuple[str, str], Tuple[str, float, float]]:
+        """allocate() input from (flow, host, session, priority, weight, demand) rows."""
+        rows = list(rows)
+        per_class: Dict[Tuple[str, str], int] = defaultdict(int)
+        for _, _, session, priority, _, _ in rows:
+            per_class[(session, priority)] += 1
+        return {
+            (flow, host): (
+                host,
+                PRIORITY_WEIGHTS.get(priority, 1.0) * weight / per_class[(session, priority)],
+                math.inf if demand is None else demand,
+            )
+            for flow, host, session, priority, weight, demand in rows
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            flows = len(self._flows)
+            throttled = self.throttled_seconds
+        limited = [r for r in self.rates.values() if not math.isinf(r)]
+        return {"flows": flows, "throttled_seconds_total": throttled, "allocated_bytes_per_second": sum(limited)}
@@ -0,0 +1,263 @@
+# batch.py
+"""
+Headless bulk downloads through the same pipeline as the pages (build_ydl_opts, the download
+engine, the download archive, audio extraction, the library index), without importing Streamlit.
+
+    python batch.py urls.txt -o run.jsonl                       # one URL per line, '#' starts a comment line
+    python batch.py accounts.txt --playlist-end 50 -o run.jsonl  # profile URLs are expanded into their posts
+    cat urls.txt | python batch.py - --audio --workers 16 -o run.jsonl
+    python batch.py urls.txt -o run.jsonl                       # again: items already done are skipped
+    python batch.py --tracked -o tracked.jsonl                  # new posts of the tracked accounts (cron-friendly)
+
+Each finished item appends one JSON line to the manifest (url, status, files, error, id, title...)
+and flushes it, so an interrupted run picks up where it stopped.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple
+
+from yt_dlp.utils import DownloadCancelled
+
+import transcode
+from bandwidth import BULK, PRIORITY_WEIGHTS
+from downloader import (
+    ACCOUNTS, BANDWIDTH, LIBRARY, MAX_PER_HOST, MAX_WORKERS, _PROFILE_RE, DownloadEngine, ItemResult, _audio_download, _finish_audio,
+    _video_download, build_ydl_opts, expand_profile, extract_metadata, sync_due,
+)
+from metacache import normalize_url
+
+WINDOW_PER_WORKER = 4  # items submitted ahead of the engine, per worker (bounds memory on huge lists)
+
+
+def read_inputs(paths: Iterable[str]) -> Iterator[str]:
+    """Non-empty, non-comment lines of the given files ("-" is stdin)."""
+    for p in paths:
+        f = sys.stdin if p == "-" else open(p, encoding="utf-8")
+        try:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield line
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def run_mode(info_only: bool, audio: bool, audio_format: str, audio_quality: int) -> str:
+    """Manifest tag of what "done" means for an item; a run only skips items done in the same mode."""
+    if info_only:
+        return "info"
+    return f"audio:{audio_format}:{audio_quality}" if audio else "video"
+
+
+def load_done(manifest: Path, mode: str) -> Set[str]:
+    """Normalized URLs the manifest records as finished in this mode, with their files still on disk."""
+    done: Set[str] = set()
+    if not manifest.exists():
+        return done
+    with manifest.open(encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash
+            if rec.get("mode") == mode and rec.get("status") == "ok" and all(Path(p).exists() for p in rec.get("files") or []):
+                done.add(normalize_url(rec.get("url", "")))
+    return done
+
+
+class Manifest:
+    """Append-only JSONL, one flushed line per record; safe to write from any thread."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._f = path.open("a+", encoding="utf-8")
+        # a crash can leave a partial last line: start ours on a fresh one
+        if self._f.tell() > 0:
+            self._f.seek(self._f.tell() - 1)
+            if self._f.read(1) != "\n":
+                self._f.write("\n")
+
+    def write(self, record: dict) -> None:
+        with self._lock:
+            self._f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            self._f.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._f.close()
+
+
+def expand(urls: Iterable[str], ydl_opts: dict, playlist_end: Optional[int],
+           on_error: Callable[[str, str], None]) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+    """
+    (item URL, account it came from, None) per input line; account/profile URLs yield their entries.
+    The last field is the tracked post id (see tracked_posts), which plain inputs do not have.
+    """
+    for url in urls:
+        if not _PROFILE_RE.match(url):
+            yield url, None, None
+            continue
+        opts = dict(ydl_opts, playlistend=playlist_end) if playlist_end else ydl_opts
+        try:
+            entries = expand_profile(opts, url)
+        except Exception as e:
+            on_error(url, str(e))
+            continue
+        if not entries:
+            on_error(url, "no entries (private, blocked or empty account?)")
+        for entry in entries:
+            yield entry, url, None
+
+
+def tracked_posts(workers: int, per_host: int) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+    """
+    (post URL, account, post id) for the posts every tracked account gained since it was last
+    queued. The id is the one the account store keeps, so the post can be marked even when its
+    download reports no info (an archive hit).
+    """
+    for account, posts in sync_due(0, workers, per_host).items():
+        for post in posts:
+            yield post["webpage_url"], account, post["id"]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("inputs", nargs="*", help="files with one URL per line; '-' (default without --tracked) is stdin")
+    parser.add_argument("-o", "--manifest", default="batch-manifest.jsonl", help="JSONL results; also the resume state")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help=f"concurrent items (default {MAX_WORKERS})")
+    parser.add_argument("--per-host", type=int, default=MAX_PER_HOST, help=f"concurrent items per host (default {MAX_PER_HOST})")
+    parser.add_argument("--audio", action="store_true", help="extract audio instead of downloading MP4")
+    parser.add_argument("--audio-format", choices=sorted(transcode.FORMATS), default=transcode.DEFAULT_FORMAT)
+    parser.add_argument("--audio-quality", type=int, default=transcode.DEFAULT_QUALITY, help="kbps when re-encoding")
+    parser.add_argument("--cookie-file", help="Netscape cookie file (private accounts)")
+    parser.add_argument("--playlist-end", type=int, help="at most this many entries per account")
+    parser.add_argument("--fragments", type=int, help="parallel HLS/DASH fragments per item")
+    parser.add_argument("--priority", choices=sorted(PRIORITY_WEIGHTS), default=BULK,
+                        help="bandwidth class next to the app's jobs (only with VD_RATE_LIMIT_MB / VD_HOST_RATE_LIMIT_MB)")
+    parser.add_argument("--tracked", action="store_true", help="sync the tracked accounts and download their new posts")
+    parser.add_argument("--info-only", action="store_true", help="record metadata only, download nothing")
+    parser.add_argument("-q", "--quiet", action="store_true", help="no per-item lines on stderr")
+    args = parser.parse_args(argv)
+    if not args.inputs and not args.tracked:
+        args.inputs = ["-"]
+
+    mode = run_mode(args.info_only, args.audio, args.audio_format, args.audio_quality)
+    manifest_path = Path(args.manifest)
+    done = load_done(manifest_path, mode)
+    manifest = Manifest(manifest_path)
+    cookie = Path(args.cookie_file).read_text() if args.cookie_file else None
+
+    cancelled = threading.Event()
+
+    def _cancel_hook(d: dict) -> None:
+        if cancelled.is_set():
+            raise DownloadCancelled("interrupted")
+
+    ydl_opts = build_ydl_opts(args.audio, args.cookie_file, args.fragments, args.audio_format)
+    # the run is one bandwidth flow, sharing any configured limit with the app's jobs
+    flow = BANDWIDTH.flow(f"batch-{os.getpid()}", session=f"batch-{os.getpid()}", priority=args.priority)
+    ydl_opts["progress_hooks"] = [_cancel_hook, flow.progress_hook]
+    download = _audio_download(args.audio_format, args.audio_quality, {}) if args.audio else _video_download({})
+    engine = DownloadEngine(args.workers, args.per_host)
+    window = threading.BoundedSemaphore(max(1, args.workers) * WINDOW_PER_WORKER)
+    idle = threading.Condition()
+    counts = {"ok": 0, "error": 0, "skipped": 0, "running": 0}
+    t0 = time.time()
+
+    def log(line: str) -> None:
+        if not args.quiet:
+            print(line, file=sys.stderr, flush=True)
+
+    def account_error(url: str, error: str) -> None:
+        manifest.write({"url": url, "mode": mode, "status": "error", "kind": "account", "error": error, "finished": round(time.time(), 3)})
+        log(f"account {url}: {error}")
+
+    def item(url: str) -> ItemResult:
+        if args.info_only:
+            info = extract_metadata(url, cookie=cookie, limit_preview=1)
+            if isinstance(info, dict) and "entries" in info:
+                info = (info.get("entries") or [None])[0]
+            return ItemResult(url, info=info)
+        return download(ydl_opts, url, None, None)
+
+    def complete(r: ItemResult, account: Optional[str], post_id: Optional[str]) -> None:
+        if r.pending is not None:
+            _finish_audio(r, args.audio_format, args.audio_quality)
+        for f in r.files:
+            LIBRARY.add(f)
+        info = r.info or {}
+        status = "ok" if r.ok else "error"
+        post_id = post_id or info.get("id")
+        if r.ok and account and post_id and not args.info_only:
+            ACCOUNTS.mark(account, [post_id])  # a failed post stays new for the next sync
+        manifest.write({
+            "url": r.url, "mode": mode, "status": status, "files": r.files, "error": r.error,
+            "id": post_id, "extractor": info.get("extractor_key"), "title": info.get("title"),
+            "duration": info.get("duration"), "account": account, "finished": round(time.time(), 3),
+        })
+        with idle:
+            counts[status] += 1
+            log(f"[{counts['ok'] + counts['error']}] {status:5} {info.get('title') or r.url}" + (f": {r.error}" if r.error else ""))
+            counts["running"] -= 1
+            idle.notify_all()
+        window.release()
+
+    def finished(future, url: str, account: Optional[str], post_id: Optional[str]) -> None:
+        try:
+            r = future.result()
+        except BaseException as e:
+            r = ItemResult(url, error=str(e))
+        if r.pending is not None:
+            # audio still extracting in the transcode pool: record it when that is done
+            r.pending.add_done_callback(lambda _: complete(r, account, post_id))
+        else:
+            complete(r, account, post_id)
+
+    seen: Set[str] = set()
+    sources = [expand(read_inputs(args.inputs), ydl_opts, args.playlist_end, account_error)] if args.inputs else []
+    if args.tracked:
+        sources.append(tracked_posts(args.workers, args.per_host))
+    try:
+        for url, account, post_id in itertools.chain(*sources):
+            key = normalize_url(url)
+            if key in done or key in seen:
+                counts["skipped"] += key in done
+                continue
+            seen.add(key)
+            window.acquire()
+            with idle:
+                counts["running"] += 1
+            future = engine.submit(url, lambda url=url: item(url))
+            future.add_done_callback(lambda f, url=url, account=account, post_id=post_id: finished(f, url, account, post_id))
+        with idle:
+            while counts["running"]:
+                idle.wait(1.0)
+    except KeyboardInterrupt:
+        cancelled.set()
+        print("interrupted: stopping running items (the manifest keeps what finished)", file=sys.stderr)
+        with idle:
+            while counts["running"]:
+                idle.wait(1.0)
+    finally:
+        flow.close()
+        manifest.close()
+    print(
+        f"{counts['ok']} ok, {counts['error']} failed, {counts['skipped']} already done in {time.time() - t0:.1f}s"
+        f" -> {manifest_path}",
+        file=sys.stderr,
+    )
+    if cancelled.is_set():
+        return 130
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+# bench/run.py
+"""
+Offline benchmarks for the real download path: downloader.build_ydl_opts (the options
+download_with_animation uses), _yt_download_worker with its engine, and the job ZIP. They run
+against bench/server.py through the vdbench yt-dlp plugin, so no network is needed.
+
+    python bench/run.py                          # all scenarios, JSON on stdout
+    python bench/run.py -s batch36 -o out.json
+    python bench/run.py --baseline out.json      # exit 1 if anything regressed beyond --tolerance
+    python bench/run.py -s fairshare             # bandwidth.py: interactive vs bulk job under a global limit
+
+Each scenario runs in a fresh subprocess (own cwd, downloads/ and .state/) so peak RSS and
+bytes written belong to that scenario alone.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+MiB = 1024 * 1024
+
+SCENARIOS: Dict[str, dict] = {
+    # one long video over one connection: the AnyVideo page's worst case
+    "single": {"items": 1, "size": 64 * MiB, "latency": 50, "fail": 0, "rate": 16 * MiB, "audio": False, "zip": False},
+    # a full grid selection: many small items, slow extractor, some failures, ZIP at the end
+    "batch36": {"items": 36, "size": 4 * MiB, "latency": 150, "fail": 0.1, "rate": 4 * MiB, "audio": False, "zip": True},
+    # Audio page: download + FFmpegExtractAudio to MP3
+    "audio": {"items": 4, "size": 8 * MiB, "latency": 50, "fail": 0, "rate": 0, "audio": True, "zip": False},
+    # a 4-item bulk job and, a second later, a single interactive item in two worker processes
+    # sharing an 8 MB/s limit (bandwidth.py); throughput is the interactive item's
+    "fairshare": {"items": 4, "size": 16 * MiB, "latency": 50, "fail": 0, "rate": 0, "audio": False, "zip": False,
+                  "env": {"VD_RATE_LIMIT_MB": "8"}},
+}
+
+# (metric, direction): +1 means higher is better
+_COMPARED = (("throughput_Bps", +1), ("latency_p50_s", -1), ("latency_p99_s", -1), ("peak_rss_kb", -1), ("disk_write_bytes", -1))
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def _write_bytes() -> Optional[int]:
+    try:
+        for line in Path("/proc/self/io").read_text().splitlines():
+            if line.startswith("write_bytes:"):
+                return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _fair_job(base_url: str, role: str, delay: float) -> dict:
+    """One job of the fairshare scenario, in its own process like a queue worker's."""
+    from bandwidth import BULK, INTERACTIVE
+    from downloader import BANDWIDTH, _yt_download_worker, build_ydl_opts
+    from progress import PROGRESS
+    from zipstream import iter_zip
+
+    cfg = SCENARIOS["fairshare"]
+    count = cfg["items"] if role == BULK else 1
+    urls = [f"{base_url}/v/fair-{role}-{i:03d}?size={cfg['size']}&latency={cfg['latency']}" for i in range(count)]
+    time.sleep(delay)
+    flow = BANDWIDTH.flow(f"fair-{role}", session=role, priority=INTERACTIVE if role == INTERACTIVE else BULK)
+    ydl_opts = dict(build_ydl_opts(), progress_hooks=[flow.progress_hook])
+    job_id = PROGRESS.create(urls)
+    t0 = time.perf_counter()
+    _yt_download_worker(ydl_opts, urls, [], job_id=job_id)
+    wall = time.perf_counter() - t0
+    flow.close()
+    snap = PROGRESS.snapshot(job_id)
+    return {"role": role, "ok": sum(i["stage"] == "done" for i in snap["items"]), "bytes": snap["bytes_done"], "wall_s": wall}
+
+
+def run_fair(name: str, base_url: str) -> dict:
+    import multiprocessing
+
+    from bandwidth import BULK, INTERACTIVE
+
+    cfg = SCENARIOS[name]
+    with multiprocessing.get_context("spawn").Pool(2) as pool:
+        bulk = pool.apply_async(_fair_job, (base_url, BULK, 0.0))
+        interactive = pool.apply_async(_fair_job, (base_url, INTERACTIVE, 1.0))
+        bulk, interactive = bulk.get(), interactive.get()
+    return {
+        "scenario": name,
+        "items": cfg["items"] + 1,
+        "ok": bulk["ok"] + interactive["ok"],
+        "failed": cfg["items"] + 1 - bulk["ok"] - interactive["ok"],
+        "bytes": bulk["bytes"] + interactive["bytes"],
+        "wall_s": round(max(bulk["wall_s"], interactive["wall_s"] + 1.0), 4),
+        "throughput_Bps": round(interactive["bytes"] / interactive["wall_s"], 1),
+        "latency_p50_s": interactive["wall_s"],
+        "bulk_throughput_Bps": round(bulk["bytes"] / bulk["wall_s"], 1),
+        "limit_Bps": float(cfg["env"]["VD_RATE_LIMIT_MB"]) * MiB,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run_child(name: str, base_url: str) -> dict:
+    """Runs one scenario in this (fresh) process; cwd is a scratch directory."""
+    cfg = SCENARIOS[name]
+    if cfg["audio"] and not shutil.which("ffmpeg"):
+        return {"scenario": name, "skipped": "ffmpeg not found"}
+    if name == "fairshare":
+        return run_fair(name, base_url)
+
+    from downloader import OUT_DIR, _yt_download_worker, build_ydl_opts
+    from progress import PROGRESS
+    from zipstream import iter_zip
+
+    urls = [
+        f"{base_url}/v/{name}-{i:03d}?size={cfg['size']}&latency={cfg['latency']}&fail={cfg['fail']}"
+        f"&rate={cfg['rate']}&kind={'audio' if cfg['audio'] else 'video'}"
+        for i in range(cfg["items"])
+    ]
+    ydl_opts = build_ydl_opts(audio=cfg["audio"])
+    written_before = _write_bytes()
+    result_paths: List[str] = []
+    job_id = PROGRESS.create(urls)
+    t0 = time.perf_counter()
+    _yt_download_worker(ydl_opts, urls, result_paths, cfg["audio"], job_id=job_id)
+    wall = time.perf_counter() - t0
+
+    snap = PROGRESS.snapshot(job_id)
+    ok_items = [i for i in snap["items"] if i["stage"] == "done"]
+    latencies = [i["finished"] - i["begun"] for i in ok_items if i["finished"] and i["begun"]]
+    files = [p for p in result_paths if not p.startswith("__ERROR__")]
+    # what the file server's /zip/ route sends for the job (the ZIP itself is never written)
+    zip_bytes = sum(len(chunk) for chunk in iter_zip(files)) if cfg["zip"] else None
+    downloaded = sum(i["bytes_done"] for i in ok_items)
+    written_after = _write_bytes()
+    if written_before is not None and written_after is not None:
+        disk = written_after - written_before
+    else:
+        disk = sum(f.stat().st_size for f in OUT_DIR.rglob("*") if f.is_file())
+    # the server fails exactly floor(items * fail) ids: anything else means the error path was not measured
+    expected_failed = int(cfg["items"] * cfg["fail"] + 1e-9)
+    if cfg["items"] - len(ok_items) != expected_failed:
+        raise RuntimeError(f"{name}: {cfg['items'] - len(ok_items)} items failed, expected {expected_failed}")
+    return {
+        "scenario": name,
+        "items": cfg["items"],
+        "ok": len(ok_items),
+        "failed": cfg["items"] - len(ok_items),
+        "files": len(files),
+        "bytes": downloaded,
+        "wall_s": round(wall, 4),
+        "throughput_Bps": round(downloaded / wall, 1) if wall > 0 else None,
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p99_s": percentile(latencies, 99),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "disk_write_bytes": disk,
+        "zip_bytes": zip_bytes,
+    }
+
+
+def run_scenario(name: str, base_url: str, env_overrides: Dict[str, str]) -> dict:
+    with tempfile.TemporaryDirectory(prefix=f"vd-bench-{name}-") as scratch:
+        env = dict(os.environ, **SCENARIOS[name].get("env", {}), **env_overrides)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(REPO_DIR), str(BENCH_DIR), env.get("PYTHONPATH")]))
+        env["VD_STATE_DIR"] = str(Path(scratch) / ".state")
+        proc = subprocess.run(
+            [sys.executable, str(Path(__file__).resolve()), "--child", name, "--base-url", base_url],
+            cwd=scratch, env=env, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            return {"scenario": name, "error": proc.stderr.strip().splitlines()[-1:] or ["exit %d" % proc.returncode]}
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float) -> List[str]:
+    base = {r["scenario"]: r for r in baseline}
+    problems = []
+    for r in results:
+        b = base.get(r["scenario"])
+        if not b or "skipped" in r or "error" in r:
+            continue
+        for metric, direction in _COMPARED:
+            new, old = r.get(metric), b.get(metric)
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            if change * direction < -tolerance:
+                problems.append(f"{r['scenario']}.{metric}: {old} -> {new} ({change:+.1%})")
+    return problems
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(SCENARIOS), help="default: all")
+    parser.add_argument("-o", "--output", help="write results JSON here as well as to stdout")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression (default 0.15)")
+    parser.add_argument("--no-ranges", action="store_true", help="server ignores Range requests")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra env for the app, e.g. VD_MAX_WORKERS=4")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.base_url)))
+        return 0
+
+    from server import BenchServer  # bench/ is this script's directory
+
+    server = BenchServer(ranges=not args.no_ranges).start()
+    env_overrides = dict(kv.split("=", 1) for kv in args.env)
+    try:
+        results = [run_scenario(name, server.base_url, env_overrides) for name in (args.scenario or list(SCENARIOS))]
+    finally:
+        server.shutdown()
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0], "env": env_overrides, "results": results}
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    if args.baseline:
+        problems = compare(results, json.loads(Path(args.baseline).read_text())["results"], args.tolerance)
+        for p in problems:
+            print(f"REGRESSION {p}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
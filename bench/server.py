@@ -0,0 +1,158 @@
+# bench/server.py
+"""
+Local stand-in for a media site. Every behaviour is chosen by query parameters on the video URL,
+so a scenario is just a list of URLs:
+
+    /v/<id>?size=<bytes>&latency=<ms>&fail=<0..1>&kind=video|audio&rate=<bytes/s>
+
+/api/<id> answers the extractor (after ``latency``; a ``fail`` share of ids get a 500: exactly
+floor(n * fail) of the ids <name>-000 ... <name>-<n-1>, spread evenly),
+/media/<id>.<ext> serves the synthetic file with Range support, optionally throttled to ``rate``.
+Audio is a valid PCM WAV, so FFmpeg postprocessing has real work to do.
+"""
+import hashlib
+import json
+import struct
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+BLOCK = 64 * 1024
+_PATTERN = hashlib.sha256(b"vd-bench").digest() * (BLOCK // 32)
+
+
+def _params(query: str) -> dict:
+    q = {k: v[0] for k, v in parse_qs(query).items()}
+    return {
+        "size": int(q.get("size", 1024 * 1024)),
+        "latency": float(q.get("latency", 0)) / 1000,
+        "fail": float(q.get("fail", 0)),
+        "kind": q.get("kind", "video"),
+        "rate": float(q.get("rate", 0)),
+    }
+
+
+def _fails(media_id: str, share: float) -> bool:
+    if share <= 0:
+        return False
+    stem, _, index = media_id.rpartition("-")
+    if stem and index.isdigit():
+        # item i fails when the running total of failures (floor(i * share)) steps up at it
+        i = int(index)
+        return int((i + 1) * share + 1e-9) > int(i * share + 1e-9)
+    return int(hashlib.md5(media_id.encode()).hexdigest()[:8], 16) % 1000 < share * 1000
+
+
+def _wav_header(size: int) -> bytes:
+    data_len = max(size - 44, 0)
+    rate, channels, bits = 44100, 2, 16
+    return b"RIFF" + struct.pack("<I", 36 + data_len) + b"WAVEfmt " + struct.pack(
+        "<IHHIIHH", 16, 1, channels, rate, rate * channels * bits // 8, channels * bits // 8, bits
+    ) + b"data" + struct.pack("<I", data_len)
+
+
+def _body(kind: str, size: int, start: int, end: int):
+    """Bytes [start, end] of the synthetic file, in BLOCK-sized pieces."""
+    header = _wav_header(size) if kind == "audio" else b""
+    pos = start
+    while pos <= end:
+        if pos < len(header):
+            chunk = header[pos:min(end + 1, len(header))]
+        else:
+            off = (pos - len(header)) % BLOCK
+            chunk = _PATTERN[off:off + min(BLOCK - off, end + 1 - pos)]
+        yield chunk
+        pos += len(chunk)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "BenchServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        p = _params(parts.query)
+        if parts.path.startswith("/api/"):
+            media_id = parts.path[len("/api/"):]
+            time.sleep(p["latency"])
+            if _fails(media_id, p["fail"]):
+                self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR)
+                return
+            ext = "wav" if p["kind"] == "audio" else "mp4"
+            body = json.dumps({
+                "id": media_id,
+                "title": f"bench {media_id}",
+                "ext": ext,
+                "size": p["size"],
+                "kind": p["kind"],
+                "path": f"/media/{media_id}.{ext}?{parts.query}",
+            }).encode()
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif parts.path.startswith("/media/"):
+            self._media(p)
+        else:
+            self.send_error(HTTPStatus.NOT_FOUND)
+
+    def _range(self, size: int) -> Optional[Tuple[int, int]]:
+        header = self.headers.get("Range", "")
+        if not header.startswith("bytes=") or "," in header:
+            return None
+        first, _, last = header[6:].partition("-")
+        if not first:
+            return None
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        return (start, end) if start <= end else None
+
+    def _media(self, p: dict) -> None:
+        size = p["size"]
+        rng = self._range(size) if self.server.ranges else None
+        start, end = rng if rng else (0, size - 1)
+        self.send_response(HTTPStatus.PARTIAL_CONTENT if rng else HTTPStatus.OK)
+        self.send_header("Content-Type", "audio/wav" if p["kind"] == "audio" else "video/mp4")
+        self.send_header("Content-Length", str(end - start + 1))
+        if self.server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if rng:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        began, sent = time.monotonic(), 0
+        try:
+            for chunk in _body(p["kind"], size, start, end):
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if p["rate"]:
+                    ahead = sent / p["rate"] - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class BenchServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, ranges: bool = True):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.ranges = ranges
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def video_url(self, media_id: str, **params) -> str:
+        return f"{self.base_url}/v/{media_id}?{urlencode(params)}"
+
+    def start(self) -> "BenchServer":
+        threading.Thread(target=self.serve_forever, name="bench-server", daemon=True).start()
+        return self
@@ -0,0 +1,29 @@
+# yt-dlp plugin: extractor for the local benchmark server (bench/server.py).
+# yt-dlp picks it up automatically when bench/ is on sys.path.
+from urllib.parse import urlsplit
+
+from yt_dlp.extractor.common import InfoExtractor
+
+
+class VDBenchIE(InfoExtractor):
+    IE_NAME = "vdbench"
+    _VALID_URL = r"https?://(?:127\.0\.0\.1|localhost):\d+/v/(?P<id>[\w-]+)"
+
+    def _real_extract(self, url):
+        media_id = self._match_id(url)
+        parts = urlsplit(url)
+        base = f"{parts.scheme}://{parts.netloc}"
+        meta = self._download_json(f"{base}/api/{media_id}?{parts.query}", media_id)
+        audio = meta["kind"] == "audio"
+        return {
+            "id": media_id,
+            "title": meta["title"],
+            "formats": [{
+                "format_id": meta["ext"],
+                "url": base + meta["path"],
+                "ext": meta["ext"],
+                "filesize": meta["size"],
+                "vcodec": "none" if audio else "h264",
+                "acodec": "pcm_s16le" if audio else "aac",
+            }],
+        }
@@ -0,0 +1,873 @@
+# downloader.py
+"""Download core shared by the Streamlit pages. Nothing in here imports Streamlit."""
+import os
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from itertools import islice
+from typing import Callable, Deque, Dict, Iterator, List, Optional
+from urllib.parse import parse_qs, urlparse, urlsplit
+
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadCancelled
+
+from accounts import NEW, SEEN, AccountStore
+from library import Library, archive_key, url_archive_key
+from metacache import MetadataCache, cookie_tag, normalize_url, ttl_for
+from metrics import REGISTRY, event, key, setup_logging, span
+from progress import DONE, ERROR, EXTRACT, POSTPROCESS, PROGRESS, ItemHooks
+import bandwidth
+import segmented
+import transcode
+from ydlpool import YdlPool
+
+# --------- Folders ----------
+OUT_DIR = Path("downloads")
+OUT_DIR.mkdir(exist_ok=True)
+# caches / indexes; kept out of OUT_DIR so they are never listed or zipped as downloads
+STATE_DIR = Path(os.environ.get("VD_STATE_DIR", ".state"))
+STATE_DIR.mkdir(exist_ok=True)
+# sources of audio jobs, one directory per item, so extracting never touches (or deletes) a video
+# another job downloaded, and two jobs extracting the same video do not share a source file
+AUDIO_SRC_DIR = OUT_DIR / ".audio-src"
+
+# per-process metric dumps (merged by the /metrics endpoint) and JSON-lines event logs
+METRICS_DIR = STATE_DIR / "metrics"
+setup_logging(STATE_DIR / "events")
+
+# configured YoutubeDL instances, reused across calls and sessions (see ydlpool.py)
+YDL_POOL = YdlPool()
+
+# bandwidth shares of running jobs, coordinated with the other processes (see bandwidth.py)
+BANDWIDTH = bandwidth.Scheduler(STATE_DIR / "bandwidth.sqlite")
+
+# finished files, for "Recent downloads" and token-based serving, and the download archive:
+# (extractor, id, format or audio settings) -> the file already downloaded for it
+LIBRARY = Library(STATE_DIR / "library.sqlite", OUT_DIR)
+
+# tracked accounts: watermarks and seen posts for incremental syncs (see accounts.py)
+ACCOUNTS = AccountStore(STATE_DIR / "accounts.sqlite")
+
+# --------- Engine limits ----------
+MAX_WORKERS = int(os.environ.get("VD_MAX_WORKERS", "8"))
+MAX_PER_HOST = int(os.environ.get("VD_MAX_PER_HOST", "4"))
+# HLS/DASH fragments fetched in parallel per item (yt-dlp's concurrent_fragment_downloads);
+# large progressive files are split into segmented.SEGMENTS ranges instead
+FRAGMENTS = int(os.environ.get("VD_FRAGMENTS", "4"))
+
+# --------- Metadata cache ----------
+METADATA_CACHE = MetadataCache(
+    STATE_DIR / "metadata.sqlite",
+    max_entries=int(os.environ.get("VD_META_CACHE_ENTRIES", "2000")),
+    max_bytes=int(os.environ.get("VD_META_CACHE_MB", "64")) * 1024 * 1024,
+)
+
+
+def _metadata_cache_metrics() -> dict:
+    s = METADATA_CACHE.stats()
+    return {
+        key("vd_cache_requests_total", cache="metadata", result="hit"): s["hits"],
+        key("vd_cache_requests_total", cache="metadata", result="miss"): s["misses"],
+        key("vd_cache_evictions_total", cache="metadata"): s["evictions"],
+        key("vd_cache_entries", cache="metadata"): s["entries"],
+        key("vd_cache_bytes", cache="metadata"): s["bytes"],
+    }
+
+
+REGISTRY.collector(_metadata_cache_metrics)
+REGISTRY.collector(lambda: {key(f"vd_ydl_pool_{k}"): v for k, v in YDL_POOL.stats().items()})
+REGISTRY.collector(lambda: {key(f"vd_archive_{k}"): v for k, v in LIBRARY.archive_stats().items()}, shared=True)
+REGISTRY.collector(lambda: {key(f"vd_bandwidth_{k}"): v for k, v in BANDWIDTH.stats().items()})
+
+# --------- Account previews ----------
+PAGE_SIZE = int(os.environ.get("VD_PAGE_SIZE", "12"))
+CURSOR_TTL = 600  # idle seconds before a live playlist cursor is dropped
+
+# --------- Account sync ----------
+SYNC_FIRST = int(os.environ.get("VD_SYNC_FIRST", "24"))  # entries recorded as the baseline of a newly tracked account
+SYNC_MAX = 500  # new entries taken by one sync at most (an account back from a long break)
+SYNC_PINNED = 3  # leading entries a profile may pin above newer posts; known ones there do not stop a sync
+
+# seconds of validity a resolved format URL must still have to be reused for a download
+EXPIRY_MARGIN = 120
+# signed-URL expiry parameters: (name, base) — YouTube/CloudFront/TikTok use decimal epochs, Meta CDNs hex
+_EXPIRY_PARAMS = (("expire", 10), ("Expires", 10), ("x-expires", 10), ("oe", 16))
+
+# account/profile pages (not single posts) that expand to many items
+_PROFILE_RE = re.compile(
+    r"^https://www\.(?:tiktok\.com/@[^/?#]+/?|instagram\.com/(?!p/|reel/|reels/|tv/|stories/)[^/?#]+/?)(?:[?#].*)?$"
+)
+
+
+@dataclass
+class ItemResult:
+    """Outcome of one URL in a batch."""
+    url: str
+    info: Optional[dict] = None
+    error: Optional[str] = None
+    files: List[str] = field(default_factory=list)
+    # audio still being extracted in the transcode pool: Future of transcode.convert()'s result per file
+    pending: Optional[Future] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class _Task:
+    host: str
+    fn: Callable[[], ItemResult]
+    future: Future
+
+
+def host_of(url: str) -> str:
+    try:
+        host = urlparse(url).hostname or ""
+    except ValueError:
+        return ""
+    return host[4:] if host.startswith("www.") else host
+
+
+class DownloadEngine:
+    """
+    Bounded worker pool for yt-dlp downloads.
+    At most ``max_workers`` items run at once overall and at most ``per_host`` per hostname;
+    the rest wait in FIFO order. One engine is shared by every session in the process.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, per_host: int = MAX_PER_HOST):
+        self.max_workers = max(1, max_workers)
+        self.per_host = max(1, per_host)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="yt-dl")
+        self._lock = threading.Lock()
+        self._waiting: Deque[_Task] = deque()
+        self._active: Dict[str, int] = {}
+        self._running = 0
+
+    def submit(self, url: str, fn: Callable[[], ItemResult]) -> Future:
+        task = _Task(host_of(url), fn, Future())
+        with self._lock:
+            self._waiting.append(task)
+        self._pump()
+        return task.future
+
+    def map(self, ydl_opts: dict, urls: List[str], job_id: Optional[str] = None,
+            on_result: Optional[Callable[[ItemResult], None]] = None,
+            infos: Optional[List[Optional[dict]]] = None,
+            download: Optional[Callable[..., ItemResult]] = None,
+            cancelled: Optional[threading.Event] = None) -> List[ItemResult]:
+        """
+        Download every URL and return one ItemResult per URL, in input order.
+        on_result, if given, is called from the worker thread as each item completes.
+        infos, if given, holds an already-extracted info dict (or None) per URL to start from.
+        download replaces _download_one (same signature) for every item.
+        Items that have not started when cancelled is set fail with "cancelled" without extracting.
+        """
+        download = download or _download_one
+
+        def _item(i: int, u: str) -> ItemResult:
+            hooks = PROGRESS.hooks(job_id, i) if job_id else None
+            if cancelled is not None and cancelled.is_set():
+                if hooks is not None:
+                    hooks.stage(ERROR, "cancelled")
+                r = ItemResult(u, error="cancelled")
+            else:
+                info = infos[i] if infos and i < len(infos) else None
+                r = download(ydl_opts, u, hooks, info)
+            if on_result is not None:
+                on_result(r)
+            return r
+
+        futures = [self.submit(u, lambda i=i, u=u: _item(i, u)) for i, u in enumerate(urls)]
+        return [f.result() for f in futures]
+
+    def _pump(self) -> None:
+        # start every waiting task whose host still has a free slot, oldest first
+        with self._lock:
+            ready: List[_Task] = []
+            skipped: Deque[_Task] = deque()
+            while self._waiting and self._running < self.max_workers:
+                task = self._waiting.popleft()
+                if self._active.get(task.host, 0) >= self.per_host:
+                    skipped.append(task)
+                    continue
+                self._active[task.host] = self._active.get(task.host, 0) + 1
+                self._running += 1
+                ready.append(task)
+            skipped.extend(self._waiting)
+            self._waiting = skipped
+        for task in ready:
+            self._pool.submit(self._run, task)
+
+    def _run(self, task: _Task) -> None:
+        try:
+            if task.future.set_running_or_notify_cancel():
+                try:
+                    task.future.set_result(task.fn())
+                except BaseException as e:
+                    task.future.set_exception(e)
+        finally:
+            with self._lock:
+                self._running -= 1
+                left = self._active.get(task.host, 1) - 1
+                if left:
+                    self._active[task.host] = left
+                else:
+                    self._active.pop(task.host, None)
+            self._pump()
+
+
+_engine: Optional[DownloadEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> DownloadEngine:
+    """Process-wide engine (Streamlit reruns the script, but imported modules persist)."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = DownloadEngine()
+        return _engine
+
+
+def build_ydl_opts(audio: bool = False, cookiefile: Optional[str] = None, fragments: Optional[int] = None,
+                   audio_format: str = transcode.DEFAULT_FORMAT) -> dict:
+    """
+    yt-dlp options for a download job: MP4, or with audio=True the best source for audio_format
+    (extracted afterwards by _yt_download_worker, not by a yt-dlp postprocessor).
+    fragments overrides VD_FRAGMENTS.
+    """
+    # the id keeps two videos with the same title from overwriting each other's file
+    outtmpl = str(OUT_DIR / "%(title).100s [%(id)s].%(ext)s")
+    if audio:
+        # vd_item is set per item by _audio_download (an info field, so pooled instances stay reusable)
+        outtmpl = str(AUDIO_SRC_DIR / "%(vd_item|shared)s" / "%(title).100s [%(id)s].%(ext)s")
+    ydl_opts = {
+        "outtmpl": outtmpl,
+        "quiet": True,
+        "no_warnings": True,
+        "ignoreerrors": True,
+        "noprogress": True,
+        "concurrent_fragment_downloads": max(1, fragments or FRAGMENTS),
+        # progress comes from progress_hooks / postprocessor_hooks, added per item by the engine
+    }
+    if audio:
+        ydl_opts["format"] = transcode.source_format(audio_format)
+    else:
+        ydl_opts.update({"format": "best", "merge_output_format": "mp4"})
+    if cookiefile:
+        ydl_opts["cookiefile"] = cookiefile
+    return ydl_opts
+
+
+def cookie_file(cookie: str) -> str:
+    """Cookie text written once per distinct cookie, so concurrent sessions never overwrite each other's."""
+    path = STATE_DIR / f"cookie_{cookie_tag(cookie)}.txt"
+    if not path.exists():
+        path.write_text(cookie)
+    return str(path)
+
+
+def metadata_key(url: str, cookie: Optional[str] = None, limit_preview: int = 24) -> str:
+    return f"{normalize_url(url)}::cookie={cookie_tag(cookie)}::limit={limit_preview}"
+
+
+def preview_opts(cookie: Optional[str] = None) -> dict:
+    opts = {"quiet": True, "no_warnings": True}
+    if cookie:
+        opts["cookiefile"] = cookie_file(cookie)
+    return opts
+
+
+def extract_metadata(url: str, cookie: Optional[str] = None, limit_preview: int = 24) -> Optional[dict]:
+    """
+    yt-dlp metadata (no download) through the shared METADATA_CACHE.
+    Playlists are trimmed to their first limit_preview entries. Raises on extractor errors.
+    """
+    cache_key = metadata_key(url, cookie, limit_preview)
+
+    def _extract() -> Optional[dict]:
+        with span("extract", host=host_of(url)), YDL_POOL.borrow(preview_opts(cookie)) as ydl:
+            info = ydl.extract_info(url, download=False)
+            if isinstance(info, dict) and "entries" in info:
+                entries = [e for e in info["entries"] if isinstance(e, dict)]
+                info = dict(info)
+                info["entries"] = entries[:limit_preview]
+            return YoutubeDL.sanitize_info(info) if info else None
+
+    return METADATA_CACHE.get_or_load(cache_key, _extract, ttl_for(url))
+
+
+class _Cursor:
+    """A live, flat, lazily-extracted playlist: pulling the next page continues the extractor's own paging."""
+
+    def __init__(self, url: str, cookie: Optional[str]):
+        opts = {"quiet": True, "no_warnings": True, "extract_flat": "in_playlist", "lazy_playlist": True}
+        if cookie:
+            opts["cookiefile"] = cookie_file(cookie)
+        self.ydl = YoutubeDL(opts)
+        # process=False: nothing is resolved, entries stay a lazy iterator over the extractor's pages
+        info = self.ydl.extract_info(url, download=False, process=False) or {}
+        entries = info.get("entries")
+        self.entries: Iterator = iter(entries if entries is not None else [info])
+        self.header = {k: info.get(k) for k in ("id", "title", "uploader", "uploader_id", "channel", "extractor_key", "webpage_url")}
+        self.position = 0
+        self.exhausted = False
+        self.used = time.time()
+
+    def take(self, start: int, count: int) -> List[dict]:
+        if start > self.position:
+            for _ in islice(self.entries, start - self.position):
+                self.position += 1
+        batch = [e for e in islice(self.entries, count)]
+        self.position += len(batch)
+        self.exhausted = len(batch) < count
+        self.used = time.time()
+        return batch
+
+    def close(self) -> None:
+        try:
+            self.ydl.close()
+        except Exception:
+            pass
+
+
+_cursors: Dict[str, _Cursor] = {}
+# key -> lock held while its cursor is used; dropped with the cursor (see _prune_cursors)
+_cursor_locks: Dict[str, threading.Lock] = {}
+_cursors_lock = threading.Lock()
+
+
+def _prune_cursors(now: float) -> None:
+    """
+    Called with _cursors_lock held: closes cursors idle for CURSOR_TTL and drops per-key locks left
+    without a cursor. A key's lock is taken before its cursor is closed, without waiting (its holder
+    may be waiting for _cursors_lock); a key in use is skipped.
+    """
+    for k in list(_cursor_locks):
+        cur = _cursors.get(k)
+        if cur is not None and now - cur.used <= CURSOR_TTL:
+            continue
+        lock = _cursor_locks[k]
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            if cur is not None:
+                _cursors.pop(k).close()
+            del _cursor_locks[k]
+        finally:
+            lock.release()
+
+
+def _entry_fields(e: dict) -> dict:
+    """Flat entries carry a subset of fields; map them to what the grid reads."""
+    e = dict(e)
+    if not e.get("thumbnail") and e.get("thumbnails"):
+        e["thumbnail"] = (e["thumbnails"][-1] or {}).get("url")
+    if not e.get("webpage_url") and e.get("url", "").startswith("http"):
+        e["webpage_url"] = e["url"]
+    return e
+
+
+def fetch_account_page(url: str, cookie: Optional[str] = None, page: int = 0, page_size: int = PAGE_SIZE) -> Optional[dict]:
+    """
+    One page (0-based) of an account's entries, flat-extracted, via METADATA_CACHE.
+    A live cursor per account continues from where the previous page stopped, so loading page N+1
+    costs one extractor page, not a re-extraction of the whole profile.
+    Returns {"header": {...}, "entries": [...], "has_more": bool}.
+    """
+    base = f"{normalize_url(url)}::cookie={cookie_tag(cookie)}::size={page_size}"
+
+    def _load() -> Optional[dict]:
+        start = page * page_size
+        while True:
+            with _cursors_lock:
+                _prune_cursors(time.time())
+                lock = _cursor_locks.setdefault(base, threading.Lock())
+            with lock:
+                with _cursors_lock:
+                    if _cursor_locks.get(base) is not lock:
+                        continue  # pruned while this thread waited for it: take the current one
+                    cur = _cursors.get(base)
+                with span("extract_page", host=host_of(url)) as fields:
+                    if cur is None or cur.position > start:
+                        # first page, or a page behind the cursor whose cache entry expired: start over
+                        if cur is not None:
+                            cur.close()
+                        cur = _Cursor(url, cookie)
+                        with _cursors_lock:
+                            _cursors[base] = cur
+                    batch = cur.take(start, page_size)
+                    has_more = not cur.exhausted
+                    fields.update(page=page, entries=len(batch))
+            break
+        entries = [_entry_fields(YoutubeDL.sanitize_info(e)) for e in batch if isinstance(e, dict)]
+        return {"header": cur.header, "entries": entries, "has_more": has_more}
+
+    return METADATA_CACHE.get_or_load(f"{base}::page={page}", _load, ttl_for(url))
+
+
+def sync_account(url: str, cookie: Optional[str] = None, max_age: float = 0.0) -> List[dict]:
+    """
+    Incremental sync of a tracked account: pages through its newest entries lazily and stops at the
+    first one already seen or older than the watermark, so extractor calls grow with what was posted
+    since the last sync, not with the size of the account. New entries are recorded as NEW (a first
+    sync records the newest SYNC_FIRST as the SEEN baseline). Returns the account's NEW posts;
+    with max_age, an account synced less than max_age seconds ago is not fetched again.
+    """
+    row = ACCOUNTS.get(url)
+    if row is None:
+        ACCOUNTS.track(url)
+        row = ACCOUNTS.get(url)
+    if max_age and row["last_sync"] and time.time() - row["last_sync"] < max_age:
+        return ACCOUNTS.new_posts(url)
+    first = row["last_sync"] is None
+    seen = ACCOUNTS.seen_ids(url)
+    fresh: List[dict] = []
+    scanned = 0
+    with span("sync", host=host_of(url)) as fields:
+        cur = _Cursor(url, cookie)
+        try:
+            for e in cur.entries:
+                if not isinstance(e, dict):
+                    continue
+                scanned += 1
+                e = _entry_fields(YoutubeDL.sanitize_info(e))
+                if first:
+                    fresh.append(e)
+                    if len(fresh) >= SYNC_FIRST:
+                        break
+                    continue
+                old = str(e.get("id") or e.get("webpage_url") or e.get("url")) in seen or (
+                    e.get("timestamp") and row["newest_ts"] and e["timestamp"] <= row["newest_ts"])
+                if old:
+                    if scanned > SYNC_PINNED:
+                        break
+                    continue
+                fresh.append(e)
+                if len(fresh) >= SYNC_MAX:
+                    break
+        finally:
+            cur.close()
+        fields.update(scanned=scanned, new=0 if first else len(fresh), first=first)
+    if cur.header.get("title") and not row["title"]:
+        ACCOUNTS.track(url, title=cur.header.get("title"), auto_download=bool(row["auto_download"]))
+    ACCOUNTS.record(url, fresh, SEEN if first else NEW)
+    REGISTRY.inc("vd_sync_entries_total", scanned, kind="scanned")
+    REGISTRY.inc("vd_sync_entries_total", 0 if first else len(fresh), kind="new")
+    return ACCOUNTS.new_posts(url)
+
+
+def sync_due(interval: float, max_workers: int = MAX_WORKERS, per_host: int = MAX_PER_HOST) -> Dict[str, List[dict]]:
+    """
+    Syncs every tracked account not synced for interval seconds (0: all of them), at most per_host
+    at a time per site. Returns account URL -> its NEW posts; accounts whose sync failed are left out.
+    """
+    by_host: Dict[str, list] = defaultdict(list)
+    for row in ACCOUNTS.due(interval):
+        by_host[host_of(row["url"])].append(row)
+    # one lane per concurrent sync allowed on a site; each lane works through its accounts in turn
+    lanes = [rows[i::per_host] for rows in by_host.values() for i in range(min(per_host, len(rows)))]
+    out: Dict[str, List[dict]] = {}
+
+    def _lane(rows: list) -> None:
+        for row in rows:
+            cookiefile = row["cookiefile"]
+            cookie = Path(cookiefile).read_text() if cookiefile and Path(cookiefile).exists() else None
+            try:
+                out[row["url"]] = sync_account(row["url"], cookie)
+            except Exception as e:
+                event("sync_failed", url=row["url"], error=str(e)[:300])
+
+    if lanes:
+        with ThreadPoolExecutor(max_workers=min(len(lanes), max(1, max_workers)), thread_name_prefix="sync") as pool:
+            list(pool.map(_lane, lanes))
+    return out
+
+
+def resolve_entries(entries: List[dict], cookie: Optional[str] = None) -> List[dict]:
+    """
+    Fill in title/thumbnail for the entries actually shown when flat extraction left them out.
+    Each entry is extracted (in parallel, cached per entry URL) only if it needs it.
+    """
+    need = [i for i, e in enumerate(entries) if (not e.get("thumbnail") or not e.get("title")) and e.get("webpage_url")]
+    if not need:
+        return entries
+    out = list(entries)
+
+    def _one(i: int) -> None:
+        try:
+            info = extract_metadata(entries[i]["webpage_url"], cookie=cookie, limit_preview=1)
+        except Exception:
+            return
+        if isinstance(info, dict):
+            if "entries" in info:
+                info = (info.get("entries") or [{}])[0]
+            # the resolved info wins: the flat entry only fills in what it lacks, and its "_type": "url"
+            # and "url" (the page, not a format) would make the result unusable as a download's info
+            flat = {k: v for k, v in entries[i].items() if v and k not in ("_type", "url")}
+            out[i] = {**flat, **info}
+
+    with ThreadPoolExecutor(max_workers=min(len(need), MAX_PER_HOST), thread_name_prefix="resolve") as pool:
+        list(pool.map(_one, need))
+    return out
+
+
+def _output_files(info: Optional[dict]) -> List[str]:
+    """
+    Final file paths yt-dlp reports for an extracted (and downloaded) info dict, playlists included.
+    Made absolute: requested_downloads paths are relative to the working directory, MoveFiles' are not.
+    """
+    if not isinstance(info, dict):
+        return []
+    files: List[str] = []
+    for e in info.get("entries") or []:
+        files.extend(_output_files(e))
+    for d in info.get("requested_downloads") or []:
+        if d.get("filepath"):
+            files.append(os.path.abspath(d["filepath"]))
+    if not files and info.get("filepath"):
+        files.append(os.path.abspath(info["filepath"]))
+    return files
+
+
+def formats_fresh(info: Optional[dict], margin: float = EXPIRY_MARGIN) -> bool:
+    """True if info is a resolved video whose signed media URLs will not expire within margin seconds."""
+    if not isinstance(info, dict) or info.get("_type", "video") != "video":
+        return False
+    urls = [f.get("url") for f in info.get("formats") or []] or [info.get("url")]
+    urls = [u for u in urls if u]
+    if not urls:
+        return False
+    deadline = time.time() + margin
+    for u in urls:
+        query = parse_qs(urlsplit(u).query)
+        for name, base in _EXPIRY_PARAMS:
+            if name in query:
+                try:
+                    if int(query[name][0], base) < deadline:
+                        return False
+                except ValueError:
+                    continue
+    return True
+
+
+def reusable_info(url: str, info: Optional[dict], cookie: Optional[str] = None) -> Optional[dict]:
+    """
+    The info dict to start a download from instead of extracting url again: the one given if it is
+    fresh, else a fresh single-item preview of url still in METADATA_CACHE, else None.
+    """
+    if formats_fresh(info):
+        return info
+    cached = METADATA_CACHE.get(metadata_key(url, cookie, 1))
+    if isinstance(cached, dict) and "entries" in cached:
+        cached = (cached.get("entries") or [None])[0]
+    return cached if formats_fresh(cached) else None
+
+
+def _segmented_fetch(ydl: YoutubeDL, info: dict, progress_hooks: List[Callable[[dict], None]]) -> None:
+    """
+    Pre-fetches the format yt-dlp will pick for info with parallel ranges (segmented.py) when it is
+    one large progressive HTTP file; yt-dlp then finds the file on disk and only postprocesses it.
+    Merged or fragmented formats, small files and servers without range support are left to yt-dlp.
+    """
+    if segmented.SEGMENTS < 2 or info.get("_type", "video") != "video":
+        return
+    formats = info.get("formats") or [info]
+    try:
+        selector = ydl.build_format_selector(ydl.params.get("format") or "best")
+        chosen = list(selector({
+            "formats": formats,
+            "has_merged_format": any(f.get("vcodec") != "none" and f.get("acodec") != "none" for f in formats),
+            "incomplete_formats": all(f.get("vcodec") == "none" for f in formats) or all(f.get("acodec") == "none" for f in formats),
+        }))
+    except Exception:
+        return
+    if len(chosen) != 1 or chosen[0].get("requested_formats"):
+        return
+    fmt = chosen[0]
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if fmt.get("protocol") not in ("http", "https") or not fmt.get("url") or (size and size < segmented.MIN_SIZE):
+        return
+    dest = ydl.prepare_filename(dict(info, **fmt))
+    if os.path.exists(dest):
+        return
+    headers = dict(fmt.get("http_headers") or {})
+    cookies = ydl.cookiejar.get_cookie_header(fmt["url"]) if hasattr(ydl.cookiejar, "get_cookie_header") else None
+    if cookies:
+        headers["Cookie"] = cookies
+    try:
+        total = segmented.probe(fmt["url"], headers)
+        if total < segmented.MIN_SIZE:
+            return
+        t0 = time.perf_counter()
+        segmented.download(fmt["url"], dest, headers, total=total, hooks=progress_hooks, info_dict=info)
+        REGISTRY.observe("vd_stage_seconds", time.perf_counter() - t0, stage="download", host=host_of(fmt["url"]))
+    except segmented.SegmentError as e:
+        REGISTRY.inc("vd_segmented_fallbacks_total", host=host_of(fmt["url"]))
+        event("segmented_fallback", url=info.get("webpage_url"), error=str(e)[:300])
+
+
+def _download_one(ydl_opts: dict, url: str, hooks: Optional[ItemHooks] = None, info: Optional[dict] = None,
+                  extra: Optional[dict] = None) -> ItemResult:
+    """extra: fields added to the item's info dict before downloading (e.g. for the output template)."""
+    # a YoutubeDL is borrowed from YDL_POOL for the item: instances are not thread-safe
+    opts = dict(ydl_opts, ignoreerrors=False)
+    # MoveFiles is the last postprocessor: its "finished" event carries each file's final location
+    moved: List[str] = []
+
+    def _moved_hook(d: dict) -> None:
+        if d.get("status") == "finished" and d.get("postprocessor") == "MoveFiles":
+            path = (d.get("info_dict") or {}).get("filepath")
+            if path:
+                moved.append(os.path.abspath(path))
+
+    # per-stage timings: extract = until the first byte, download = yt-dlp's elapsed, postprocess per PP
+    host = host_of(url)
+    t0 = time.perf_counter()
+    marks: Dict[str, float] = {}
+
+    def _timing_hook(d: dict) -> None:
+        status = d.get("status")
+        if status == "downloading" and "first_byte" not in marks:
+            marks["first_byte"] = time.perf_counter()
+            REGISTRY.observe("vd_stage_seconds", marks["first_byte"] - t0, stage="extract", host=host)
+        elif status == "finished":
+            REGISTRY.inc("vd_download_bytes_total", d.get("total_bytes") or d.get("downloaded_bytes") or 0, host=host)
+            if d.get("elapsed"):
+                REGISTRY.observe("vd_stage_seconds", d["elapsed"], stage="download", host=host)
+
+    def _pp_timing_hook(d: dict) -> None:
+        pp = d.get("postprocessor") or "?"
+        if d.get("status") == "started":
+            marks[pp] = time.perf_counter()
+        elif d.get("status") == "finished" and pp in marks:
+            REGISTRY.observe("vd_stage_seconds", time.perf_counter() - marks.pop(pp), stage="postprocess", pp=pp)
+
+    opts["progress_hooks"] = list(opts.get("progress_hooks") or []) + [_timing_hook]
+    opts["postprocessor_hooks"] = list(opts.get("postprocessor_hooks") or []) + [_moved_hook, _pp_timing_hook]
+    if hooks is not None:
+        opts["progress_hooks"] = list(opts.get("progress_hooks") or []) + [hooks.progress_hook]
+        opts["postprocessor_hooks"] = list(opts.get("postprocessor_hooks") or []) + [hooks.postprocessor_hook]
+        hooks.stage(EXTRACT)
+    try:
+        with YDL_POOL.borrow(opts) as ydl:
+            if info is not None and info.get("_type", "video") != "video":
+                info = None  # a playlist (carousel, slideshow): its entries are resolved by a full extraction
+            reused = info is not None
+            if reused:
+                info = YoutubeDL.sanitize_info(info)  # a copy: process_ie_result fills it in
+            elif segmented.SEGMENTS > 1:
+                # resolve first, so a large progressive format can be pre-fetched in segments
+                info = ydl.extract_info(url, download=False)
+                if info.get("_type", "video") != "video":
+                    info = None
+            if info is not None:
+                info.update(extra or {})
+                try:
+                    _segmented_fetch(ydl, info, opts["progress_hooks"])
+                    # same path as --load-info-json: format selection + download, no extractor requests
+                    info = ydl.process_ie_result(info, download=True)
+                except DownloadCancelled:
+                    raise
+                except Exception:
+                    if not reused:
+                        raise
+                    # e.g. a signed URL rejected early: fall back to a full extraction
+                    info = None
+                    reused = False
+            if info is None:
+                info = ydl.extract_info(url, download=True, extra_info=extra)
+    except Exception as e:
+        if hooks is not None:
+            hooks.stage(ERROR, str(e))
+        REGISTRY.inc("vd_items_total", outcome="error", host=host)
+        REGISTRY.inc("vd_errors_total", stage="download")
+        event("item", url=url, outcome="error", error=str(e)[:300], duration_s=round(time.perf_counter() - t0, 4))
+        return ItemResult(url, error=str(e))
+    if hooks is not None:
+        hooks.stage(DONE)
+    REGISTRY.inc("vd_items_total", outcome="ok", host=host)
+    event("item", url=url, outcome="ok", reused=reused, duration_s=round(time.perf_counter() - t0, 4))
+    files = list(dict.fromkeys(moved + _output_files(info)))  # both absolute, so each file is listed once
+    return ItemResult(url, info=info, files=[f for f in files if os.path.isfile(f)])
+
+
+def warm_up() -> None:
+    """Builds the YoutubeDL instances the first preview and the first MP4 download will borrow."""
+    YDL_POOL.warm(preview_opts())
+    YDL_POOL.warm(dict(build_ydl_opts(), ignoreerrors=False))
+
+
+def expand_profile(ydl_opts: dict, url: str) -> List[str]:
+    """Flat-extract an account URL into its entry URLs so they can be downloaded in parallel."""
+    opts = dict(ydl_opts, extract_flat="in_playlist", ignoreerrors=True)
+    with YDL_POOL.borrow(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+    entries = (info or {}).get("entries") or []
+    urls = [e.get("webpage_url") or e.get("url") for e in entries if isinstance(e, dict)]
+    return [u for u in urls if u]
+
+
+def _archive_hit(url: str, variant: str, info: Optional[dict], hooks: Optional[ItemHooks]) -> Optional[ItemResult]:
+    """The archived files of url in this variant as a finished item, None if it must be fetched."""
+    hit = LIBRARY.archived(archive_key(info, variant), url_archive_key(url, variant))
+    REGISTRY.inc("vd_cache_requests_total", cache="archive", result="miss" if hit is None else "hit")
+    if hit is None:
+        return None
+    if hooks is not None:
+        hooks.stage(DONE)
+    event("item", url=url, outcome="ok", archived=True, files=len(hit))
+    return ItemResult(url, info=info, files=hit)
+
+
+def _gather(futures: List[Future]) -> Future:
+    """Future of every result of futures, in order; it fails with the first exception once all are done."""
+    out: Future = Future()
+    left = [len(futures)]
+    lock = threading.Lock()
+
+    def _done(_: Future) -> None:
+        with lock:
+            left[0] -= 1
+            if left[0]:
+                return
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            out.set_exception(errors[0])
+        else:
+            out.set_result([f.result() for f in futures])
+
+    if not futures:
+        out.set_result([])
+    for f in futures:
+        f.add_done_callback(_done)
+    return out
+
+
+def _video_download(known: Dict[str, dict]) -> Callable[..., ItemResult]:
+    """
+    DownloadEngine.map download function for video jobs. A video already downloaded in the same
+    format is returned from the archive without a single request; new downloads are archived.
+    known: url -> an info dict naming the video (stale ones are fine, only extractor and id are used).
+    """
+    def _item(ydl_opts: dict, url: str, hooks: Optional[ItemHooks] = None, info: Optional[dict] = None) -> ItemResult:
+        variant = f"video:{ydl_opts.get('format')}"
+        hit = _archive_hit(url, variant, info or known.get(url), hooks)
+        if hit is not None:
+            return hit
+        r = _download_one(ydl_opts, url, hooks, info)
+        if r.ok and r.files:
+            LIBRARY.archive((archive_key(r.info, variant), url_archive_key(url, variant)), r.files)
+        return r
+    return _item
+
+
+def _audio_download(target: str, quality: int, known: Dict[str, dict]) -> Callable[..., ItemResult]:
+    """
+    DownloadEngine.map download function for audio jobs. Audio already extracted for the same
+    video, format and quality is returned from the archive without downloading; otherwise the source
+    is downloaded and each of its files (a carousel has several) is handed to the transcode pool
+    (ItemResult.pending), so the slot is free while FFmpeg runs.
+    known: url -> an info dict naming the video (stale ones are fine, only extractor and id are used).
+    """
+    def _item(ydl_opts: dict, url: str, hooks: Optional[ItemHooks] = None, info: Optional[dict] = None) -> ItemResult:
+        hit = _archive_hit(url, f"audio:{target}:{quality}", info or known.get(url), hooks)
+        if hit is not None:
+            return hit
+        item = uuid.uuid4().hex
+        r = _download_one(ydl_opts, url, hooks, info, extra={"vd_item": item})
+        if not r.ok or not r.files:
+            return r
+        if hooks is not None:
+            hooks.stage(POSTPROCESS)
+        # only sources this item downloaded into its own directory are removed after extraction
+        own = os.path.abspath(AUDIO_SRC_DIR / item)
+        acodec = (r.info or {}).get("acodec")
+        r.pending = _gather([
+            transcode.submit(src, target, quality, acodec, os.path.abspath(OUT_DIR), os.path.dirname(src) == own)
+            for src in r.files
+        ])
+        if hooks is not None:
+            r.pending.add_done_callback(lambda f: hooks.stage(ERROR, str(f.exception())) if f.exception() else hooks.stage(DONE))
+        return r
+    return _item
+
+
+def _finish_audio(r: ItemResult, target: str, quality: int) -> None:
+    """Waits for r's extraction and swaps the source files for the audio files (or records the error)."""
+    try:
+        converted = r.pending.result()
+    except Exception as e:
+        r.error = f"audio extraction failed: {e}"
+        r.files = []
+    else:
+        for _, mode, seconds in converted:
+            REGISTRY.observe("vd_stage_seconds", seconds, stage="transcode", mode=mode)
+        r.files = [path for path, _, _ in converted]
+        variant = f"audio:{target}:{quality}"
+        LIBRARY.archive((archive_key(r.info, variant), url_archive_key(r.url, variant)), r.files)
+    r.pending = None
+
+
+def _yt_download_worker(ydl_opts, urls: List[str], result_paths: List[str], audio=False, cookie=None, playlist_end=None,
+                        job_id: Optional[str] = None,
+                        infos: Optional[List[Optional[dict]]] = None,
+                        audio_format: str = transcode.DEFAULT_FORMAT, audio_quality: int = transcode.DEFAULT_QUALITY,
+                        on_files: Optional[Callable[[List[str]], None]] = None,
+                        cancelled: Optional[threading.Event] = None):
+    """
+    Run yt-dlp downloads through the shared engine (bounded, parallel).
+    This worker writes the exact files each item produced into result_paths list, and one "__ERROR__:" line per failed item.
+    With a job_id, per-item progress is reported to the PROGRESS registry and the job is marked finished at the end.
+    infos may carry the already-resolved info dict per URL (e.g. from the preview); fresh ones are
+    downloaded without re-extracting.
+    With audio, ydl_opts come from build_ydl_opts(audio=True, audio_format=...) and each download is
+    extracted to audio_format in the transcode pool while the next ones download.
+    on_files, if given, gets each finished item's files as soon as they are final (e.g. to stream a ZIP).
+    Once cancelled is set, items that have not started yet are skipped (running ones are stopped by
+    the caller's progress hook).
+    """
+    def on_result(r: ItemResult) -> None:
+        if r.pending is not None:
+            return  # indexed once its audio is extracted
+        for f in r.files:
+            LIBRARY.add(f)
+        if on_files is not None and r.ok and r.files:
+            on_files(r.files)
+    try:
+        if len(urls) == 1 and _PROFILE_RE.match(urls[0]):
+            # profile/playlist URL: fan its entries out over the pool
+            if playlist_end and isinstance(playlist_end, int) and playlist_end > 0:
+                ydl_opts = dict(ydl_opts, playlistend=playlist_end)
+            urls = expand_profile(ydl_opts, urls[0]) or urls
+            infos = None
+            if job_id:
+                PROGRESS.set_items(job_id, urls)
+        given = [infos[i] if infos and i < len(infos) else None for i in range(len(urls))]
+        infos = [reusable_info(u, given[i], cookie) for i, u in enumerate(urls)]
+        # items already on disk (same video and rendition) are answered from the archive
+        known = {u: given[i] for i, u in enumerate(urls) if isinstance(given[i], dict)}
+        download = _audio_download(audio_format, audio_quality, known) if audio else _video_download(known)
+        results = get_engine().map(ydl_opts, urls, job_id, on_result, infos, download, cancelled)
+        for r in results:
+            if r.pending is not None:
+                _finish_audio(r, audio_format, audio_quality)
+                on_result(r)
+        # only the files this job produced, as reported by yt-dlp (no directory scan)
+        for r in results:
+            if r.ok:
+                result_paths.extend(f for f in r.files if f not in result_paths)
+            else:
+                result_paths.append(f"__ERROR__:{r.url}: {r.error}")
+    except Exception as e:
+        result_paths.append(f"__ERROR__:{e}")
+    finally:
+        if job_id:
+            PROGRESS.finish(job_id)
@@ -0,0 +1,193 @@
+# fileserve.py
+"""
+Small HTTP side-server for finished downloads. Files are looked up by Library token and
+streamed straight from disk with socket.sendfile (chunked send where sendfile is missing).
+HTTP Range is honoured so browsers and download managers can resume. Nothing is read until
+a file is actually requested. Extra GET routes (e.g. /metrics) can be mounted with ``routes``,
+directories of immutable, content-addressed images (thumbnails) with ``mounts``, and bodies
+generated while they are sent (a job's ZIP) with ``streams``.
+"""
+import mimetypes
+import os
+import re
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterable, Optional, Tuple
+from urllib.parse import quote, unquote, urlsplit
+
+from library import Library
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Single byte range -> (start, end) inclusive; None for no/unsupported Range; (-1, -1) if unsatisfiable."""
+    if not header:
+        return None
+    m = _RANGE_RE.match(header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if not m.group(1):  # suffix range: last N bytes
+        n = int(m.group(2))
+        if n == 0 or size == 0:
+            return (-1, -1)
+        return (max(size - n, 0), size - 1)
+    start = int(m.group(1))
+    end = int(m.group(2)) if m.group(2) else size - 1
+    if start >= size or end < start:
+        return (-1, -1)
+    return (start, min(end, size - 1))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "FileServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # quiet; the Streamlit console is noisy enough
+        pass
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def do_GET(self):
+        self._serve(head=False)
+
+    def _serve(self, head: bool) -> None:
+        path = unquote(urlsplit(self.path).path)
+        route = self.server.routes.get(path)
+        if route is not None:
+            content_type, body = route()
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            if not head:
+                self.wfile.write(body)
+            return
+        for prefix, directory in self.server.mounts.items():
+            if path.startswith(prefix):
+                self._serve_mounted(directory, path[len(prefix):], head)
+                return
+        for prefix, stream in self.server.streams.items():
+            if path.startswith(prefix):
+                self._serve_stream(stream(path[len(prefix):]), head)
+                return
+        if not path.startswith("/files/"):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        row = self.server.library.lookup(path[len("/files/"):].split("/", 1)[0])
+        if row is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        try:
+            f = open(row["path"], "rb")
+        except OSError:
+            self.server.library.remove(row["token"])
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        with f:
+            self._send_file(f, row["name"], head, {"Content-Disposition": f"attachment; filename*=UTF-8''{quote(row['name'])}"})
+
+    def _serve_mounted(self, directory: Path, rel: str, head: bool) -> None:
+        root = directory.resolve()
+        target = (root / rel).resolve()
+        image = (mimetypes.guess_type(target.name)[0] or "").startswith("image/")
+        if root not in target.parents or not image or not target.is_file():
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        try:
+            f = open(target, "rb")
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        with f:
+            # mounted files are content-addressed: a name never changes its bytes
+            self._send_file(f, target.name, head, {"Cache-Control": "public, max-age=604800, immutable"})
+
+    def _serve_stream(self, found: Optional[Tuple[str, Iterable[bytes]]], head: bool) -> None:
+        """Sends a generated body chunked: its length is not known until the last chunk."""
+        if found is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        name, chunks = found
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", mimetypes.guess_type(name)[0] or "application/octet-stream")
+        self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(name)}")
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        if head:
+            return
+        try:
+            for chunk in chunks:
+                if chunk:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # client went away; the generator is dropped mid-archive
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+
+    def _send_file(self, f: BinaryIO, name: str, head: bool, extra_headers: Dict[str, str]) -> None:
+        size = os.fstat(f.fileno()).st_size
+        rng = parse_range(self.headers.get("Range"), size)
+        if rng == (-1, -1):
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start, end = rng if rng else (0, size - 1)
+        length = max(end - start + 1, 0)
+        self.send_response(HTTPStatus.PARTIAL_CONTENT if rng else HTTPStatus.OK)
+        self.send_header("Content-Type", mimetypes.guess_type(name)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        for header, value in extra_headers.items():
+            self.send_header(header, value)
+        if rng:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if head or not length:
+            return
+        try:
+            self.wfile.flush()
+            self.connection.sendfile(f, start, length)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client went away (paused / cancelled); it can resume with Range
+
+
+class FileServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        library: Library,
+        host: str = "0.0.0.0",
+        port: int = 8502,
+        routes: Optional[Dict[str, Callable[[], Tuple[str, bytes]]]] = None,
+        mounts: Optional[Dict[str, Path]] = None,
+        streams: Optional[Dict[str, Callable[[str], Optional[Tuple[str, Iterable[bytes]]]]]] = None,
+    ):
+        super().__init__((host, port), _Handler)
+        self.library = library
+        # path -> fn() returning (content type, body)
+        self.routes = dict(routes or {})
+        # URL prefix ("/thumbs/") -> directory served below it
+        self.mounts = {prefix: Path(d) for prefix, d in (mounts or {}).items()}
+        # URL prefix ("/zip/") -> fn(rest of the path) returning (download name, body chunks), or None (404)
+        self.streams = dict(streams or {})
+
+    def start(self) -> "FileServer":
+        threading.Thread(target=self.serve_forever, name="file-server", daemon=True).start()
+        return self
+
+
+def file_url(base_url: str, token: str, name: str) -> str:
+    # the trailing name is cosmetic (browsers show it); only the token is used for lookup
+    return f"{base_url.rstrip('/')}/files/{token}/{quote(name)}"
@@ -0,0 +1,423 @@
+# jobqueue.py
+"""
+Durable download queue. Jobs live in SQLite and are executed by a fixed pool of worker
+processes, so they outlive Streamlit reruns, closed tabs and app restarts, and the number of
+jobs running on the server is capped at the pool size.
+
+Pages call submit() / status() / cancel() / result(); workers claim() jobs and write progress
+snapshots back into the row. Interactive jobs are claimed before bulk ones and, within a class,
+the session with the fewest running jobs goes first; set_weight() changes a job's bandwidth
+share (bandwidth.py) while it runs. Run ``python jobqueue.py`` to serve the queue from a separate process
+(set VD_QUEUE_EXTERNAL=1 so the app does not start its own pool).
+
+Workers are started as ``python jobqueue.py --worker``, not with multiprocessing: its spawn start
+method re-imports the parent's __main__, which under ``streamlit run`` is the app script itself.
+"""
+import argparse
+import atexit
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from bandwidth import BULK, INTERACTIVE, PRIORITY_WEIGHTS
+from metrics import REGISTRY, event, start_dump
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+TERMINAL = (DONE, FAILED, CANCELLED)
+
+QUEUE_WORKERS = int(os.environ.get("VD_QUEUE_WORKERS", "2"))
+POLL_INTERVAL = 0.5
+PROGRESS_INTERVAL = 1.0
+MAX_ATTEMPTS = 3
+# a running job's worker refreshes its heartbeat with every progress snapshot; a job silent for this
+# long belongs to a dead (OOM-killed, restarted) worker. PIDs are not used: they are reused after restarts.
+HEARTBEAT_TIMEOUT = 30.0
+WATCH_INTERVAL = 5.0
+# finished jobs (their progress and result) are deleted this long after they ended; files stay
+JOB_RETENTION = float(os.environ.get("VD_JOB_RETENTION_DAYS", "7")) * 86400
+
+
+class JobQueue:
+    """One connection per process; every method is safe to call from any thread."""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, state TEXT NOT NULL, payload TEXT NOT NULL,"
+            " created REAL NOT NULL, started REAL, finished REAL,"
+            " worker INTEGER, attempts INTEGER NOT NULL DEFAULT 0, cancel INTEGER NOT NULL DEFAULT 0,"
+            " progress TEXT, result TEXT, error TEXT)"
+        )
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column, ddl in (("session", "TEXT"), ("priority", f"TEXT NOT NULL DEFAULT '{BULK}'"), ("weight", "REAL NOT NULL DEFAULT 1"),
+                            ("heartbeat", "REAL")):
+            if column not in columns:  # databases created before these columns existed
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {ddl}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created)")
+
+    # --------- client side ----------
+    def submit(self, payload: dict, session: Optional[str] = None, priority: str = BULK) -> str:
+        """priority: INTERACTIVE (a single item someone is waiting for) or BULK (accounts, selections)."""
+        job_id = uuid.uuid4().hex[:16]
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, state, payload, created, session, priority) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(payload, default=str), time.time(), session or job_id,
+                 priority if priority in PRIORITY_WEIGHTS else BULK),
+            )
+        return job_id
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """State, timestamps, latest progress snapshot and, for queued jobs, the queue position (1-based)."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, state, created, started, finished, attempts, cancel, progress, error, priority, weight"
+                " FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            out = dict(row)
+            out["progress"] = json.loads(out["progress"]) if out["progress"] else None
+            if out["state"] == QUEUED:
+                # interactive jobs are claimed first (session fairness is left out of the estimate)
+                out["position"] = self._db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE state = ? AND"
+                    " ((priority = ? AND ? != ?) OR (priority = ? AND created <= ?))",
+                    (QUEUED, INTERACTIVE, out["priority"], INTERACTIVE, out["priority"], out["created"]),
+                ).fetchone()[0]
+        return out
+
+    def result(self, job_id: str) -> Optional[dict]:
+        """{"files": [...], "errors": [...], "zip_name": name|None} once the job is done/failed, else None."""
+        with self._lock:
+            row = self._db.execute("SELECT state, result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["state"] not in TERMINAL or not row["result"]:
+            return None
+        return json.loads(row["result"])
+
+    def payload(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row["payload"]) if row else None
+
+    def iter_files(self, job_id: str, poll: float = PROGRESS_INTERVAL) -> Iterator[str]:
+        """
+        The job's output files as they finish (its progress snapshots list them while it runs), then
+        the rest of its result; blocks between them, so iter_zip can send a ZIP of a running job.
+        """
+        sent = set()
+        while True:
+            status = self.status(job_id)
+            ended = status is None or status["state"] in TERMINAL
+            if ended:
+                files = (self.result(job_id) or {}).get("files") or []
+            else:
+                files = (status["progress"] or {}).get("files") or []
+            for f in files:
+                if f not in sent:
+                    sent.add(f)
+                    yield f
+            if ended:
+                return
+            time.sleep(poll)
+
+    def cancel(self, job_id: str) -> None:
+        """Queued jobs are cancelled at once; running ones stop at their next progress callback."""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = ?, finished = ?, cancel = 1 WHERE id = ? AND state = ?",
+                (CANCELLED, now, job_id, QUEUED),
+            )
+            self._db.execute("UPDATE jobs SET cancel = 1 WHERE id = ? AND state = ?", (job_id, RUNNING))
+
+    def set_weight(self, job_id: str, weight: float) -> None:
+        """The job's bandwidth share relative to its session's other jobs (1 = normal); applies while it runs."""
+        with self._lock:
+            self._db.execute("UPDATE jobs SET weight = ? WHERE id = ?", (max(0.01, float(weight)), job_id))
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {state: n for state, n in rows}
+
+    # --------- worker side ----------
+    def claim(self, worker: int) -> Optional[dict]:
+        """
+        Atomically moves the next queued job to running for this worker: interactive before bulk,
+        then the session with the fewest running jobs, then the oldest.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id, payload, created, session, priority, weight FROM jobs AS j WHERE state = ?"
+                    " ORDER BY priority != ?,"
+                    " (SELECT COUNT(*) FROM jobs AS r WHERE r.state = ? AND r.session = j.session), created LIMIT 1",
+                    (QUEUED, INTERACTIVE, RUNNING),
+                ).fetchone()
+                if row is not None:
+                    now = time.time()
+                    self._db.execute(
+                        "UPDATE jobs SET state = ?, started = ?, heartbeat = ?, worker = ?, attempts = attempts + 1 WHERE id = ?",
+                        (RUNNING, now, now, worker, row["id"]),
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        REGISTRY.observe("vd_stage_seconds", time.time() - row["created"], stage="queue_wait")
+        return {
+            "id": row["id"], "payload": json.loads(row["payload"]),
+            "session": row["session"] or row["id"], "priority": row["priority"], "weight": row["weight"],
+        }
+
+    def cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            row = self._db.execute("SELECT cancel FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel"])
+
+    def weight(self, job_id: str) -> float:
+        with self._lock:
+            row = self._db.execute("SELECT weight FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["weight"] if row else 1.0
+
+    def set_progress(self, job_id: str, snapshot: Optional[dict]) -> None:
+        """Stores the snapshot and refreshes the job's heartbeat (see requeue_orphans)."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET progress = ?, heartbeat = ? WHERE id = ?",
+                (json.dumps(snapshot, default=str), time.time(), job_id),
+            )
+
+    def finish(self, job_id: str, state: str, result: dict, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = ?, finished = ?, result = ?, error = ? WHERE id = ?",
+                (state, time.time(), json.dumps(result, default=str), error, job_id),
+            )
+
+    def requeue_orphans(self, timeout: float = HEARTBEAT_TIMEOUT) -> int:
+        """
+        Running jobs without a heartbeat for timeout seconds (their worker crashed, was killed or
+        restarted) go back to the queue, or fail after MAX_ATTEMPTS.
+        """
+        with self._lock:
+            orphans = self._db.execute(
+                "SELECT id, attempts FROM jobs WHERE state = ? AND COALESCE(heartbeat, started, 0) < ?",
+                (RUNNING, time.time() - timeout),
+            ).fetchall()
+            for r in orphans:
+                if r["attempts"] >= MAX_ATTEMPTS:
+                    self._db.execute(
+                        "UPDATE jobs SET state = ?, finished = ?, error = ? WHERE id = ?",
+                        (FAILED, time.time(), "worker died too many times", r["id"]),
+                    )
+                else:
+                    self._db.execute("UPDATE jobs SET state = ?, worker = NULL WHERE id = ?", (QUEUED, r["id"]))
+        if orphans:
+            event("jobs_requeued", jobs=[r["id"] for r in orphans])
+        return len(orphans)
+
+    def prune(self, max_age: float = JOB_RETENTION) -> int:
+        """Deletes done, failed and cancelled jobs that ended more than max_age seconds ago."""
+        with self._lock:
+            pruned = self._db.execute(
+                "DELETE FROM jobs WHERE state IN (?, ?, ?) AND finished < ?", (*TERMINAL, time.time() - max_age),
+            ).rowcount
+        if pruned:
+            event("jobs_pruned", jobs=pruned)
+        return pruned
+
+
+def run_job(queue: JobQueue, job: dict) -> None:
+    """Executes one claimed job in this process and records its outcome."""
+    # imported here so the client side (the Streamlit pages) does not pay for yt-dlp in this module
+    from yt_dlp.utils import DownloadCancelled
+
+    from downloader import BANDWIDTH, _yt_download_worker, build_ydl_opts
+    from progress import PROGRESS
+    from transcode import DEFAULT_FORMAT, DEFAULT_QUALITY
+
+    job_id, p = job["id"], job["payload"]
+    urls: List[str] = p["urls"]
+    t0 = time.perf_counter()
+    cancelled = threading.Event()
+
+    def _cancel_hook(d: dict) -> None:
+        if cancelled.is_set():
+            raise DownloadCancelled("cancelled")
+
+    audio_format = p.get("audio_format") or DEFAULT_FORMAT
+    ydl_opts = build_ydl_opts(p.get("audio", False), p.get("cookiefile"), p.get("fragments"), audio_format)
+    # every download of the job draws from one bandwidth flow, shared fairly with other sessions' jobs
+    flow = BANDWIDTH.flow(job_id, job.get("session") or job_id, job.get("priority") or BULK, job.get("weight") or 1.0)
+    ydl_opts["progress_hooks"] = [_cancel_hook, flow.progress_hook]
+    cookie = Path(p["cookiefile"]).read_text() if p.get("cookiefile") and Path(p["cookiefile"]).exists() else None
+    result_paths: List[str] = []
+    # files of finished items, published with each progress snapshot (see JobQueue.iter_files)
+    finished: List[str] = []
+    local_id = PROGRESS.create(urls)
+
+    def _snapshot() -> Optional[dict]:
+        snap = PROGRESS.snapshot(local_id)
+        if snap is not None:
+            snap["files"] = list(finished)
+        return snap
+
+    worker = threading.Thread(
+        target=_yt_download_worker,
+        args=(ydl_opts, urls, result_paths, p.get("audio", False), cookie, p.get("playlist_end")),
+        kwargs={
+            "job_id": local_id, "infos": p.get("infos"), "on_files": finished.extend, "cancelled": cancelled,
+            "audio_format": audio_format, "audio_quality": p.get("audio_quality") or DEFAULT_QUALITY,
+        },
+        daemon=True,
+    )
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(PROGRESS_INTERVAL)
+            queue.set_progress(job_id, _snapshot())
+            if not cancelled.is_set() and queue.cancel_requested(job_id):
+                cancelled.set()
+            if BANDWIDTH.enabled:
+                flow.set_weight(queue.weight(job_id))
+    finally:
+        flow.close()
+    queue.set_progress(job_id, _snapshot())
+
+    files = [f for f in result_paths if not f.startswith("__ERROR__")]
+    errors = [f for f in result_paths if f.startswith("__ERROR__")]
+    # the ZIP is not written: the file server streams it from these files (see zipstream.iter_zip)
+    zip_name = None
+    if p.get("zip_stem") and files:
+        zip_name = p.get("zip_name") or f"{p['zip_stem']}_selected_{int(time.time())}.zip"
+    result = {"files": files, "errors": errors, "zip_name": zip_name}
+    if cancelled.is_set():
+        state = CANCELLED
+    else:
+        state = DONE if files or not errors else FAILED
+    queue.finish(job_id, state, result, errors[0] if errors and not files else None)
+    duration = time.perf_counter() - t0
+    REGISTRY.inc("vd_jobs_total", state=state)
+    REGISTRY.observe("vd_stage_seconds", duration, stage="job")
+    event("job", job=job_id, state=state, items=len(urls), files=len(files), errors=len(errors), duration_s=round(duration, 4))
+
+
+def _worker_main(db_path: str, parent: Optional[int] = None) -> None:
+    """Claims and runs jobs until the process that started this worker (parent, a pid) is gone."""
+    from downloader import METRICS_DIR, warm_up
+
+    start_dump(METRICS_DIR)
+    warm_up()
+    queue = JobQueue(Path(db_path))
+    pid = os.getpid()
+    while parent is None or os.getppid() == parent:
+        job = queue.claim(pid)
+        if job is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        try:
+            run_job(queue, job)
+        except Exception as e:
+            queue.finish(job["id"], FAILED, {"files": [], "errors": [f"__ERROR__:{e}"], "zip_name": None}, str(e))
+
+
+class WorkerPool:
+    """Fixed number of worker processes serving one queue database."""
+
+    def __init__(self, db_path: Path, processes: int = QUEUE_WORKERS):
+        self.db_path = Path(db_path)
+        self.processes = max(1, processes)
+        self._procs: List[subprocess.Popen] = []
+        self._lock = threading.Lock()
+        self._queue = JobQueue(self.db_path)
+        self._watcher: Optional[threading.Thread] = None
+        atexit.register(self.stop)
+
+    def ensure_running(self) -> "WorkerPool":
+        """
+        Starts missing workers (first call, or after one died), requeues jobs of dead workers and
+        prunes old finished jobs.
+        """
+        with self._lock:
+            self._procs = [p for p in self._procs if p.poll() is None]
+            self._queue.requeue_orphans()
+            self._queue.prune()
+            while len(self._procs) < self.processes:
+                # a fresh interpreter running this file (see the module docstring); it inherits cwd and env
+                self._procs.append(subprocess.Popen([
+                    sys.executable, str(Path(__file__).resolve()), "--worker",
+                    "--db", str(self.db_path), "--parent", str(os.getpid()),
+                ]))
+        return self
+
+    def watch(self, interval: float = WATCH_INTERVAL) -> "WorkerPool":
+        """Calls ensure_running() every interval seconds from a daemon thread (once per pool)."""
+        def _loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.ensure_running()
+                except Exception as e:
+                    event("worker_pool_error", error=str(e)[:300])
+
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=_loop, name="worker-pool-watch", daemon=True)
+                self._watcher.start()
+        return self
+
+    def stop(self) -> None:
+        """Terminates the workers; their running jobs are requeued once their heartbeat is stale."""
+        with self._lock:
+            for proc in self._procs:
+                if proc.poll() is None:
+                    proc.terminate()
+            for proc in self._procs:
+                try:
+                    proc.wait(5)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+            self._procs = []
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from downloader import STATE_DIR
+
+    parser = argparse.ArgumentParser(description="Serve the download queue with a pool of worker processes.")
+    parser.add_argument("--workers", type=int, default=QUEUE_WORKERS)
+    parser.add_argument("--db", default=str(STATE_DIR / "jobs.sqlite"))
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)  # one worker, started by WorkerPool
+    parser.add_argument("--parent", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker:
+        _worker_main(args.db, args.parent)
+        return
+    WorkerPool(Path(args.db), args.workers).ensure_running().watch()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
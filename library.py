@@ -0,0 +1,186 @@
+# library.py
+"""
+Index of files in the downloads folder (SQLite). Pages list recent files from here instead of
+sorting the directory, and files are served by an opaque token rather than by path.
+
+The download archive maps a video in a given rendition (extractor + id + format or audio
+settings) to the files already downloaded for it (one per carousel or slideshow entry), so a
+repeat request reuses them.
+"""
+import hashlib
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from metacache import normalize_url
+
+
+def archive_key(info: Optional[dict], variant: str) -> Optional[str]:
+    """Archive key of the video info names (a stale or flat entry is fine), None without an id."""
+    if not isinstance(info, dict) or not info.get("id"):
+        return None
+    extractor = info.get("extractor_key") or info.get("ie_key") or info.get("extractor") or ""
+    return f"{extractor.lower()}:{info['id']}:{variant}"
+
+
+def url_archive_key(url: str, variant: str) -> str:
+    """Secondary key for requests that come with a bare URL (no info dict to take the id from)."""
+    return f"url:{normalize_url(url)}:{variant}"
+
+
+def file_sha256(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def _unchanged(path: str, size: int, mtime: float) -> bool:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return st.st_size == size and st.st_mtime == mtime
+
+
+class Library:
+    def __init__(self, db_path: Path, out_dir: Optional[Path] = None):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        fresh = self._db.execute("SELECT name FROM sqlite_master WHERE name = 'files'").fetchone() is None
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " token TEXT PRIMARY KEY, path TEXT NOT NULL UNIQUE, name TEXT NOT NULL,"
+            " size INTEGER NOT NULL, mtime REAL NOT NULL, added REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS files_added ON files (added)")
+        # one row per (key, file); rowid order is the item's file order
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS archive_files ("
+            " key TEXT NOT NULL, path TEXT NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL,"
+            " sha256 TEXT NOT NULL, added REAL NOT NULL, PRIMARY KEY (key, path))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS archive_files_path ON archive_files (path)")
+        self._migrate_archive()
+        if fresh and out_dir is not None and Path(out_dir).is_dir():
+            # one-time import of whatever was downloaded before the index existed
+            for p in sorted(Path(out_dir).iterdir(), key=lambda p: p.stat().st_mtime):
+                if p.is_file() and not p.name.endswith(".part"):
+                    self.add(str(p), added=p.stat().st_mtime)
+
+    def _migrate_archive(self) -> None:
+        """Moves the one-file-per-key archive table of earlier versions into archive_files."""
+        self._db.execute("BEGIN IMMEDIATE")  # another process may be migrating the same database
+        try:
+            if self._db.execute("SELECT name FROM sqlite_master WHERE name = 'archive'").fetchone() is not None:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO archive_files (key, path, size, mtime, sha256, added)"
+                    " SELECT key, path, size, mtime, sha256, added FROM archive"
+                )
+                self._db.execute("DROP TABLE archive")
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def add(self, path: str, added: Optional[float] = None) -> Optional[str]:
+        """Registers (or refreshes) a finished file; returns its token, None if it does not exist."""
+        p = Path(path).resolve()
+        try:
+            st = p.stat()
+        except OSError:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT token FROM files WHERE path = ?", (str(p),)).fetchone()
+            token = row["token"] if row else secrets.token_urlsafe(16)
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (token, path, name, size, mtime, added) VALUES (?, ?, ?, ?, ?, ?)",
+                (token, str(p), p.name, st.st_size, st.st_mtime, added or time.time()),
+            )
+        return token
+
+    def token_for(self, path: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT token FROM files WHERE path = ?", (str(Path(path).resolve()),)).fetchone()
+        return row["token"] if row else self.add(path)
+
+    def lookup(self, token: str) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self._db.execute("SELECT * FROM files WHERE token = ?", (token,)).fetchone()
+
+    def remove(self, token: str) -> None:
+        with self._lock:
+            row = self._db.execute("SELECT path FROM files WHERE token = ?", (token,)).fetchone()
+            self._db.execute("DELETE FROM files WHERE token = ?", (token,))
+            if row:
+                # the whole entry: an item missing one of its files is not in the archive
+                self._db.execute(
+                    "DELETE FROM archive_files WHERE key IN (SELECT key FROM archive_files WHERE path = ?)", (row["path"],)
+                )
+
+    def recent(self, limit: int = 6) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._db.execute("SELECT * FROM files ORDER BY added DESC LIMIT ?", (limit,)).fetchall()
+
+    # --------- download archive ----------
+    def archived(self, *keys: Optional[str]) -> Optional[List[str]]:
+        """
+        Paths of the files archived under the first matching key, in download order. An entry any of
+        whose files is gone or has changed since (size / mtime) is dropped as a whole; the files'
+        contents are not re-hashed.
+        """
+        with self._lock:
+            for k in keys:
+                if k is None:
+                    continue
+                rows = self._db.execute(
+                    "SELECT path, size, mtime FROM archive_files WHERE key = ? ORDER BY rowid", (k,)
+                ).fetchall()
+                if not rows:
+                    continue
+                if all(_unchanged(r["path"], r["size"], r["mtime"]) for r in rows):
+                    return [r["path"] for r in rows]
+                self._db.execute("DELETE FROM archive_files WHERE key = ?", (k,))
+        return None
+
+    def archive(self, keys: Iterable[Optional[str]], paths: List[str]) -> None:
+        """
+        Records paths (size, mtime, SHA-256 of each) as the files of every non-None key, replacing
+        what the key had, and indexes them. Nothing is recorded if one of them cannot be read.
+        """
+        keys = [k for k in keys if k is not None]
+        if not keys or not paths:
+            return
+        files = []
+        try:
+            for path in paths:
+                p = Path(path).resolve()
+                st = p.stat()
+                files.append((str(p), st.st_size, st.st_mtime, file_sha256(str(p))))
+        except OSError:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany("DELETE FROM archive_files WHERE key = ?", [(k,) for k in keys])
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO archive_files (key, path, size, mtime, sha256, added) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(k, *f, now) for k in keys for f in files],
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        for f in files:
+            self.add(f[0])
+
+    def archive_stats(self) -> dict:
+        with self._lock:
+            row = self._db.execute("SELECT COUNT(DISTINCT key), COUNT(DISTINCT path) FROM archive_files").fetchone()
+        return {"keys": row[0], "files": row[1]}
@@ -0,0 +1,211 @@
+# metacache.py
+"""
+Process-wide cache for extractor results, shared by every session and persisted in SQLite.
+Entries expire per extractor (TTL by host) and are evicted least-recently-used once the
+entry-count or byte budget is exceeded. Concurrent misses on one key run a single load.
+A miss in memory reads through to SQLite, so entries another process (the app, a queue worker)
+stored since this one started are found too.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# seconds an extracted result stays fresh, by host (media URLs in it expire on the CDN side)
+EXTRACTOR_TTL = {
+    "tiktok.com": 15 * 60,
+    "instagram.com": 15 * 60,
+    "youtube.com": 3 * 3600,
+    "youtu.be": 3 * 3600,
+}
+DEFAULT_TTL = 3600
+
+# share/tracking parameters that do not change what the extractor returns
+_TRACKING_PARAMS = {"igshid", "igsh", "is_from_webapp", "sender_device", "is_copy_url", "_r", "_t", "si", "feature", "fbclid"}
+
+
+def _host(netloc: str) -> str:
+    host = netloc.lower().split("@")[-1]
+    host = host[:host.find("]") + 1] if host.startswith("[") else host.split(":")[0]  # [IPv6] keeps its colons
+    for prefix in ("www.", "m.", "vm."):
+        if host.startswith(prefix):
+            return host[len(prefix):]
+    return host
+
+
+def normalize_url(url: str) -> str:
+    """
+    Canonical form used as cache key: lowercase host without www./m. (an explicit non-default port
+    is kept), no fragment, no tracking params, no trailing slash.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url.strip()
+    scheme = parts.scheme.lower() or "https"
+    netloc = _host(parts.netloc)
+    if port and port != {"http": 80, "https": 443}.get(scheme):
+        netloc = f"{netloc}:{port}"
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k not in _TRACKING_PARAMS and not k.startswith("utm_")
+    )
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((scheme, netloc, path, urlencode(query), ""))
+
+
+def ttl_for(url: str) -> int:
+    host = _host(urlsplit(url).netloc)
+    for domain, ttl in EXTRACTOR_TTL.items():
+        if host == domain or host.endswith("." + domain):
+            return ttl
+    return DEFAULT_TTL
+
+
+def cookie_tag(cookie: Optional[str]) -> str:
+    """Results depend on whose cookie was used; key on a digest, never the cookie itself."""
+    return hashlib.sha256(cookie.encode()).hexdigest()[:16] if cookie else "-"
+
+
+class MetadataCache:
+    """LRU + TTL cache of JSON-serialisable values; values are shared, treat them as read-only."""
+
+    def __init__(self, db_path: Optional[Path] = None, max_entries: int = 2000, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> (value, expires_at, size)
+        self._entries: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: Dict[str, Future] = {}
+        self.hits = self.misses = self.evictions = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path is not None:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._load()
+
+    def _load(self) -> None:
+        now = time.time()
+        self._db.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+        rows = self._db.execute("SELECT key, value, expires FROM entries ORDER BY accessed").fetchall()
+        for key, blob, expires in rows:
+            try:
+                self._insert(key, json.loads(blob), expires, len(blob))
+            except ValueError:
+                continue
+        self._evict()
+
+    def _insert(self, key: str, value: Any, expires: float, size: int) -> None:
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[2]
+        self._entries[key] = (value, expires, size)
+        self._bytes += size
+
+    def _evict(self) -> None:
+        dropped = []
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            key, (_, _, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            dropped.append((key,))
+        if dropped and self._db is not None:
+            self._db.executemany("DELETE FROM entries WHERE key = ?", dropped)
+
+    def _read_through(self, key: str) -> Optional[Tuple[Any, float, int]]:
+        """key's unexpired entry in SQLite, moved into memory; None if there is none."""
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT value, expires FROM entries WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+        if row is None:
+            return None
+        try:
+            value = json.loads(row[0])
+        except ValueError:
+            return None
+        self._insert(key, value, row[1], len(row[0]))
+        self._evict()
+        return self._entries.get(key)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            now = time.time()
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                self._entries.pop(key)
+                self._bytes -= entry[2]
+                if self._db is not None:
+                    # only if still expired there: another process may have stored a fresh value
+                    self._db.execute("DELETE FROM entries WHERE key = ? AND expires <= ?", (key, now))
+                entry = None
+            if entry is None:
+                entry = self._read_through(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, value: Any, ttl: float) -> None:
+        blob = json.dumps(value, default=str)
+        expires = time.time() + ttl
+        with self._lock:
+            self._insert(key, value, expires, len(blob))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                    (key, blob, expires, time.time()),
+                )
+            self._evict()
+
+    def get_or_load(self, key: str, loader: Callable[[], Any], ttl: float) -> Any:
+        """
+        Cached value for key, else loader() — run once even if many sessions miss at the same time.
+        Loader exceptions reach every waiter and nothing is cached; a None result is not cached either.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+        if not owner:
+            return fut.result()
+        try:
+            value = loader()
+            if value is not None:
+                self.put(key, value, ttl)
+            fut.set_result(value)
+            return value
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "inflight": len(self._inflight),
+            }
@@ -0,0 +1,249 @@
+# metrics.py
+"""
+Counters, gauges and per-stage timing histograms, exported in Prometheus text format or JSON,
+plus a structured (JSON lines) event log.
+
+Every process (the app and each queue worker) keeps its own REGISTRY and, once start_dump()
+is called, writes it to <dir>/<pid>.json every few seconds; the /metrics endpoint merges the
+live registry with the other processes' dumps. Counters and histograms of every dump are summed;
+gauges only from dumps fresh enough to belong to a live process, and gauges read from a shared
+database are left out of the dumps and reported once by the serving process.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, float("inf"))
+DUMP_INTERVAL = 5.0
+LIVE_DUMP = 3 * DUMP_INTERVAL  # gauges of an older dump (a dead or restarted process's) are not merged
+STALE_DUMP = 86400  # dumps of dead processes are dropped after a day
+STALE_LOG = 7 * 86400  # event logs of processes gone for a week are deleted
+
+log = logging.getLogger("vd")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def key(name: str, **labels) -> Tuple[str, Labels]:
+    """Metric key as returned by collectors."""
+    return (name, _labels(labels))
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[Tuple[str, Labels], float] = {}
+        # (name, labels) -> [bucket counts..., sum, count]
+        self._hists: Dict[Tuple[str, Labels], List[float]] = {}
+        # (fn, shared)
+        self._collectors: List[Tuple[Callable[[], Dict[Tuple[str, Labels], float]], bool]] = []
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[(name, _labels(labels))] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = [0.0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def collector(self, fn: Callable[[], Dict[Tuple[str, Labels], float]], shared: bool = False) -> None:
+        """
+        fn() -> {key(name, **labels): value}, evaluated on every export (cache sizes, queue depth...).
+        Names ending in _total are exported as counters, everything else as gauges.
+        shared: fn reads state every process sees (a shared database), so it is only evaluated for
+        this process's own export, never written to its dump, and counted once however many run.
+        """
+        with self._lock:
+            self._collectors.append((fn, shared))
+
+    def snapshot(self, shared: bool = True) -> dict:
+        """shared=False leaves out shared collectors (for dumps)."""
+        with self._lock:
+            collectors = [fn for fn, is_shared in self._collectors if shared or not is_shared]
+            gauges = dict(self._gauges)
+            counters = dict(self._counters)
+            hists = {k: list(v) for k, v in self._hists.items()}
+        for fn in collectors:
+            try:
+                for k, value in fn().items():
+                    (counters if k[0].endswith("_total") else gauges)[k] = value
+            except Exception:
+                continue
+        enc = lambda d: [[name, dict(labels), value] for (name, labels), value in d.items()]
+        return {"counters": enc(counters), "gauges": enc(gauges), "histograms": enc(hists), "buckets": list(BUCKETS[:-1])}
+
+
+REGISTRY = Registry()
+
+
+@contextmanager
+def span(stage: str, **labels) -> Iterator[dict]:
+    """
+    Times a stage into vd_stage_seconds{stage=...} and logs it. The yielded dict can carry extra
+    fields for the log line (bytes, url...). Exceptions are counted in vd_errors_total and re-raised.
+    """
+    fields: dict = {}
+    t0 = time.perf_counter()
+    try:
+        yield fields
+    except BaseException as e:
+        REGISTRY.inc("vd_errors_total", stage=stage)
+        fields["error"] = str(e)[:300]
+        raise
+    finally:
+        duration = time.perf_counter() - t0
+        REGISTRY.observe("vd_stage_seconds", duration, stage=stage, **labels)
+        event(stage, duration_s=round(duration, 4), **labels, **fields)
+
+
+def event(name: str, **fields) -> None:
+    """One structured log line (JSON) on the "vd" logger."""
+    if log.isEnabledFor(logging.INFO):
+        log.info(json.dumps({"ts": round(time.time(), 3), "event": name, "pid": os.getpid(), **fields}, default=str))
+
+
+def setup_logging(directory: Path) -> None:
+    """
+    JSON-lines event log at <directory>/<pid>.log, rotated at 20 MB; idempotent. One file per process,
+    like the metric dumps: RotatingFileHandler is not safe across processes sharing a file.
+    """
+    if any(getattr(h, "_vd_events", None) == os.getpid() for h in log.handlers):
+        return
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    now = time.time()
+    for f in directory.glob("*.log*"):
+        try:
+            if now - f.stat().st_mtime > STALE_LOG:
+                f.unlink()
+        except OSError:
+            continue
+    for h in [h for h in log.handlers if getattr(h, "_vd_events", None)]:
+        log.removeHandler(h)  # inherited by a forked child: that file is the parent's
+    handler = logging.handlers.RotatingFileHandler(directory / f"{os.getpid()}.log", maxBytes=20 * 1024 * 1024, backupCount=3)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    handler._vd_events = os.getpid()
+    log.addHandler(handler)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+
+# --------- cross-process dumps ----------
+_dump_started = False
+_dump_lock = threading.Lock()
+
+
+def start_dump(directory: Path, interval: float = DUMP_INTERVAL) -> None:
+    """Background thread writing this process's snapshot to <directory>/<pid>.json; idempotent."""
+    global _dump_started
+    with _dump_lock:
+        if _dump_started:
+            return
+        _dump_started = True
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    target = directory / f"{os.getpid()}.json"
+
+    def _loop():
+        while True:
+            time.sleep(interval)
+            try:
+                tmp = target.with_suffix(".tmp")
+                tmp.write_text(json.dumps(REGISTRY.snapshot(shared=False)))
+                tmp.replace(target)
+            except OSError:
+                pass
+
+    threading.Thread(target=_loop, name="metrics-dump", daemon=True).start()
+
+
+def collect(directory: Optional[Path] = None) -> dict:
+    """
+    This process's live metrics merged with the other processes' latest dumps. A dump older than
+    LIVE_DUMP adds its counters and histograms (they are totals) but not its gauges (queue depth,
+    items in flight... of a process that is gone).
+    """
+    snaps = [REGISTRY.snapshot()]
+    if directory is not None and Path(directory).is_dir():
+        now = time.time()
+        for f in Path(directory).glob("*.json"):
+            if f.stem == str(os.getpid()):
+                continue
+            try:
+                age = now - f.stat().st_mtime
+                if age > STALE_DUMP:
+                    f.unlink()
+                    continue
+                snap = json.loads(f.read_text())
+            except (OSError, ValueError):
+                continue
+            if age > LIVE_DUMP:
+                snap["gauges"] = []
+            snaps.append(snap)
+    merged: Dict[str, Dict[Tuple[str, Labels], object]] = {"counters": {}, "gauges": {}, "histograms": {}}
+    for snap in snaps:
+        for kind in merged:
+            for name, labels, value in snap.get(kind, []):
+                key = (name, _labels(labels))
+                if kind == "histograms":
+                    cur = merged[kind].get(key)
+                    merged[kind][key] = [a + b for a, b in zip(cur, value)] if cur else list(value)
+                else:
+                    merged[kind][key] = merged[kind].get(key, 0) + value
+    return {
+        kind: [[name, dict(labels), value] for (name, labels), value in sorted(items.items())]
+        for kind, items in merged.items()
+    }
+
+
+def _fmt_labels(labels: Dict[str, str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = sorted(labels.items()) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+
+def render_prometheus(data: dict) -> str:
+    lines: List[str] = []
+    typed = set()
+    for kind, ptype in (("counters", "counter"), ("gauges", "gauge")):
+        for name, labels, value in data[kind]:
+            if name not in typed:
+                lines.append(f"# TYPE {name} {ptype}")
+                typed.add(name)
+            lines.append(f"{name}{_fmt_labels(labels)} {value}")
+    for name, labels, h in data["histograms"]:
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        for bound, count in zip(BUCKETS, h):
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{name}_bucket{_fmt_labels(labels, ('le', le))} {count}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {h[-2]}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {h[-1]}")
+    return "\n".join(lines) + "\n"
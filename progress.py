@@ -0,0 +1,179 @@
+# progress.py
+"""Per-job progress registry fed by yt-dlp progress / postprocessor hooks. No Streamlit imports."""
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+# stages an item moves through
+QUEUED, EXTRACT, DOWNLOAD, POSTPROCESS, DONE, ERROR = "queued", "extract", "download", "postprocess", "done", "error"
+
+JOB_TTL = 3600  # finished jobs are dropped after an hour
+
+
+@dataclass
+class ItemProgress:
+    """Live counters for one URL of a job. Mutated only under the registry lock."""
+    url: str
+    stage: str = QUEUED
+    filename: Optional[str] = None
+    bytes_done: int = 0
+    bytes_total: Optional[int] = None
+    speed: Optional[float] = None  # instantaneous, bytes/s (as reported by yt-dlp)
+    eta: Optional[float] = None
+    begun: Optional[float] = None  # left the queue (extraction started)
+    started: Optional[float] = None  # first byte received
+    finished: Optional[float] = None
+    error: Optional[str] = None
+    # bytes of files already completed for this item (video + audio of a merged format, ...)
+    _closed_bytes: int = 0
+
+    @property
+    def avg_speed(self) -> Optional[float]:
+        if not self.started or not self.bytes_done:
+            return None
+        elapsed = (self.finished or time.time()) - self.started
+        return self.bytes_done / elapsed if elapsed > 0 else None
+
+
+@dataclass
+class Job:
+    id: str
+    items: List[ItemProgress]
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.finished is not None
+
+
+class ItemHooks:
+    """The yt-dlp hooks for one item; pass ``progress_hook``/``postprocessor_hook`` in ydl params."""
+
+    def __init__(self, registry: "ProgressRegistry", job_id: str, index: int):
+        self._registry = registry
+        self._job_id = job_id
+        self._index = index
+
+    def stage(self, stage: str, error: Optional[str] = None) -> None:
+        with self._registry._lock:
+            item = self._item()
+            if item is None:
+                return
+            item.stage = stage
+            if stage == EXTRACT and item.begun is None:
+                item.begun = time.time()
+            if stage in (DONE, ERROR):
+                item.finished = time.time()
+                item.speed = None
+                item.eta = None
+            if error:
+                item.error = error
+
+    def progress_hook(self, d: dict) -> None:
+        with self._registry._lock:
+            item = self._item()
+            if item is None:
+                return
+            status = d.get("status")
+            done = d.get("downloaded_bytes") or 0
+            total = d.get("total_bytes") or d.get("total_bytes_estimate")
+            item.filename = d.get("filename") or item.filename
+            if status == "downloading":
+                if item.started is None:
+                    item.started = time.time()
+                item.stage = DOWNLOAD
+                item.bytes_done = item._closed_bytes + done
+                item.bytes_total = item._closed_bytes + int(total) if total else None
+                item.speed = d.get("speed")
+                item.eta = d.get("eta")
+            elif status == "finished":
+                size = int(total or done)
+                item._closed_bytes += size
+                item.bytes_done = item.bytes_total = item._closed_bytes
+                item.speed = None
+                item.eta = None
+
+    def postprocessor_hook(self, d: dict) -> None:
+        if d.get("status") == "started":
+            self.stage(POSTPROCESS)
+
+    def _item(self) -> Optional[ItemProgress]:
+        job = self._registry._jobs.get(self._job_id)
+        if job is None or self._index >= len(job.items):
+            return None
+        return job.items[self._index]
+
+
+class ProgressRegistry:
+    """Process-wide table of jobs. Writers are the download threads, readers are the UI reruns."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+
+    def create(self, urls: List[str]) -> str:
+        self.prune()
+        job = Job(uuid.uuid4().hex[:12], [ItemProgress(u) for u in urls])
+        with self._lock:
+            self._jobs[job.id] = job
+        return job.id
+
+    def set_items(self, job_id: str, urls: List[str]) -> None:
+        """Replace the item list (an account URL expanded into its entries)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.items = [ItemProgress(u) for u in urls]
+
+    def hooks(self, job_id: str, index: int) -> ItemHooks:
+        return ItemHooks(self, job_id, index)
+
+    def finish(self, job_id: str) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.finished = time.time()
+
+    def snapshot(self, job_id: str) -> Optional[dict]:
+        """Copy of the job with aggregate totals; safe to read while the job runs."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            items = []
+            for it in job.items:
+                row = asdict(it)
+                row.pop("_closed_bytes", None)
+                row["avg_speed"] = it.avg_speed
+                items.append(row)
+            done = job.done
+        bytes_done = sum(i["bytes_done"] for i in items)
+        totals = [i["bytes_total"] for i in items]
+        bytes_total = sum(totals) if totals and all(t for t in totals) else None
+        speed = sum(i["speed"] or 0 for i in items)
+        completed = sum(1 for i in items if i["stage"] in (DONE, ERROR))
+        eta = None
+        if bytes_total and speed:
+            eta = max(bytes_total - bytes_done, 0) / speed
+        return {
+            "id": job_id,
+            "done": done,
+            "items": items,
+            "completed": completed,
+            "bytes_done": bytes_done,
+            "bytes_total": bytes_total,
+            "speed": speed or None,
+            "eta": eta,
+        }
+
+    def prune(self, ttl: float = JOB_TTL) -> None:
+        cutoff = time.time() - ttl
+        with self._lock:
+            for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+                del self._jobs[job_id]
+
+
+PROGRESS = ProgressRegistry()
@@ -0,0 +1,173 @@
+# segmented.py
+"""
+Parallel byte-range downloads for large progressive (single-URL HTTP) media. The file is split into
+byte ranges fetched over pooled connections; each range is written in place (os.pwrite) into a
+preallocated .part file, and a failed range is retried on its own from where it stopped.
+
+A server that does not answer the Range probe with 206 raises RangesUnsupported so the caller can
+fall back to a plain single-connection download.
+"""
+import os
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+SEGMENTS = int(os.environ.get("VD_SEGMENTS", "4"))  # connections per file; 1 disables segmenting
+MIN_SIZE = int(os.environ.get("VD_SEGMENT_MIN_MB", "16")) * 1024 * 1024  # smaller files are not worth splitting
+RETRIES = 5  # per segment
+CHUNK_SIZE = 256 * 1024
+TIMEOUT = 30
+
+
+class SegmentError(IOError):
+    """The segmented download failed; nothing usable is left on disk."""
+
+
+class RangesUnsupported(SegmentError):
+    """The server ignores byte ranges (or hides the size); download over one connection instead."""
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=64)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def split(size: int, parts: int) -> List[Tuple[int, int]]:
+    """[0, size) as up to ``parts`` inclusive (start, end) ranges of near-equal length."""
+    parts = max(1, min(parts, size))
+    step = -(-size // parts)
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+
+def probe(url: str, headers: Dict[str, str]) -> int:
+    """Total size if the server honours byte ranges; raises RangesUnsupported otherwise."""
+    try:
+        with _get_session().get(url, headers={**headers, "Range": "bytes=0-0"}, stream=True, timeout=TIMEOUT) as r:
+            if r.status_code != 206:
+                raise RangesUnsupported(f"HTTP {r.status_code} to a range request")
+            total = r.headers.get("Content-Range", "").rpartition("/")[2]
+    except requests.RequestException as e:
+        raise SegmentError(str(e)) from e
+    if not total.isdigit() or not int(total):
+        raise RangesUnsupported("no total size in Content-Range")
+    return int(total)
+
+
+def _preallocate(fd: int, size: int) -> None:
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):  # not on macOS / some filesystems: a sparse file will do
+        os.ftruncate(fd, size)
+
+
+def download(
+    url: str,
+    dest: str,
+    headers: Optional[Dict[str, str]] = None,
+    total: Optional[int] = None,
+    segments: int = SEGMENTS,
+    hooks: Iterable[Callable[[dict], None]] = (),
+    info_dict: Optional[dict] = None,
+) -> int:
+    """
+    Fetches url into dest over ``segments`` parallel ranges and returns its size. ``total`` is the
+    size from an earlier probe() (probed here otherwise). ``hooks`` get yt-dlp style "downloading"
+    dicts (carrying info_dict, as yt-dlp's do) after every chunk, from the segment threads: a hook
+    that raises (e.g. DownloadCancelled) aborts the download and one that blocks (a bandwidth.Flow)
+    throttles that connection.
+    """
+    headers = dict(headers or {})
+    hooks = list(hooks)
+    if total is None:
+        total = probe(url, headers)
+    ranges = split(total, segments)
+    done = [0] * len(ranges)
+    stop = threading.Event()
+    session = _get_session()
+    part = dest + ".part"
+
+    def fetch(i: int) -> None:
+        start, end = ranges[i]
+        error: Optional[Exception] = None
+        for attempt in range(RETRIES):
+            pos = start + done[i]
+            if pos > end:
+                return
+            try:
+                rng = {"Range": f"bytes={pos}-{end}"}
+                with session.get(url, headers={**headers, **rng}, stream=True, timeout=TIMEOUT) as r:
+                    if r.status_code != 206:
+                        raise SegmentError(f"HTTP {r.status_code} for bytes {pos}-{end}")
+                    for chunk in r.iter_content(CHUNK_SIZE):
+                        if stop.is_set():
+                            return
+                        view = memoryview(chunk)[:end + 1 - pos]
+                        while view:
+                            n = os.pwrite(fd, view, pos)
+                            view = view[n:]
+                            pos += n
+                            done[i] += n
+                        report("downloading", time.monotonic() - t0)
+                        if pos > end:
+                            return
+            except (requests.RequestException, SegmentError) as e:
+                error = e
+            if stop.is_set():
+                return
+            time.sleep(min(0.5 * 2 ** attempt, 8))
+        raise SegmentError(f"bytes {start}-{end}: {error or 'connection closed early'} (after {RETRIES} attempts)")
+
+    def report(status: str, elapsed: float) -> None:
+        got = sum(done)
+        speed = got / elapsed if elapsed > 0 else None
+        d = {
+            "status": status, "filename": dest, "tmpfilename": part, "downloaded_bytes": got,
+            "total_bytes": total, "elapsed": elapsed, "speed": speed,
+            "eta": (total - got) / speed if speed else None, "info_dict": info_dict or {},
+        }
+        for hook in hooks:
+            hook(d)
+
+    fd = os.open(part, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    ok = False
+    t0 = time.monotonic()
+    try:
+        _preallocate(fd, total)
+        with ThreadPoolExecutor(len(ranges), thread_name_prefix="segment") as pool:
+            futures = [pool.submit(fetch, i) for i in range(len(ranges))]
+            try:
+                finished, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                for f in finished:
+                    if f.exception() is not None:
+                        raise f.exception()
+            except BaseException:
+                stop.set()
+                raise
+        if sum(done) != total:
+            raise SegmentError(f"got {sum(done)} of {total} bytes")
+        ok = True
+    finally:
+        os.close(fd)
+        if not ok:
+            # a preallocated .part would look complete to yt-dlp's resume logic
+            try:
+                os.unlink(part)
+            except OSError:
+                pass
+    report("downloading", time.monotonic() - t0)
+    os.replace(part, dest)
+    return total
@@ -1,20 +1,44 @@
 # app.py
 import streamlit as st
-from yt_dlp import YoutubeDL
 from pathlib import Path
-import threading
-import time
-import shutil
+import base64
 import tempfile
 import traceback
 import streamlit.components.v1 as components
 from typing import List, Optional
+from urllib.parse import quote, urlsplit
 import os
+import json
+import threading
+import time
+import uuid
+
+from bandwidth import BULK, INTERACTIVE
+from downloader import ACCOUNTS, BANDWIDTH, FRAGMENTS, LIBRARY, METADATA_CACHE, METRICS_DIR, PAGE_SIZE, STATE_DIR, cookie_file, extract_metadata, fetch_account_page, resolve_entries, sync_account, sync_due, warm_up
+from fileserve import FileServer, file_url
+from jobqueue import CANCELLED, QUEUED, TERMINAL, JobQueue, WorkerPool
+from metrics import REGISTRY, collect, key, render_prometheus
+from progress import DONE, ERROR
+from thumbs import GRID_WIDTH, ThumbnailService
+from zipstream import iter_zip
 
 # --------- App branding ----------
 APP_TITLE = "All Video Downloader"
 APP_TAGLINE = "Enjoy"
 HOME_HTML = "home.html"  # must be in same folder
+AUDIO_FORMATS = {"mp3": "MP3", "m4a": "M4A (AAC)", "opus": "Opus"}  # Audio page targets (see transcode.py)
+# tracked accounts: a page visit re-syncs at most this often; VD_SYNC_INTERVAL (minutes) > 0 also
+# refreshes all of them in the background and queues new posts of accounts set to auto-download
+SYNC_MAX_AGE = 60
+SYNC_INTERVAL = float(os.environ.get("VD_SYNC_INTERVAL", "0")) * 60
+SHARES = (0.25, 0.5, 1.0, 2.0, 4.0)  # bandwidth share of a running job (1 = normal), see bandwidth.py
+
+# --------- File server (Save buttons) ----------
+FILE_PORT = int(os.environ.get("VD_FILE_PORT", "8502"))
+# where browsers reach the file server when it sits behind a proxy; by default the page's own host on FILE_PORT
+FILE_BASE_URL = os.environ.get("VD_FILE_BASE_URL")
+# largest selection ZIP built in memory for st.download_button when the file server is not reachable
+ZIP_INLINE_MAX = int(os.environ.get("VD_ZIP_INLINE_MB", "200")) * 1024 * 1024
 
 # --------- Page config ----------
 st.set_page_config(
@@ -24,10 +48,6 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
-# --------- Folders ----------
-OUT_DIR = Path("downloads")
-OUT_DIR.mkdir(exist_ok=True)
-
 # --------- CSS (dark - neon) ----------
 st.markdown(
     """
@@ -46,19 +66,6 @@ h1,h2,h3 { text-align:center; color:#8ef0ff; }
 /* Inputs */
 input[type=text], textarea { background:#07111a !important; color:#eafcff !important; border-radius:8px !important; padding:10px !important; border:1px solid #183045 !important; }
 
-/* Grid */
-.grid { display:flex; flex-wrap:wrap; gap:14px; justify-content:center; margin-top:12px; }
-.grid-item { width:300px; background: linear-gradient(180deg,#08121a,#0b1720); border-radius:12px; padding:8px; box-shadow:0 10px 30px rgba(0,0,0,0.6); transition: transform .18s ease, box-shadow .18s ease; border:1px solid rgba(0,120,255,0.04); }
-.grid-item:hover { transform: translateY(-6px); box-shadow: 0 18px 40px rgba(0,140,255,0.12); }
-.grid-thumb { width:100%; height:170px; object-fit:cover; border-radius:8px; transition: transform .22s ease, box-shadow .22s ease; }
-.grid-item:hover .grid-thumb { transform: scale(1.06); box-shadow: 0 10px 30px rgba(0,200,255,0.14); }
-.grid-title { font-weight:700; font-size:14px; margin-top:8px; color:#eafcff; overflow:hidden; text-overflow:ellipsis; white-space:nowrap; }
-.grid-meta { color:#98e9ff88; font-size:12px; margin-top:6px; }
-.chk-row { display:flex; justify-content:space-between; align-items:center; gap:8px; margin-top:8px; }
-
-/* responsive */
-@media (max-width: 950px) { .grid-item { width:100%; } }
-
 /* hide default footer */
 footer { display:none !important; }
 </style>
@@ -71,10 +78,11 @@ if "page" not in st.session_state:
     st.session_state.page = "Home"
 if "INSTAGRAM_COOKIE" not in st.session_state:
     st.session_state.INSTAGRAM_COOKIE = ""
-if "preview_cache" not in st.session_state:
-    st.session_state.preview_cache = {}
-if "download_thread" not in st.session_state:
-    st.session_state.download_thread = None
+if "jobs" not in st.session_state:
+    st.session_state.jobs = {}
+if "session_id" not in st.session_state:
+    # bandwidth and queue fairness are per browser session
+    st.session_state.session_id = uuid.uuid4().hex
 
 def set_page_and_close(page_name: str):
     st.session_state.page = page_name
@@ -94,7 +102,7 @@ with st.sidebar:
     st.markdown("---")
     if st.button("🏠 Home", on_click=set_page_and_close, args=("Home",)): pass
     if st.button("🔎 Any Video (MP4)", on_click=set_page_and_close, args=("AnyVideo",)): pass
-    if st.button("🎧 Audio (MP3)", on_click=set_page_and_close, args=("Audio",)): pass
+    if st.button("🎧 Audio", on_click=set_page_and_close, args=("Audio",)): pass
     if st.button("🎬 TikTok Account", on_click=set_page_and_close, args=("TikTok",)): pass
     if st.button("📸 Instagram Account", on_click=set_page_and_close, args=("Instagram",)): pass
     if st.button("⚙️ Set Instagram Cookie", on_click=set_page_and_close, args=("Cookie",)): pass
@@ -135,115 +143,404 @@ def human_duration(seconds: Optional[int]) -> str:
     except Exception:
         return str(seconds or "")
 
+@st.cache_resource
+def thumbnail_service() -> ThumbnailService:
+    """One thumbnail proxy (HTTP pool + disk cache) for the whole server process."""
+    service = ThumbnailService(STATE_DIR / "thumbs", max_bytes=int(os.environ.get("VD_THUMB_CACHE_MB", "128")) * 1024 * 1024)
+
+    def _metrics():
+        s = service.stats()
+        return {
+            key("vd_cache_requests_total", cache="thumbs", result="hit"): s["hits"],
+            key("vd_cache_requests_total", cache="thumbs", result="miss"): s["misses"],
+            key("vd_thumb_failures_total"): s["failures"],
+            key("vd_cache_entries", cache="thumbs"): s["files"],
+            key("vd_cache_bytes", cache="thumbs"): s["bytes"],
+        }
+
+    REGISTRY.collector(_metrics)
+    return service
+
+@st.cache_resource
+def file_server() -> FileServer:
+    """
+    Started once per server process; streams files by token with Range support, a job's files as
+    one ZIP at /zip/<job id>/<name> (built while it is sent, never written to disk; for a running
+    job, each file is added as it finishes), and serves /metrics (Prometheus text) and /metrics.json
+    for all processes (app + queue workers).
+    """
+    routes = {
+        "/metrics": lambda: ("text/plain; version=0.0.4", render_prometheus(collect(METRICS_DIR)).encode()),
+        "/metrics.json": lambda: ("application/json", json.dumps(collect(METRICS_DIR)).encode()),
+    }
+    queue = job_queue()
+
+    def _job_zip(rest: str):
+        job_id = rest.split("/", 1)[0]
+        result = queue.result(job_id)
+        if result is not None:
+            return (result["zip_name"], iter_zip(result["files"])) if result.get("zip_name") else None
+        payload = queue.payload(job_id)
+        if not payload or not payload.get("zip_name"):
+            return None
+        return payload["zip_name"], iter_zip(queue.iter_files(job_id))
+
+    return FileServer(LIBRARY, port=FILE_PORT, routes=routes, mounts={"/thumbs/": thumbnail_service().cache_dir},
+                      streams={"/zip/": _job_zip}).start()
+
+def file_base_url() -> Optional[str]:
+    """
+    Where this browser reaches the file server: VD_FILE_BASE_URL, else the host the page was loaded
+    from, on FILE_PORT. None on an https page without VD_FILE_BASE_URL: a plain-http link there is
+    blocked as mixed content, so callers fall back to serving through Streamlit itself.
+    """
+    if FILE_BASE_URL:
+        return FILE_BASE_URL.rstrip("/")
+    page = urlsplit(st.context.url or "")
+    scheme = page.scheme or "http"
+    host = page.hostname or urlsplit("//" + (st.context.headers.get("Host") or "")).hostname
+    if scheme != "http" or not host:
+        return None
+    return f"http://[{host}]:{FILE_PORT}" if ":" in host else f"http://{host}:{FILE_PORT}"
+
+def thumb_url(local: Optional[str], remote: Optional[str]) -> Optional[str]:
+    """
+    Browser URL of a cached thumbnail: served by the file server, or inlined as a data URI (the
+    JPEGs are a few KB) where the browser cannot reach it; the original URL if none is cached.
+    """
+    if not local:
+        return remote
+    base = file_base_url()
+    if base is None:
+        try:
+            return "data:image/jpeg;base64," + base64.b64encode(Path(local).read_bytes()).decode()
+        except OSError:
+            return remote  # evicted from the cache meanwhile
+    file_server()
+    rel = Path(local).relative_to(thumbnail_service().cache_dir).as_posix()
+    return f"{base}/thumbs/{rel}"
+
+_media_grid = components.declare_component("media_grid", path=str(Path(__file__).parent / "grid_component"))
+
+def media_grid(grid_key: str, entries: List[dict], action: str, height: int = 720) -> Optional[List[dict]]:
+    """
+    Account preview grid as one component: offscreen cards are not rendered and selection stays in
+    the browser (select all / none / first N included), so clicking around causes no reruns.
+    Returns the selected entries once per click on the `action` button, else None.
+    """
+    thumbs = thumbnail_service().get_many([e.get("thumbnail") for e in entries], width=GRID_WIDTH)
+    items, by_id = [], {}
+    for e, local in zip(entries, thumbs):
+        item_id = e.get("webpage_url") or e.get("url") or e.get("id")
+        by_id[item_id] = e
+        items.append({
+            "id": item_id,
+            "title": (e.get("title") or "")[:80],
+            "meta": f"{human_duration(e.get('duration'))} • {e.get('uploader') or ''}",
+            "thumb": thumb_url(local, e.get("thumbnail")),
+        })
+    value = _media_grid(items=items, action=action, storage_key=grid_key, height=height, key=grid_key, default=None)
+    # the component keeps returning its last value on later reruns: act on each click once
+    if not value or value.get("nonce") == st.session_state.get(f"{grid_key}::nonce"):
+        return None
+    st.session_state[f"{grid_key}::nonce"] = value.get("nonce")
+    return [by_id[i] for i in value.get("selected") or [] if i in by_id]
+
+def _file_link(label: str, token: str, path: str, name: str, key: str):
+    base = file_base_url()
+    if base is not None:
+        st.link_button(label, file_url(base, token, name))
+    else:
+        # same-origin fallback: the file is only read when clicked, but then whole, into memory
+        st.download_button(label, lambda: Path(path).read_bytes(), file_name=name, on_click="ignore", key=key)
+
+def save_button(label: str, path: str):
+    """
+    Link to the file server instead of st.download_button, which loads the whole file into memory
+    (still used where the browser cannot reach the file server, see file_base_url).
+    """
+    file_server()
+    token = LIBRARY.token_for(path)
+    if token:
+        _file_link(label, token, path, Path(path).name, key=f"save::{label}::{token}")
+
+def recent_files(label: str):
+    """The six newest indexed files; no directory listing and no file is opened."""
+    recent = LIBRARY.recent(6)
+    if recent:
+        file_server()
+        st.write(label)
+        cols = st.columns(min(3, len(recent)))
+        for i, row in enumerate(recent):
+            with cols[i % len(cols)]:
+                st.write(row["name"])
+                _file_link("⬇️ Save", row["token"], row["path"], row["name"], key=f"recent::{row['token']}")
+    return recent
+
 def fetch_metadata(url: str, cookie: Optional[str] = None, limit_preview: int = 24):
-    """Uses yt-dlp to extract metadata (no download). Caches results."""
-    cache_key = f"{url}::cookie={bool(cookie)}::limit={limit_preview}"
-    if cache_key in st.session_state.preview_cache:
-        return st.session_state.preview_cache[cache_key]
-    opts = {"quiet": True, "no_warnings": True}
-    if cookie:
-        tmp = OUT_DIR / "preview_cookie.txt"
-        tmp.write_text(cookie)
-        opts["cookiefile"] = str(tmp)
+    """Uses yt-dlp to extract metadata (no download). Cached process-wide, shared by all sessions."""
     try:
-        with YoutubeDL(opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            if isinstance(info, dict) and "entries" in info:
-                entries = [e for e in info["entries"] if isinstance(e, dict)]
-                info_preview = dict(info)
-                info_preview["entries"] = entries[:limit_preview]
-                st.session_state.preview_cache[cache_key] = info_preview
-                return info_preview
-            st.session_state.preview_cache[cache_key] = info
-            return info
+        return extract_metadata(url, cookie=cookie, limit_preview=limit_preview)
     except Exception as e:
         st.error(f"Preview failed: {e}")
         return None
 
-def _yt_download_worker(ydl_opts, urls: List[str], result_paths: List[str], audio=False, cookie=None, playlist_end=None):
+def fetch_account_preview(url: str, cookie: Optional[str] = None, pages: int = 1):
     """
-    Run yt-dlp downloads sequentially in background thread.
-    This worker writes found files into result_paths list.
+    First `pages` pages of an account, flat-extracted and cached per page (see fetch_account_page).
+    Only the entries shown here get their details resolved.
     """
+    header, entries, has_more = {}, [], False
     try:
-        with YoutubeDL(ydl_opts) as ydl:
-            if len(urls) == 1 and (urls[0].startswith("https://www.tiktok.com/") or urls[0].startswith("https://www.instagram.com/")):
-                # profile/playlist URL
-                if playlist_end and isinstance(playlist_end, int) and playlist_end > 0:
-                    ydl.params["playlistend"] = playlist_end
-                res = ydl.extract_info(urls[0], download=True)
-            else:
-                for u in urls:
-                    ydl.extract_info(u, download=True)
-        # find recent files (last 15 minutes)
-        now = time.time()
-        for p in OUT_DIR.iterdir():
-            try:
-                if p.is_file() and (now - p.stat().st_mtime) < 900:
-                    result_paths.append(str(p))
-            except Exception:
-                continue
+        for page_no in range(pages):
+            res = fetch_account_page(url, cookie=cookie, page=page_no)
+            if not res:
+                break
+            header = header or res["header"]
+            entries.extend(res["entries"])
+            has_more = res["has_more"]
+            if not has_more:
+                break
+        entries = resolve_entries(entries, cookie=cookie)
     except Exception as e:
-        result_paths.append(f"__ERROR__:{e}")
+        st.error(f"Preview failed: {e}")
+        return None
+    return {**header, "entries": entries, "has_more": has_more}
+
+def human_bytes(n: Optional[float]) -> str:
+    if not n:
+        return "0 B"
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+@st.cache_resource
+def job_queue() -> JobQueue:
+    """
+    The durable queue; unless VD_QUEUE_EXTERNAL is set, this process also runs its worker pool,
+    replacing dead workers (and requeueing their jobs) every few seconds.
+    """
+    queue = JobQueue(STATE_DIR / "jobs.sqlite")
+    REGISTRY.collector(lambda: {key("vd_queue_jobs", state=k): n for k, n in queue.counts().items()}, shared=True)
+    if not os.environ.get("VD_QUEUE_EXTERNAL"):
+        WorkerPool(queue.db_path).ensure_running().watch()
+    return queue
 
-def download_with_animation(urls: List[str], audio: bool = False, cookie: Optional[str] = None, playlist_end: Optional[int] = None) -> List[str]:
+def download_with_animation(urls: List[str], audio: bool = False, cookie: Optional[str] = None, playlist_end: Optional[int] = None, job_key: str = "download", zip_stem: Optional[str] = None, infos: Optional[List[Optional[dict]]] = None, fragments: Optional[int] = None, audio_format: Optional[str] = None, audio_quality: Optional[int] = None) -> str:
     """
-    Starts a background download and shows an animated progress bar in the UI while it runs.
-    Returns list of downloaded file paths (or empty on failure).
+    Enqueues a download job and remembers its id under job_key for this session.
+    Returns the job id; show_download(job_key) renders its live progress and, once finished, its files.
+    With zip_stem, the job's files can be downloaded as "<zip_stem>_selected_<time>.zip" (see zip_button).
+    infos: the info dicts already shown in the preview, one per URL; fresh ones are not extracted again.
+    fragments: parallel HLS/DASH fragment downloads per item (default VD_FRAGMENTS).
+    audio_format / audio_quality: target of an audio job ("mp3", "m4a" or "opus"; kbps when re-encoding).
+    A single URL is an interactive job, claimed and served bandwidth ahead of bulk (multi-item) jobs.
     """
-    outtmpl = str(OUT_DIR / "%(title).100s.%(ext)s")
-    ydl_opts = {
-        "outtmpl": outtmpl,
-        "quiet": True,
-        "no_warnings": True,
-        "ignoreerrors": True,
-        # progress_hooks not used for percentage accuracy (we animate instead)
+    payload = {
+        "urls": urls,
+        "audio": audio,
+        "cookiefile": cookie_file(cookie) if cookie else None,
+        "playlist_end": playlist_end,
+        "zip_stem": zip_stem,
+        "zip_name": f"{zip_stem}_selected_{int(time.time())}.zip" if zip_stem else None,
+        "infos": infos,
+        "fragments": fragments,
+        "audio_format": audio_format,
+        "audio_quality": audio_quality,
     }
-    if audio:
-        ydl_opts.update({
-            "format": "bestaudio/best",
-            "postprocessors": [{"key": "FFmpegExtractAudio", "preferredcodec": "mp3", "preferredquality": "192"}]
-        })
+    priority = INTERACTIVE if len(urls) == 1 and not zip_stem else BULK
+    job_id = job_queue().submit(payload, session=st.session_state.session_id, priority=priority)
+    st.session_state.jobs[job_key] = job_id
+    return job_id
+
+@st.fragment(run_every=1.0)
+def _download_progress(job_id: str):
+    """Redraws from the job's latest progress snapshot once a second; only this fragment reruns, not the page."""
+    status = job_queue().status(job_id)
+    if status is None or status["state"] in TERMINAL:
+        st.rerun()
+    if st.button("✖ Cancel", key=f"cancel_{job_id}"):
+        job_queue().cancel(job_id)
+    if BANDWIDTH.enabled and status["state"] != QUEUED:
+        share = st.select_slider("Bandwidth share", options=SHARES, value=status["weight"] if status["weight"] in SHARES else 1.0,
+                                 format_func=lambda w: f"{w:g}×", key=f"share_{job_id}")
+        if share != status["weight"]:
+            job_queue().set_weight(job_id, share)
+    snap = status["progress"]
+    if status["state"] == QUEUED or not snap:
+        position = status.get("position")
+        st.progress(0.0, text=f"Queued (position {position})" if position else "Starting...")
+        return
+    items = snap["items"]
+    if snap["bytes_total"]:
+        frac = snap["bytes_done"] / snap["bytes_total"]
     else:
-        ydl_opts.update({"format": "best", "merge_output_format": "mp4"})
-
-    if cookie:
-        cf = OUT_DIR / "dl_cookie.txt"
-        cf.write_text(cookie)
-        ydl_opts["cookiefile"] = str(cf)
-
-    result_paths: List[str] = []
-    # spawn thread
-    worker = threading.Thread(target=_yt_download_worker, args=(ydl_opts, urls, result_paths, audio, cookie, playlist_end))
-    worker.start()
-    st.session_state.download_thread = worker
-
-    # animated progress while thread alive
-    progress = st.progress(0)
-    status = st.empty()
-    t = 0
-    while worker.is_alive():
-        # animate a looping bar (0..100)
-        t = (t + 7) % 100
-        progress.progress(t)
-        status.info("Downloading... (this is an animated progress bar)")
-        time.sleep(0.18)
-    # finished
-    progress.progress(100)
-    status.success("Download finished — finalizing files...")
-    # small wait for filesystem updates
-    time.sleep(0.6)
+        frac = snap["completed"] / max(len(items), 1)
+    text = f"{snap['completed']}/{len(items)} done • {human_bytes(snap['bytes_done'])}"
+    if snap["bytes_total"]:
+        text += f" of {human_bytes(snap['bytes_total'])}"
+    if snap["speed"]:
+        text += f" • {human_bytes(snap['speed'])}/s"
+    if snap["eta"]:
+        text += f" • ETA {human_duration(snap['eta'])}"
+    st.progress(min(max(frac, 0.0), 1.0), text=text)
+    for it in items:
+        if it["stage"] in (DONE, ERROR):
+            continue
+        name = Path(it["filename"]).name if it["filename"] else it["url"]
+        line = f"{it['stage']} — {name[:80]}"
+        if it["bytes_total"]:
+            line += f" — {100 * it['bytes_done'] / it['bytes_total']:.0f}%"
+        if it["speed"]:
+            line += f" @ {human_bytes(it['speed'])}/s (avg {human_bytes(it['avg_speed'])}/s)"
+        if it["eta"]:
+            line += f" • ETA {human_duration(it['eta'])}"
+        st.caption(line)
+
+def show_download(job_key: str) -> List[str]:
+    """
+    Shows this session's job_key download: live progress while it runs, errors once it ends.
+    Returns list of downloaded file paths when finished (empty while running or on failure).
+    """
+    job_id = st.session_state.jobs.get(job_key)
+    if not job_id:
+        return []
+    status = job_queue().status(job_id)
+    if status is None:
+        return []
+    if status["state"] not in TERMINAL:
+        _download_progress(job_id)
+        return []
+    if status["state"] == CANCELLED:
+        st.warning("Download cancelled.")
 
     # collect results (filter out errors)
-    downloaded = [p for p in result_paths if not p.startswith("__ERROR__")]
-    errors = [p for p in result_paths if p.startswith("__ERROR__")]
+    result = job_queue().result(job_id) or {}
+    downloaded = [p for p in result.get("files", []) if Path(p).exists()]
+    errors = result.get("errors", [])
     if errors:
-        status.error("Some downloads failed. See logs.")
+        st.error("Some downloads failed. See logs.")
         for e in errors:
             st.text(e)
     return downloaded
 
+def zip_button(job_key: str):
+    """
+    Download button for a zip_stem job's files as one ZIP, streamed by the file server. While the job
+    runs, the ZIP starts at once and each file is added as it finishes.
+    """
+    job_id = st.session_state.jobs.get(job_key)
+    status = job_queue().status(job_id) if job_id else None
+    if status is None:
+        return
+    base = file_base_url()
+    if status["state"] not in TERMINAL:
+        name = (job_queue().payload(job_id) or {}).get("zip_name")
+        if name and base is not None:
+            file_server()
+            st.link_button("⬇️ Download ZIP now (files are added as they finish)", f"{base}/zip/{job_id}/{quote(name)}")
+        return
+    result = job_queue().result(job_id)
+    name = (result or {}).get("zip_name")
+    if not name:
+        return
+    st.success(f"ZIP ready: {name}")
+    if base is not None:
+        file_server()
+        st.link_button("⬇️ Download ZIP", f"{base}/zip/{job_id}/{quote(name)}")
+        return
+    # same-origin fallback: st.download_button holds the whole ZIP in memory, so only small ones
+    files = [f for f in result["files"] if Path(f).is_file()]
+    size = sum(Path(f).stat().st_size for f in files)
+    if size > ZIP_INLINE_MAX:
+        st.warning(f"This ZIP ({human_bytes(size)}) is too large to download through the page. Set VD_FILE_BASE_URL "
+                   "to a public URL of the file server, or select fewer items.")
+        return
+    st.download_button("⬇️ Download ZIP", lambda: b"".join(iter_zip(files)), file_name=name,
+                       mime="application/zip", on_click="ignore", key=f"zip::{job_id}")
+
+@st.cache_resource
+def ydl_warm_up() -> threading.Thread:
+    """Once per server process, in the background: the first preview then borrows a ready YoutubeDL."""
+    thread = threading.Thread(target=warm_up, name="ydl-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+@st.cache_resource
+def account_refresher() -> Optional[threading.Thread]:
+    """Once per server process when VD_SYNC_INTERVAL is set: syncs due tracked accounts and queues auto-download ones."""
+    if SYNC_INTERVAL <= 0:
+        return None
+    queue = job_queue()
+
+    def _loop():
+        while True:
+            for url, new in sync_due(SYNC_INTERVAL).items():
+                row = ACCOUNTS.get(url)
+                if not new or row is None or not row["auto_download"]:
+                    continue
+                urls = [e["webpage_url"] for e in new]
+                queue.submit({"urls": urls, "audio": False, "cookiefile": row["cookiefile"], "infos": new},
+                             session="account-sync", priority=BULK)
+                ACCOUNTS.mark(url, [e["id"] for e in new])
+            time.sleep(min(SYNC_INTERVAL, 60))
+
+    thread = threading.Thread(target=_loop, name="account-sync", daemon=True)
+    thread.start()
+    return thread
+
+def tracked_account(account_url: str, name: str, prefix: str, cookie: Optional[str] = None):
+    """
+    Incremental view of a tracked account: only the posts that appeared since it was tracked and
+    were not queued yet. Syncing pages the account only as far as the first post already seen.
+    """
+    row = ACCOUNTS.get(account_url)
+    auto = st.toggle("Queue new posts automatically" + ("" if SYNC_INTERVAL > 0 else " (needs VD_SYNC_INTERVAL)"),
+                     value=bool(row and row["auto_download"]), key=f"{prefix}_auto::{name}")
+    if row is not None and auto != bool(row["auto_download"]):
+        ACCOUNTS.track(account_url, cookiefile=cookie_file(cookie) if cookie else None, auto_download=auto)
+    force = st.button("🔄 Check for new posts", key=f"{prefix}_sync::{name}")
+    try:
+        with st.spinner("Checking for new posts..."):
+            new = sync_account(account_url, cookie=cookie, max_age=0 if force else SYNC_MAX_AGE)
+    except Exception as e:
+        st.error(f"Sync failed: {e}")
+        return
+    row = ACCOUNTS.get(account_url)
+    if row and row["last_sync"]:
+        st.caption(f"Last checked {int(time.time() - row['last_sync']) // 60} min ago")
+    job_key = f"{prefix}_new::{name}"
+    if not new:
+        st.info(f"No new posts from @{name} since they were last queued.")
+    else:
+        st.write(f"{len(new)} new posts from @{name}")
+        picked = media_grid(f"{prefix}_new_grid::{name}", resolve_entries(new, cookie=cookie), "⬇️ Download New & Create ZIP")
+        if picked:
+            download_with_animation([e["webpage_url"] for e in picked], audio=False, cookie=cookie, job_key=job_key,
+                                    zip_stem=name, infos=picked)
+            ACCOUNTS.mark(account_url, [e["id"] for e in picked])
+            st.rerun()
+        elif picked is not None:
+            st.warning("No posts selected.")
+    show_download(job_key)
+    zip_button(job_key)
+
+def track_toggle(account_url: str, name: str, prefix: str, cookie: Optional[str] = None) -> bool:
+    """"Track" switch of an account page; True while the account is tracked."""
+    tracked = ACCOUNTS.get(account_url) is not None
+    want = st.toggle("📌 Track this account (show only new posts)", value=tracked, key=f"{prefix}_track::{name}")
+    if want and not tracked:
+        ACCOUNTS.track(account_url, cookiefile=cookie_file(cookie) if cookie else None)
+    elif tracked and not want:
+        ACCOUNTS.untrack(account_url)
+    return want
+
 # --------- UI pages ----------
+file_server()  # up from the first page view so /metrics can be scraped
+job_queue()
+ydl_warm_up()
+account_refresher()
 st.markdown("<div class='card'>", unsafe_allow_html=True)
 page = st.session_state.page
 
@@ -263,16 +560,7 @@ if page == "Home":
     else:
         st.info(f"Place a '{HOME_HTML}' file in the app folder to show your landing page here.")
     st.markdown("---")
-    recent = sorted(list(OUT_DIR.glob("*")), key=lambda p: p.stat().st_mtime, reverse=True)[:6]
-    if recent:
-        st.write("Recent downloads (click to save):")
-        cols = st.columns(min(3, len(recent)))
-        for i, f in enumerate(recent):
-            with cols[i % len(cols)]:
-                st.write(f.name)
-                with open(f, "rb") as fh:
-                    st.download_button("⬇️ Save", data=fh, file_name=f.name)
-    else:
+    if not recent_files("Recent downloads (click to save):"):
         st.info("No downloads yet.")
 
 # ANY VIDEO (MP4): auto-preview + download
@@ -291,23 +579,26 @@ elif page == "AnyVideo":
             c1, c2 = st.columns([1, 2])
             with c1:
                 if thumbnail:
-                    st.image(thumbnail, use_column_width=True)
+                    st.image(thumbnail_service().get(thumbnail, width=480) or thumbnail, use_column_width=True)
             with c2:
                 st.markdown(f"**{title}**")
                 st.write(f"Uploader: {uploader}")
                 st.write(f"Duration: {duration}")
             st.markdown("---")
+            job_key = f"any_video::{url.strip()}"
+            with st.expander("Advanced"):
+                fragments = st.slider("Parallel fragments (HLS/DASH streams)", 1, 16, FRAGMENTS, key="any_video_fragments")
             if st.button("⬇️ Download MP4"):
-                downloaded = download_with_animation([url.strip()], audio=False)
-                if downloaded:
-                    st.success(f"Downloaded {len(downloaded)} file(s).")
-                    for p in downloaded:
-                        with open(p, "rb") as fh:
-                            st.download_button("⬇️ Save file", data=fh, file_name=Path(p).name)
-
-# AUDIO (MP3)
+                download_with_animation([url.strip()], audio=False, job_key=job_key, infos=[entry], fragments=fragments)
+            downloaded = show_download(job_key)
+            if downloaded:
+                st.success(f"Downloaded {len(downloaded)} file(s).")
+                for p in downloaded:
+                    save_button("⬇️ Save file", p)
+
+# AUDIO (MP3 / M4A / Opus)
 elif page == "Audio":
-    st.markdown("<h2>🎧 Extract Audio (MP3)</h2>", unsafe_allow_html=True)
+    st.markdown("<h2>🎧 Extract Audio</h2>", unsafe_allow_html=True)
     url = st.text_input("Paste video URL to extract audio", key="audio_url")
     if url and url.strip():
         with st.spinner("Fetching preview..."):
@@ -316,155 +607,91 @@ elif page == "Audio":
             entry = info["entries"][0] if isinstance(info, dict) and "entries" in info else info
             st.markdown(f"**{entry.get('title','No title')}**")
             if entry.get("thumbnail"):
-                st.image(entry.get("thumbnail"), width=360)
+                st.image(thumbnail_service().get(entry.get("thumbnail"), width=360) or entry.get("thumbnail"), width=360)
             st.write(f"Uploader: {entry.get('uploader') or ''}")
-        if st.button("⬇️ Download MP3"):
-            downloaded = download_with_animation([url.strip()], audio=True)
-            if downloaded:
-                st.success("Audio downloaded.")
-                for p in downloaded:
-                    with open(p, "rb") as fh:
-                        st.download_button("⬇️ Save audio", data=fh, file_name=Path(p).name)
+        fc1, fc2 = st.columns(2)
+        with fc1:
+            audio_format = st.selectbox(
+                "Format", list(AUDIO_FORMATS), format_func=AUDIO_FORMATS.get, key="audio_format",
+                help="M4A and Opus keep the source audio as-is when it already uses that codec (no re-encode).",
+            )
+        with fc2:
+            audio_quality = st.select_slider("Bitrate when re-encoding (kbps)", [96, 128, 160, 192, 256, 320], value=192, key="audio_quality")
+        job_key = f"audio::{url.strip()}::{audio_format}::{audio_quality}"
+        if st.button(f"⬇️ Download {audio_format.upper()}"):
+            download_with_animation([url.strip()], audio=True, job_key=job_key, infos=[entry] if info else None,
+                                    audio_format=audio_format, audio_quality=audio_quality)
+        downloaded = show_download(job_key)
+        if downloaded:
+            st.success("Audio downloaded.")
+            for p in downloaded:
+                save_button("⬇️ Save audio", p)
 
 # TIKTOK Account: grid preview, select/deselect visible, quick select N, ZIP download
 elif page == "TikTok":
     st.markdown("<h2>🎬 TikTok Account — Grid Preview</h2>", unsafe_allow_html=True)
     username = st.text_input("Enter TikTok username (without @)", key="tt_user")
-    if username and username.strip():
+    if username and username.strip() and track_toggle(f"https://www.tiktok.com/@{username.strip()}", username.strip(), "tt"):
+        tracked_account(f"https://www.tiktok.com/@{username.strip()}", username.strip(), "tt")
+    elif username and username.strip():
         account_url = f"https://www.tiktok.com/@{username.strip()}"
-        preview_limit = st.slider("Preview first N videos", 3, 36, 12, 3, key="tt_preview")
+        pages_key = f"tt_pages::{username.strip()}"
         with st.spinner("Fetching preview..."):
-            info = fetch_metadata(account_url, limit_preview=preview_limit)
+            info = fetch_account_preview(account_url, pages=st.session_state.get(pages_key, 1))
         entries = info.get("entries") if info and isinstance(info, dict) else None
         if not entries:
             st.info("No preview available — account may be private or blocked. Try cookie.")
         else:
             st.write(f"Showing {len(entries)} items from @{username.strip()}")
-            c1, c2, c3 = st.columns([1,1,2])
-            with c1:
-                if st.button("Select All Visible (TikTok)"):
-                    for idx in range(len(entries)):
-                        st.session_state[f"tt_chk_{idx}"] = True
-                    st.experimental_rerun()
-            with c2:
-                if st.button("Deselect All Visible (TikTok)"):
-                    for idx in range(len(entries)):
-                        st.session_state[f"tt_chk_{idx}"] = False
-                    st.experimental_rerun()
-            with c3:
-                select_first = st.number_input("Quick select first N", min_value=0, max_value=len(entries), value=0, step=1, key="tt_quick")
-                if st.button("Apply Quick Select (TikTok)"):
-                    for idx in range(len(entries)):
-                        st.session_state[f"tt_chk_{idx}"] = True if idx < select_first else False
-                    st.experimental_rerun()
-
-            st.markdown("<div class='grid'>", unsafe_allow_html=True)
-            selected_urls = []
-            for idx, e in enumerate(entries):
-                url_item = e.get("webpage_url") or e.get("url") or e.get("id")
-                key = f"tt_chk_{idx}"
-                default = st.session_state.get(key, False)
-                st.markdown("<div class='grid-item'>", unsafe_allow_html=True)
-                if e.get("thumbnail"):
-                    st.image(e.get("thumbnail"), use_column_width=True)
-                st.markdown(f"<div class='grid-title'>{(e.get('title') or '')[:80]}</div>", unsafe_allow_html=True)
-                st.markdown(f"<div class='grid-meta'>{human_duration(e.get('duration'))} • {e.get('uploader') or ''}</div>", unsafe_allow_html=True)
-                chk = st.checkbox("Select", value=default, key=key)
-                if chk:
-                    selected_urls.append(url_item)
-                st.markdown("</div>", unsafe_allow_html=True)
-            st.markdown("</div>", unsafe_allow_html=True)
-
-            if st.button("⬇️ Download Selected & Create ZIP (TikTok)"):
-                if not selected_urls:
+            job_key = f"tt_zip::{username.strip()}"
+            picked = media_grid(f"tt_grid::{username.strip()}", entries, "⬇️ Download Selected & Create ZIP")
+            if info.get("has_more") and st.button(f"Load {PAGE_SIZE} more (TikTok)"):
+                st.session_state[pages_key] = st.session_state.get(pages_key, 1) + 1
+                st.rerun()
+
+            if picked is not None:
+                if not picked:
                     st.warning("No items selected.")
                 else:
-                    st.info(f"Downloading {len(selected_urls)} selected items...")
-                    files = download_with_animation(selected_urls, audio=False)
-                    if files:
-                        # create zip of selected files
-                        tmp_dir = OUT_DIR / f"tmp_zip_{int(time.time())}"
-                        tmp_dir.mkdir(exist_ok=True)
-                        for f in files:
-                            src = Path(f)
-                            if src.exists():
-                                shutil.copy(src, tmp_dir / src.name)
-                        zip_name = OUT_DIR / f"{username.strip()}_selected_{int(time.time())}.zip"
-                        shutil.make_archive(str(zip_name.with_suffix('')), 'zip', root_dir=tmp_dir)
-                        shutil.rmtree(tmp_dir)
-                        st.success(f"ZIP created: {zip_name.name}")
-                        with open(zip_name, "rb") as zf:
-                            st.download_button("⬇️ Download ZIP", data=zf, file_name=zip_name.name)
+                    st.info(f"Downloading {len(picked)} selected items...")
+                    selected_urls = [e.get("webpage_url") or e.get("url") or e.get("id") for e in picked]
+                    download_with_animation(selected_urls, audio=False, job_key=job_key, zip_stem=username.strip(), infos=picked)
+            show_download(job_key)
+            zip_button(job_key)
 
 # INSTAGRAM Account: grid preview + selection + ZIP (cookie support)
 elif page == "Instagram":
     st.markdown("<h2>📸 Instagram Account — Grid Preview</h2>", unsafe_allow_html=True)
     ig_user = st.text_input("Enter Instagram username (without @)", key="ig_user")
-    if ig_user and ig_user.strip():
+    ig_cookie = st.session_state.INSTAGRAM_COOKIE or None
+    if ig_user and ig_user.strip() and track_toggle(f"https://www.instagram.com/{ig_user.strip()}/", ig_user.strip(), "ig", ig_cookie):
+        tracked_account(f"https://www.instagram.com/{ig_user.strip()}/", ig_user.strip(), "ig", ig_cookie)
+    elif ig_user and ig_user.strip():
         profile_url = f"https://www.instagram.com/{ig_user.strip()}/"
-        preview_limit = st.slider("Preview first N posts", 3, 36, 12, 3, key="ig_preview")
-        cookie = st.session_state.INSTAGRAM_COOKIE or None
+        pages_key = f"ig_pages::{ig_user.strip()}"
+        cookie = ig_cookie
         with st.spinner("Fetching profile preview (may require cookie for private accounts)..."):
-            info = fetch_metadata(profile_url, cookie=cookie, limit_preview=preview_limit)
+            info = fetch_account_preview(profile_url, cookie=cookie, pages=st.session_state.get(pages_key, 1))
         entries = info.get("entries") if info and isinstance(info, dict) else None
         if not entries:
             st.info("No preview entries found. Profile may be private or blocked. Set cookie in Cookie page.")
         else:
             st.write(f"Showing {len(entries)} items from @{ig_user.strip()}")
-            c1, c2, c3 = st.columns([1,1,2])
-            with c1:
-                if st.button("Select All Visible (IG)"):
-                    for idx in range(len(entries)):
-                        st.session_state[f"ig_chk_{idx}"] = True
-                    st.experimental_rerun()
-            with c2:
-                if st.button("Deselect All Visible (IG)"):
-                    for idx in range(len(entries)):
-                        st.session_state[f"ig_chk_{idx}"] = False
-                    st.experimental_rerun()
-            with c3:
-                select_first = st.number_input("Quick select first N", min_value=0, max_value=len(entries), value=0, step=1, key="ig_quick")
-                if st.button("Apply Quick Select (IG)"):
-                    for idx in range(len(entries)):
-                        st.session_state[f"ig_chk_{idx}"] = True if idx < select_first else False
-                    st.experimental_rerun()
-
-            st.markdown("<div class='grid'>", unsafe_allow_html=True)
-            selected_urls = []
-            for idx, e in enumerate(entries):
-                url_item = e.get("webpage_url") or e.get("url") or e.get("id")
-                key = f"ig_chk_{idx}"
-                default = st.session_state.get(key, False)
-                st.markdown("<div class='grid-item'>", unsafe_allow_html=True)
-                if e.get("thumbnail"):
-                    st.image(e.get("thumbnail"), use_column_width=True)
-                st.markdown(f"<div class='grid-title'>{(e.get('title') or '')[:80]}</div>", unsafe_allow_html=True)
-                st.markdown(f"<div class='grid-meta'>{human_duration(e.get('duration'))} • {e.get('uploader') or ''}</div>", unsafe_allow_html=True)
-                chk = st.checkbox("Select", value=default, key=key)
-                if chk:
-                    selected_urls.append(url_item)
-                st.markdown("</div>", unsafe_allow_html=True)
-            st.markdown("</div>", unsafe_allow_html=True)
-
-            if st.button("⬇️ Download Selected & Create ZIP (IG)"):
-                if not selected_urls:
+            job_key = f"ig_zip::{ig_user.strip()}"
+            picked = media_grid(f"ig_grid::{ig_user.strip()}", entries, "⬇️ Download Selected & Create ZIP")
+            if info.get("has_more") and st.button(f"Load {PAGE_SIZE} more (IG)"):
+                st.session_state[pages_key] = st.session_state.get(pages_key, 1) + 1
+                st.rerun()
+
+            if picked is not None:
+                if not picked:
                     st.warning("No posts selected.")
                 else:
-                    st.info(f"Downloading {len(selected_urls)} selected posts...")
-                    files = download_with_animation(selected_urls, audio=False, cookie=cookie)
-                    if files:
-                        tmp_dir = OUT_DIR / f"tmp_zip_ig_{int(time.time())}"
-                        tmp_dir.mkdir(exist_ok=True)
-                        for f in files:
-                            src = Path(f)
-                            if src.exists():
-                                shutil.copy(src, tmp_dir / src.name)
-                        zip_name = OUT_DIR / f"{ig_user.strip()}_selected_{int(time.time())}.zip"
-                        shutil.make_archive(str(zip_name.with_suffix('')), 'zip', root_dir=tmp_dir)
-                        shutil.rmtree(tmp_dir)
-                        st.success(f"ZIP created: {zip_name.name}")
-                        with open(zip_name, "rb") as zf:
-                            st.download_button("⬇️ Download ZIP", data=zf, file_name=zip_name.name)
+                    st.info(f"Downloading {len(picked)} selected posts...")
+                    selected_urls = [e.get("webpage_url") or e.get("url") or e.get("id") for e in picked]
+                    download_with_animation(selected_urls, audio=False, cookie=cookie, job_key=job_key, zip_stem=ig_user.strip(), infos=picked)
+            show_download(job_key)
+            zip_button(job_key)
 
 # COOKIE
 elif page == "Cookie":
@@ -488,15 +715,10 @@ elif page == "About":
 - Built with Streamlit + yt-dlp.  
 - Developer: Tanzeel ur Rehman
 """)
+    cs = METADATA_CACHE.stats()
+    st.caption(f"Metadata cache: {cs['entries']} entries • {human_bytes(cs['bytes'])} • {cs['hits']} hits / {cs['misses']} misses")
+    st.caption(f"Metrics: {file_base_url() or f'http://<host>:{FILE_PORT}'}/metrics (Prometheus) • /metrics.json • event logs in {STATE_DIR / 'events'}")
     st.markdown("---")
-    recent = sorted(list(OUT_DIR.glob("*")), key=lambda p: p.stat().st_mtime, reverse=True)[:6]
-    if recent:
-        st.write("Recent files:")
-        cols = st.columns(min(3, len(recent)))
-        for i, f in enumerate(recent):
-            with cols[i % len(cols)]:
-                st.write(f.name)
-                with open(f, "rb") as fh:
-                    st.download_button("⬇️ Save", data=fh, file_name=f.name)
+    recent_files("Recent files:")
 
 st.markdown("</div>", unsafe_allow_html=True)
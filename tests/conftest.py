@@ -0,0 +1,25 @@
+# tests/conftest.py
+# The modules live at the repository root; importing downloader creates its state directory,
+# so point that at a throwaway one before any test imports it. bench/ holds the local media
+# server and the yt-dlp plugin that extracts from it (found by yt-dlp through sys.path).
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+BENCH_DIR = REPO_DIR / "bench"
+
+sys.path[:0] = [str(REPO_DIR), str(BENCH_DIR)]
+os.environ.setdefault("VD_STATE_DIR", tempfile.mkdtemp(prefix="vd-tests-"))
+
+
+@pytest.fixture
+def bench_server():
+    from server import BenchServer
+
+    server = BenchServer().start()
+    yield server
+    server.shutdown()
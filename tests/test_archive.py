@@ -0,0 +1,131 @@
+# tests/test_archive.py
+import sqlite3
+from concurrent.futures import Future
+
+import pytest
+
+import downloader
+from downloader import ItemResult, _audio_download, _finish_audio, _video_download
+from library import Library, archive_key
+
+INFO = {"id": "abc", "extractor_key": "Instagram"}
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    lib = Library(tmp_path / "library.sqlite")
+    monkeypatch.setattr(downloader, "LIBRARY", lib)
+    return lib
+
+
+def _files(tmp_path, *names):
+    paths = []
+    for n in names:
+        p = tmp_path / n
+        p.write_bytes(n.encode() * 10)
+        paths.append(str(p))
+    return paths
+
+
+def test_hit_returns_every_file_in_order(library, tmp_path):
+    files = _files(tmp_path, "b.jpg", "a.mp4", "c.jpg")
+    library.archive([archive_key(INFO, "video:best"), "url:x"], files)
+    assert library.archived(archive_key(INFO, "video:best")) == files
+    assert library.archived(None, "url:x") == files
+    assert library.archive_stats() == {"keys": 2, "files": 3}
+
+
+def test_miss(library, tmp_path):
+    library.archive(["k"], _files(tmp_path, "a.mp4"))
+    assert library.archived("other", None) is None
+    assert library.archived(archive_key({"title": "no id"}, "video:best")) is None
+
+
+@pytest.mark.parametrize("damage", ["delete", "rewrite"])
+def test_entry_with_a_missing_or_changed_file_is_dropped(library, tmp_path, damage):
+    files = _files(tmp_path, "1.jpg", "2.jpg")
+    library.archive(["k"], files)
+    if damage == "delete":
+        (tmp_path / "2.jpg").unlink()
+    else:
+        (tmp_path / "2.jpg").write_bytes(b"different length")
+    assert library.archived("k") is None
+    (tmp_path / "2.jpg").write_bytes(b"2.jpg" * 10)
+    assert library.archived("k") is None  # dropped as a whole, not revived
+    assert library.archive_stats()["keys"] == 0
+
+
+def test_removing_one_file_drops_the_entry(library, tmp_path):
+    files = _files(tmp_path, "1.jpg", "2.jpg")
+    library.archive(["k"], files)
+    library.remove(library.token_for(files[1]))
+    assert library.archived("k") is None
+    assert library.token_for(files[0]) is not None  # still indexed as a download
+
+
+def test_rearchiving_replaces_the_files(library, tmp_path):
+    library.archive(["k"], _files(tmp_path, "1.jpg", "2.jpg"))
+    newer = _files(tmp_path, "3.mp4")
+    library.archive(["k"], newer)
+    assert library.archived("k") == newer
+
+
+def test_single_file_archive_is_migrated(tmp_path):
+    path = _files(tmp_path, "a.mp4")[0]
+    lib = Library(tmp_path / "library.sqlite")
+    st = (tmp_path / "a.mp4").stat()
+    db = sqlite3.connect(str(tmp_path / "library.sqlite"))
+    db.execute("DROP TABLE archive_files")
+    db.execute("CREATE TABLE archive (key TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL,"
+               " mtime REAL NOT NULL, sha256 TEXT NOT NULL, added REAL NOT NULL)")
+    db.execute("INSERT INTO archive VALUES ('k', ?, ?, ?, '', 0)", (path, st.st_size, st.st_mtime))
+    db.commit()
+    db.close()
+    del lib
+    assert Library(tmp_path / "library.sqlite").archived("k") == [path]
+
+
+def test_video_download_reuses_every_archived_file(library, tmp_path, monkeypatch):
+    files = _files(tmp_path, "1.jpg", "2.mp4")
+    calls = []
+
+    def fake_download(ydl_opts, url, hooks=None, info=None):
+        calls.append(url)
+        return ItemResult(url, info=INFO, files=list(files))
+
+    monkeypatch.setattr(downloader, "_download_one", fake_download)
+    url = "https://www.instagram.com/p/abc/"
+    item = _video_download({url: INFO})
+    opts = {"format": "best"}
+    assert item(opts, url).files == files
+    assert item(opts, url).files == files
+    assert calls == [url]
+    # a bare URL (no info dict) hits through the URL key
+    assert _video_download({})(opts, url).files == files
+    (tmp_path / "1.jpg").unlink()
+    item(opts, url)
+    assert calls == [url, url]
+
+
+def test_audio_download_extracts_and_archives_every_file(library, tmp_path, monkeypatch):
+    sources = _files(tmp_path, "1.m4a", "2.m4a")
+    submitted = []
+
+    def fake_submit(src, target, quality, acodec=None, dest_dir=None, remove_source=False):
+        out = tmp_path / (src.rsplit("/", 1)[1] + ".mp3")
+        out.write_bytes(b"mp3")
+        submitted.append(src)
+        f = Future()
+        f.set_result((str(out), "encode", 0.01))
+        return f
+
+    monkeypatch.setattr(downloader.transcode, "submit", fake_submit)
+    monkeypatch.setattr(downloader, "_download_one",
+                        lambda ydl_opts, url, hooks=None, info=None, extra=None: ItemResult(url, info=INFO, files=list(sources)))
+    url = "https://www.instagram.com/p/abc/"
+    r = _audio_download("mp3", 192, {url: INFO})({}, url)
+    _finish_audio(r, "mp3", 192)
+    assert submitted == sources
+    assert r.files == [s + ".mp3" for s in sources]
+    hit = _audio_download("mp3", 192, {url: INFO})({}, url)
+    assert hit.pending is None and hit.files == r.files
@@ -0,0 +1,73 @@
+# tests/test_bandwidth.py
+import math
+
+import pytest
+
+from bandwidth import BULK, INTERACTIVE, Scheduler, allocate
+
+INF = math.inf
+
+
+def test_no_limits_leaves_every_flow_unlimited():
+    rates = allocate({"a": ("h1", 1.0, INF), "b": ("h2", 1.0, INF)})
+    assert rates == {"a": INF, "b": INF}
+
+
+def test_global_capacity_is_split_by_weight():
+    rates = allocate({"a": ("h1", 1.0, INF), "b": ("h2", 1.0, INF), "c": ("h1", 2.0, INF)}, capacity=12)
+    assert rates == pytest.approx({"a": 3, "b": 3, "c": 6})
+
+
+def test_demand_cap_is_redistributed():
+    # a wants less than its fair half: the rest goes to b
+    rates = allocate({"a": ("h1", 1.0, 2.0), "b": ("h2", 1.0, INF)}, capacity=10)
+    assert rates == pytest.approx({"a": 2, "b": 8})
+
+
+def test_all_demands_below_capacity_are_met():
+    rates = allocate({"a": ("h1", 1.0, 2.0), "b": ("h2", 3.0, 3.0)}, capacity=10)
+    assert rates == pytest.approx({"a": 2, "b": 3})
+
+
+def test_host_capacity_applies_per_host():
+    flows = {"a": ("h1", 1.0, INF), "b": ("h1", 1.0, INF), "c": ("h2", 1.0, INF)}
+    assert allocate(flows, host_capacity=10) == pytest.approx({"a": 5, "b": 5, "c": 10})
+
+
+def test_host_capacity_frees_global_capacity_for_other_hosts():
+    # h1 fills its 4 first; c then gets the rest of the global 7 (below its own host cap)
+    flows = {"a": ("h1", 1.0, INF), "b": ("h1", 1.0, INF), "c": ("h2", 1.0, INF)}
+    assert allocate(flows, capacity=7, host_capacity=4) == pytest.approx({"a": 2, "b": 2, "c": 3})
+
+
+def test_demand_and_host_caps_together():
+    flows = {"a": ("h1", 1.0, 1.0), "b": ("h1", 1.0, INF), "c": ("h2", 4.0, INF)}
+    rates = allocate(flows, capacity=12, host_capacity=5)
+    assert rates == pytest.approx({"a": 1, "b": 4, "c": 5})
+    assert sum(rates.values()) <= 12 + 1e-9
+
+
+def test_zero_weight_flow_is_not_limited():
+    rates = allocate({"a": ("h1", 0.0, INF), "b": ("h1", 1.0, INF)}, capacity=10)
+    assert rates == {"a": INF, "b": pytest.approx(10)}
+
+
+def test_shares_split_a_session_between_its_flows():
+    rows = [
+        ("j1", "h1", "s1", BULK, 1.0, None),
+        ("j2", "h1", "s1", BULK, 1.0, None),
+        ("j3", "h2", "s2", BULK, 1.0, None),
+        ("j4", "h2", "s3", INTERACTIVE, 1.0, 3.0),
+    ]
+    flows = Scheduler.shares(rows)
+    assert flows[("j1", "h1")] == ("h1", 0.5, INF)
+    assert flows[("j3", "h2")] == ("h2", 1.0, INF)
+    assert flows[("j4", "h2")] == ("h2", 4.0, 3.0)
+    rates = allocate(flows, capacity=11)
+    # the interactive flow only wants 3; the 8 left are shared 1:1 between the two bulk sessions
+    assert rates == pytest.approx({("j1", "h1"): 2, ("j2", "h1"): 2, ("j3", "h2"): 4, ("j4", "h2"): 3})
+
+
+def test_shares_apply_job_weight():
+    flows = Scheduler.shares([("j1", "h1", "s1", BULK, 2.0, None), ("j2", "h1", "s2", BULK, 1.0, None)])
+    assert allocate(flows, capacity=9) == pytest.approx({("j1", "h1"): 6, ("j2", "h1"): 3})
@@ -0,0 +1,94 @@
+# tests/test_cursors.py
+import threading
+
+import pytest
+
+import downloader
+from downloader import fetch_account_page
+from metacache import MetadataCache
+
+ACCOUNT = "https://www.tiktok.com/@someone"
+
+
+@pytest.fixture
+def cursors(monkeypatch):
+    """Every fake cursor opened, in order; a cursor's take() waits while its `gate` is cleared."""
+    opened = []
+
+    class FakeCursor:
+        def __init__(self, url, cookie):
+            self.url, self.position, self.exhausted, self.closed = url, 0, False, False
+            self.used = downloader.time.time()
+            self.header = {"title": url}
+            self.gate = threading.Event()
+            self.gate.set()
+            self.taking = threading.Event()
+            opened.append(self)
+
+        def take(self, start, count):
+            assert not self.closed
+            self.taking.set()
+            self.gate.wait(5)
+            assert not self.closed, "closed while in use"
+            batch = [{"id": str(i), "url": f"{self.url}/video/{i}"} for i in range(start, start + count)]
+            self.position = start + count
+            self.used = downloader.time.time()
+            return batch
+
+        def close(self):
+            self.closed = True
+
+    monkeypatch.setattr(downloader, "_Cursor", FakeCursor)
+    monkeypatch.setattr(downloader, "METADATA_CACHE", MetadataCache())
+    monkeypatch.setattr(downloader, "_cursors", {})
+    monkeypatch.setattr(downloader, "_cursor_locks", {})
+    return opened
+
+
+def _expire(cur):
+    cur.used -= downloader.CURSOR_TTL + 1
+
+
+def test_next_page_continues_the_cursor(cursors):
+    assert [e["id"] for e in fetch_account_page(ACCOUNT, page=0, page_size=2)["entries"]] == ["0", "1"]
+    assert [e["id"] for e in fetch_account_page(ACCOUNT, page=1, page_size=2)["entries"]] == ["2", "3"]
+    assert len(cursors) == 1
+
+
+def test_idle_cursor_is_closed_with_its_lock(cursors):
+    fetch_account_page(ACCOUNT, page=0)
+    _expire(cursors[0])
+    fetch_account_page("https://www.tiktok.com/@other", page=0)
+    assert cursors[0].closed
+    assert len(downloader._cursors) == len(downloader._cursor_locks) == 1
+
+
+def test_cursor_in_use_is_not_closed(cursors):
+    fetch_account_page(ACCOUNT, page=0, page_size=2)
+    cur = cursors[0]
+    cur.gate.clear()
+    cur.taking.clear()
+    worker = threading.Thread(target=fetch_account_page, args=(ACCOUNT,), kwargs={"page": 1, "page_size": 2})
+    worker.start()
+    assert cur.taking.wait(5)
+    _expire(cur)  # idle by its timestamp, but a page is being taken from it
+    fetch_account_page("https://www.tiktok.com/@other", page=0)
+    assert not cur.closed
+    cur.gate.set()
+    worker.join(5)
+    assert not cur.closed and downloader._cursors[next(k for k in downloader._cursors if "someone" in k)] is cur
+
+
+def test_lock_without_a_cursor_is_dropped(cursors, monkeypatch):
+    fake = downloader._Cursor
+
+    def failing(url, cookie):
+        raise RuntimeError("private account")
+
+    monkeypatch.setattr(downloader, "_Cursor", failing)
+    with pytest.raises(RuntimeError):
+        fetch_account_page(ACCOUNT, page=0)
+    assert len(downloader._cursor_locks) == 1
+    monkeypatch.setattr(downloader, "_Cursor", fake)
+    fetch_account_page("https://www.tiktok.com/@other", page=0)
+    assert list(downloader._cursor_locks) == list(downloader._cursors)
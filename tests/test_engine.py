@@ -0,0 +1,114 @@
+# tests/test_engine.py
+import threading
+import time
+from collections import defaultdict
+
+import pytest
+
+from downloader import DownloadEngine, ItemResult, host_of
+
+
+class _Probe:
+    """Task factory recording how many tasks ran at once, overall and per host."""
+
+    def __init__(self, hold: float = 0.05):
+        self.hold = hold
+        self.lock = threading.Lock()
+        self.running = 0
+        self.per_host = defaultdict(int)
+        self.peak = 0
+        self.peak_per_host = defaultdict(int)
+        self.started = []
+
+    def task(self, url: str):
+        def _run() -> ItemResult:
+            host = host_of(url)
+            with self.lock:
+                self.running += 1
+                self.per_host[host] += 1
+                self.peak = max(self.peak, self.running)
+                self.peak_per_host[host] = max(self.peak_per_host[host], self.per_host[host])
+                self.started.append(url)
+            time.sleep(self.hold)
+            with self.lock:
+                self.running -= 1
+                self.per_host[host] -= 1
+            return ItemResult(url)
+        return _run
+
+
+def test_per_host_and_global_limits():
+    engine = DownloadEngine(max_workers=4, per_host=2)
+    probe = _Probe()
+    urls = [f"https://a.test/{i}" for i in range(6)] + [f"https://b.test/{i}" for i in range(3)] + ["https://c.test/0"]
+    futures = [engine.submit(u, probe.task(u)) for u in urls]
+    assert [f.result(5).url for f in futures] == urls
+    assert probe.peak == 4
+    assert probe.peak_per_host == {"a.test": 2, "b.test": 2, "c.test": 1}
+
+
+def test_waiting_host_does_not_block_other_hosts():
+    # a.test's backlog is queued first, but b.test items take the free slots instead of waiting behind it
+    engine = DownloadEngine(max_workers=3, per_host=1)
+    probe = _Probe(hold=0.1)
+    urls = [f"https://a.test/{i}" for i in range(4)] + ["https://b.test/0", "https://c.test/0"]
+    futures = [engine.submit(u, probe.task(u)) for u in urls]
+    for f in futures:
+        f.result(5)
+    assert set(probe.started[:3]) == {"https://a.test/0", "https://b.test/0", "https://c.test/0"}
+    assert probe.peak_per_host["a.test"] == 1
+
+
+def test_www_prefix_counts_as_the_same_host():
+    engine = DownloadEngine(max_workers=4, per_host=1)
+    probe = _Probe()
+    urls = ["https://www.a.test/0", "https://a.test/1", "https://www.a.test/2"]
+    for f in [engine.submit(u, probe.task(u)) for u in urls]:
+        f.result(5)
+    assert probe.peak == 1
+
+
+def test_exception_reaches_the_future_and_frees_the_slot():
+    engine = DownloadEngine(max_workers=1, per_host=1)
+
+    def boom() -> ItemResult:
+        raise RuntimeError("extractor failed")
+
+    failed = engine.submit("https://a.test/0", boom)
+    ok = engine.submit("https://a.test/1", lambda: ItemResult("https://a.test/1"))
+    with pytest.raises(RuntimeError, match="extractor failed"):
+        failed.result(5)
+    assert ok.result(5).url == "https://a.test/1"
+
+
+def test_map_keeps_input_order_and_passes_infos():
+    engine = DownloadEngine(max_workers=3, per_host=3)
+    seen = []
+
+    def download(opts, url, hooks, info):
+        time.sleep(0.03 if url.endswith("0") else 0)
+        seen.append((url, info))
+        return ItemResult(url, info=info)
+
+    urls = ["https://a.test/0", "https://a.test/1", "https://b.test/2"]
+    infos = [{"id": "x"}, None, {"id": "z"}]
+    results = engine.map({}, urls, infos=infos, download=download)
+    assert [r.url for r in results] == urls
+    assert [r.info for r in results] == infos
+    assert len(seen) == 3
+
+
+def test_map_skips_items_not_started_when_cancelled():
+    engine = DownloadEngine(max_workers=1, per_host=1)
+    cancelled = threading.Event()
+    started = []
+
+    def download(opts, url, hooks, info):
+        started.append(url)
+        cancelled.set()  # e.g. the job was cancelled while its first item ran
+        return ItemResult(url)
+
+    urls = [f"https://a.test/{i}" for i in range(4)]
+    results = engine.map({}, urls, download=download, cancelled=cancelled)
+    assert started == urls[:1]
+    assert [r.error for r in results] == [None, "cancelled", "cancelled", "cancelled"]
@@ -0,0 +1,37 @@
+# tests/test_fileserve.py
+import pytest
+
+from fileserve import parse_range
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=500-", (500, 999)),
+    ("bytes=900-2000", (900, 999)),  # end past the file is clamped
+    ("bytes=-100", (900, 999)),  # suffix: last 100 bytes
+    ("bytes=-5000", (0, 999)),  # suffix longer than the file
+    (" bytes=0-0 ", (0, 0)),
+    ("bytes=999-999", (999, 999)),
+])
+def test_satisfiable(header, expected):
+    assert parse_range(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=1000-1001", "bytes=10-5", "bytes=-0"])
+def test_unsatisfiable(header):
+    assert parse_range(header, SIZE) == (-1, -1)
+
+
+@pytest.mark.parametrize("header", ["bytes=-", "bytes=0-1,5-9", "items=0-9", "bytes=a-b", "0-9"])
+def test_unsupported_is_ignored(header):
+    # answered with the whole file (200), not an error
+    assert parse_range(header, SIZE) is None
+
+
+def test_empty_file():
+    assert parse_range("bytes=0-", 0) == (-1, -1)
+    assert parse_range("bytes=-10", 0) == (-1, -1)
@@ -0,0 +1,132 @@
+# tests/test_jobqueue.py
+import os
+import sys
+import time
+import types
+
+import pytest
+
+from bandwidth import BULK, INTERACTIVE
+from conftest import BENCH_DIR, REPO_DIR
+from jobqueue import CANCELLED, DONE, FAILED, MAX_ATTEMPTS, QUEUED, RUNNING, TERMINAL, JobQueue, WorkerPool
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(tmp_path / "jobs.sqlite")
+
+
+def test_claim_order(queue):
+    bulk_a1 = queue.submit({"n": 1}, session="a")
+    bulk_a2 = queue.submit({"n": 2}, session="a")
+    bulk_b = queue.submit({"n": 3}, session="b")
+    interactive = queue.submit({"n": 4}, session="c", priority=INTERACTIVE)
+    assert queue.status(interactive)["position"] == 1
+    assert queue.status(bulk_a2)["position"] == 3
+    # interactive first, then the oldest bulk job; then b, whose session has nothing running yet
+    assert [queue.claim(1)["id"] for _ in range(4)] == [interactive, bulk_a1, bulk_b, bulk_a2]
+    assert queue.claim(1) is None
+    assert queue.counts() == {RUNNING: 4}
+
+
+def test_claim_marks_running(queue):
+    job_id = queue.submit({"urls": ["u"]}, session="s")
+    job = queue.claim(42)
+    assert job == {"id": job_id, "payload": {"urls": ["u"]}, "session": "s", "priority": BULK, "weight": 1.0}
+    status = queue.status(job_id)
+    assert status["state"] == RUNNING and status["attempts"] == 1 and status["started"]
+
+
+def test_cancel_queued_job_at_once(queue):
+    job_id = queue.submit({})
+    queue.cancel(job_id)
+    assert queue.status(job_id)["state"] == CANCELLED
+    assert queue.claim(1) is None
+
+
+def test_cancel_running_job_is_requested(queue):
+    job_id = queue.submit({})
+    queue.claim(1)
+    assert not queue.cancel_requested(job_id)
+    queue.cancel(job_id)
+    assert queue.cancel_requested(job_id)
+    assert queue.status(job_id)["state"] == RUNNING  # the worker stops it and records the outcome
+
+
+def test_result_only_once_finished(queue):
+    job_id = queue.submit({})
+    queue.claim(1)
+    assert queue.result(job_id) is None
+    queue.finish(job_id, DONE, {"files": ["a"], "errors": [], "zip_name": None})
+    assert queue.result(job_id) == {"files": ["a"], "errors": [], "zip_name": None}
+
+
+def test_heartbeat_keeps_a_running_job(queue):
+    job_id = queue.submit({})
+    queue.claim(1)
+    time.sleep(0.3)
+    queue.set_progress(job_id, {"items": []})
+    assert queue.requeue_orphans(timeout=0.2) == 0
+    assert queue.status(job_id)["state"] == RUNNING
+
+
+def test_requeue_orphans(queue):
+    job_id = queue.submit({})
+    queue.claim(1)
+    assert queue.requeue_orphans(timeout=60) == 0
+    time.sleep(0.05)
+    assert queue.requeue_orphans(timeout=0) == 1
+    assert queue.status(job_id)["state"] == QUEUED
+    assert queue.claim(2)["id"] == job_id
+
+
+def test_orphan_fails_after_max_attempts(queue):
+    job_id = queue.submit({})
+    for _ in range(MAX_ATTEMPTS):
+        queue.claim(1)
+        time.sleep(0.05)
+        queue.requeue_orphans(timeout=0)
+    status = queue.status(job_id)
+    assert status["state"] == FAILED and status["attempts"] == MAX_ATTEMPTS
+
+
+def test_prune_drops_only_old_finished_jobs(queue):
+    old_cancelled, old_done, running, fresh = (queue.submit({}) for _ in range(4))
+    queue.cancel(old_cancelled)
+    for _ in range(3):
+        queue.claim(1)
+    queue.finish(old_done, DONE, {"files": [], "errors": [], "zip_name": None})
+    time.sleep(0.05)
+    queue.finish(fresh, DONE, {"files": [], "errors": [], "zip_name": None})
+    assert queue.prune(max_age=0.03) == 2
+    assert queue.status(old_done) is None and queue.status(old_cancelled) is None
+    assert queue.status(running)["state"] == RUNNING
+    assert queue.status(fresh)["state"] == DONE
+    assert queue.prune() == 0
+
+
+def test_worker_pool_runs_a_job(tmp_path, monkeypatch, bench_server):
+    # under `streamlit run`, __main__ is the app script: workers must not go through it
+    app = tmp_path / "app.py"
+    app.write_text("raise SystemExit('the app script was re-executed')\n")
+    fake_main = types.ModuleType("__main__")
+    fake_main.__file__ = str(app)
+    monkeypatch.setitem(sys.modules, "__main__", fake_main)
+    # workers inherit cwd (downloads/) and env (state directory, the bench extractor plugin)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("VD_STATE_DIR", str(tmp_path / ".state"))
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join([str(REPO_DIR), str(BENCH_DIR)]))
+
+    queue = JobQueue(tmp_path / "jobs.sqlite")
+    job_id = queue.submit({"urls": [bench_server.video_url("pool-000", size=65536)], "audio": False, "zip_stem": "t"})
+    pool = WorkerPool(queue.db_path, processes=1).ensure_running()
+    try:
+        deadline = time.time() + 60
+        while queue.status(job_id)["state"] not in TERMINAL and time.time() < deadline:
+            time.sleep(0.2)
+    finally:
+        pool.stop()
+    assert queue.status(job_id)["state"] == DONE
+    result = queue.result(job_id)
+    assert [os.path.getsize(f) for f in result["files"]] == [65536]
+    assert result["zip_name"].startswith("t_selected_")
@@ -0,0 +1,134 @@
+# tests/test_metacache.py
+import threading
+import time
+
+import pytest
+
+from metacache import MetadataCache, normalize_url
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://www.TikTok.com/@user/", "https://tiktok.com/@user"),
+    ("https://m.youtube.com/watch?v=abc&si=share&feature=shared", "https://youtube.com/watch?v=abc"),
+    ("https://www.instagram.com/p/XYZ/?igsh=abc&utm_source=ig_web", "https://instagram.com/p/XYZ"),
+    ("https://example.com/v?b=2&a=1#t=10", "https://example.com/v?a=1&b=2"),
+    ("  https://example.com  ", "https://example.com/"),
+    ("https://vm.tiktok.com/ZM123/", "https://tiktok.com/ZM123"),
+    ("https://example.com:443/a", "https://example.com/a"),
+    ("http://127.0.0.1:8000/v/x", "http://127.0.0.1:8000/v/x"),
+    ("http://[::1]:8000/v/x", "http://[::1]:8000/v/x"),
+])
+def test_normalize_url(url, expected):
+    assert normalize_url(url) == expected
+
+
+def test_normalize_url_keeps_ports_apart():
+    assert normalize_url("http://host:8000/v/x") != normalize_url("http://host:9000/v/x")
+
+
+def test_evicts_least_recently_used_by_count():
+    cache = MetadataCache(max_entries=2)
+    cache.put("a", {"v": 1}, 60)
+    cache.put("b", {"v": 2}, 60)
+    assert cache.get("a") == {"v": 1}  # a is now the most recently used
+    cache.put("c", {"v": 3}, 60)
+    assert cache.get("b") is None
+    assert cache.get("a") == {"v": 1}
+    assert cache.get("c") == {"v": 3}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_evicts_by_bytes():
+    blob = "x" * 100
+    cache = MetadataCache(max_entries=100, max_bytes=250)
+    for key in ("a", "b", "c"):
+        cache.put(key, blob, 60)
+    assert cache.get("a") is None
+    assert cache.get("b") == blob and cache.get("c") == blob
+    assert cache.stats()["bytes"] <= 250
+
+
+def test_replacing_a_key_does_not_double_count_bytes():
+    cache = MetadataCache(max_bytes=1000)
+    cache.put("a", "x" * 100, 60)
+    cache.put("a", "y" * 100, 60)
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["bytes"] == len('"' + "y" * 100 + '"')
+
+
+def test_expired_entries_are_misses():
+    cache = MetadataCache()
+    cache.put("a", 1, -1)
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_persists_across_instances(tmp_path):
+    db = tmp_path / "meta.sqlite"
+    first = MetadataCache(db, max_entries=2)
+    first.put("a", {"v": 1}, 60)
+    first.put("b", {"v": 2}, 60)
+    first.put("c", {"v": 3}, 60)  # evicts a, also from disk
+    second = MetadataCache(db, max_entries=2)
+    assert second.get("a") is None
+    assert second.get("b") == {"v": 2} and second.get("c") == {"v": 3}
+
+
+def test_expired_entries_are_dropped_on_load(tmp_path):
+    db = tmp_path / "meta.sqlite"
+    first = MetadataCache(db)
+    first.put("old", {"v": 0}, -1)
+    first.put("new", {"v": 1}, 60)
+    second = MetadataCache(db)
+    assert second.stats()["entries"] == 1
+    assert second.get("new") == {"v": 1}
+
+
+def test_concurrent_misses_run_one_load():
+    cache = MetadataCache()
+    calls = []
+    gate = threading.Event()
+
+    def loader():
+        calls.append(1)
+        gate.wait(5)
+        return {"v": 1}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("k", loader, 60))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    gate.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1
+    assert results == [{"v": 1}] * 8
+
+
+def test_failed_or_empty_loads_are_not_cached():
+    cache = MetadataCache()
+    with pytest.raises(ValueError):
+        cache.get_or_load("k", lambda: (_ for _ in ()).throw(ValueError("boom")), 60)
+    assert cache.get_or_load("k", lambda: None, 60) is None
+    assert cache.get_or_load("k", lambda: {"v": 2}, 60) == {"v": 2}
+
+
+def test_reads_through_to_entries_another_instance_stored(tmp_path):
+    db = tmp_path / "meta.sqlite"
+    worker = MetadataCache(db)  # started first, like a queue worker next to the app
+    app = MetadataCache(db)
+    app.put("k", {"v": 1}, 60)
+    assert worker.get("k") == {"v": 1}
+    assert worker.stats()["entries"] == 1
+
+
+def test_expired_copy_in_memory_does_not_hide_a_fresh_one_on_disk(tmp_path):
+    db = tmp_path / "meta.sqlite"
+    worker = MetadataCache(db)
+    worker.put("k", {"v": 1}, 0.05)
+    app = MetadataCache(db)
+    time.sleep(0.1)
+    app.put("k", {"v": 2}, 60)
+    assert worker.get("k") == {"v": 2}
+    assert MetadataCache(db).get("k") == {"v": 2}
@@ -0,0 +1,49 @@
+# tests/test_metrics.py
+import json
+import os
+import time
+
+from metrics import LIVE_DUMP, REGISTRY, Registry, collect, key
+
+
+def _dump(directory, pid, counters=(), gauges=(), age=0.0):
+    path = directory / f"{pid}.json"
+    path.write_text(json.dumps({"counters": list(counters), "gauges": list(gauges), "histograms": []}))
+    then = time.time() - age
+    os.utime(path, (then, then))
+
+
+def _value(data, kind, name, **labels):
+    return sum(v for n, l, v in data[kind] if n == name and l == {k: str(x) for k, x in labels.items()})
+
+
+def test_counters_of_every_dump_but_gauges_of_live_ones_only(tmp_path):
+    _dump(tmp_path, 101, [["t_items_total", {}, 3]], [["t_inflight", {}, 2]])
+    _dump(tmp_path, 102, [["t_items_total", {}, 4]], [["t_inflight", {}, 5]], age=LIVE_DUMP + 60)  # a dead worker
+    data = collect(tmp_path)
+    assert _value(data, "counters", "t_items_total") == 7
+    assert _value(data, "gauges", "t_inflight") == 2
+
+
+def test_stale_dumps_are_deleted(tmp_path):
+    _dump(tmp_path, 103, [["t_old_total", {}, 1]], age=2 * 86400)
+    assert _value(collect(tmp_path), "counters", "t_old_total") == 0
+    assert not (tmp_path / "103.json").exists()
+
+
+def test_shared_collectors_stay_out_of_dumps():
+    registry = Registry()
+    registry.collector(lambda: {key("t_own"): 1})
+    registry.collector(lambda: {key("t_shared_rows"): 10}, shared=True)
+    names = lambda snap: {name for name, _, _ in snap["gauges"]}
+    assert names(registry.snapshot()) == {"t_own", "t_shared_rows"}
+    assert names(registry.snapshot(shared=False)) == {"t_own"}
+
+
+def test_shared_gauge_is_counted_once(tmp_path):
+    REGISTRY.collector(lambda: {key("t_archive_keys"): 10}, shared=True)
+    # workers' dumps are written with snapshot(shared=False)
+    for pid in (201, 202):
+        snap = REGISTRY.snapshot(shared=False)
+        (tmp_path / f"{pid}.json").write_text(json.dumps(snap))
+    assert _value(collect(tmp_path), "gauges", "t_archive_keys") == 10
@@ -0,0 +1,61 @@
+# tests/test_reuse.py
+# A grid selection starts its download from the info dicts the preview resolved: no second extraction.
+import pytest
+
+import downloader
+from downloader import _yt_download_worker, build_ydl_opts, formats_fresh, resolve_entries, reusable_info
+from metacache import MetadataCache
+from server import _Handler
+
+
+@pytest.fixture
+def api_calls(monkeypatch):
+    """Paths of the extractor requests (/api/...) the bench server answered."""
+    calls = []
+    do_get = _Handler.do_GET
+
+    def counting(handler):
+        if handler.path.startswith("/api/"):
+            calls.append(handler.path)
+        do_get(handler)
+
+    monkeypatch.setattr(_Handler, "do_GET", counting)
+    return calls
+
+
+def _flat(url: str, media_id: str) -> dict:
+    # what a flat (extract_flat) playlist entry looks like: a page URL, no formats, no title
+    return {"_type": "url", "ie_key": "VDBench", "id": media_id, "url": url, "webpage_url": url}
+
+
+def test_resolved_entry_is_a_usable_download_info(bench_server, api_calls):
+    url = bench_server.video_url("reuse-000", size=4096)
+    [entry] = resolve_entries([_flat(url, "reuse-000")])
+    assert entry.get("_type", "video") == "video"
+    assert entry["title"] == "bench reuse-000" and entry["formats"]
+    assert formats_fresh(entry)
+    assert reusable_info(url, entry) is entry
+    assert len(api_calls) == 1
+
+
+def test_grid_selection_downloads_without_extracting_again(bench_server, api_calls, tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "OUT_DIR", tmp_path)
+    url = bench_server.video_url("reuse-001", size=4096)
+    picked = resolve_entries([_flat(url, "reuse-001")])
+    paths = []
+    _yt_download_worker(build_ydl_opts(), [url], paths, infos=picked)
+    assert [p for p in paths if p.startswith("__ERROR__")] == []
+    assert len(paths) == 1 and paths[0].startswith(str(tmp_path))
+    assert len(api_calls) == 1  # the preview's extraction only
+
+
+def test_queue_worker_finds_the_apps_resolved_info(bench_server, api_calls, monkeypatch):
+    url = bench_server.video_url("reuse-002", size=4096)
+    flat = _flat(url, "reuse-002")
+    # a queue worker has its own MetadataCache on the same database, opened before the app resolved
+    worker_cache = MetadataCache(downloader.STATE_DIR / "metadata.sqlite")
+    resolve_entries([flat])
+    monkeypatch.setattr(downloader, "METADATA_CACHE", worker_cache)
+    info = reusable_info(url, flat)
+    assert formats_fresh(info) and info["id"] == "reuse-002"
+    assert len(api_calls) == 1
@@ -0,0 +1,148 @@
+# tests/test_segmented.py
+import os
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import downloader
+import segmented
+from downloader import _download_one, build_ydl_opts
+from metrics import REGISTRY, key
+from server import BenchServer, _Handler
+
+PAYLOAD = os.urandom(300_000)
+
+
+class _Flaky(BaseHTTPRequestHandler):
+    """Serves PAYLOAD with ranges; the first `drops` answers for each range end stop halfway through."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        first, _, last = self.headers["Range"][len("bytes="):].partition("-")
+        start, end = int(first), min(int(last or len(PAYLOAD) - 1), len(PAYLOAD) - 1)
+        with self.server.lock:
+            self.server.requests.append((start, end))
+            n = self.server.tries[end] = self.server.tries.get(end, 0) + 1
+        self.send_response(HTTPStatus.PARTIAL_CONTENT)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+        self.end_headers()
+        if end > start and n <= self.server.drops:
+            self.wfile.write(PAYLOAD[start:start + (end - start + 1) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(PAYLOAD[start:end + 1])
+
+
+@pytest.fixture
+def flaky():
+    def start(drops: int):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _Flaky)
+        server.daemon_threads = True
+        server.lock, server.requests, server.tries, server.drops = threading.Lock(), [], {}, drops
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server, f"http://127.0.0.1:{server.server_address[1]}/f.bin"
+
+    servers = []
+    yield start
+    for s in servers:
+        s.shutdown()
+
+
+def test_split_covers_every_byte_once():
+    assert segmented.split(10, 3) == [(0, 3), (4, 7), (8, 9)]
+    assert segmented.split(2, 4) == [(0, 0), (1, 1)]
+    for size, parts in ((1, 1), (1000, 7), (999_999, 4)):
+        ranges = segmented.split(size, parts)
+        assert ranges[0][0] == 0 and ranges[-1][1] == size - 1
+        assert all(b[0] == a[1] + 1 for a, b in zip(ranges, ranges[1:]))
+
+
+def test_segments_are_reassembled_in_place(flaky, tmp_path):
+    _, url = flaky(drops=0)
+    dest = str(tmp_path / "f.bin")
+    seen = []
+    assert segmented.download(url, dest, segments=4, hooks=[seen.append]) == len(PAYLOAD)
+    assert open(dest, "rb").read() == PAYLOAD
+    assert not os.path.exists(dest + ".part")
+    assert seen[-1]["downloaded_bytes"] == seen[-1]["total_bytes"] == len(PAYLOAD)
+
+
+def test_a_dropped_segment_resumes_where_it_stopped(flaky, tmp_path, monkeypatch):
+    monkeypatch.setattr(segmented, "CHUNK_SIZE", 10_000)  # the cut (half a range) falls on a chunk boundary
+    server, url = flaky(drops=1)
+    dest = str(tmp_path / "f.bin")
+    segmented.download(url, dest, total=len(PAYLOAD), segments=3)
+    assert open(dest, "rb").read() == PAYLOAD
+    # each range: one cut-off attempt, then a retry for the rest only
+    for start, end in segmented.split(len(PAYLOAD), 3):
+        resumed = [r for r in server.requests if r[1] == end and r[0] > start]
+        assert resumed == [(start + (end - start + 1) // 2, end)]
+
+
+def test_retries_give_up_and_leave_no_part_file(flaky, tmp_path, monkeypatch):
+    monkeypatch.setattr(segmented, "RETRIES", 2)
+    _, url = flaky(drops=10 ** 6)
+    dest = str(tmp_path / "f.bin")
+    with pytest.raises(segmented.SegmentError, match="after 2 attempts"):
+        segmented.download(url, dest, total=len(PAYLOAD), segments=2)
+    assert not os.path.exists(dest) and not os.path.exists(dest + ".part")
+
+
+def test_probe_without_range_support():
+    server = BenchServer(ranges=False).start()
+    try:
+        with pytest.raises(segmented.RangesUnsupported):
+            segmented.probe(f"{server.base_url}/media/x.mp4?size=4096", {})
+    finally:
+        server.shutdown()
+    server = BenchServer().start()
+    try:
+        assert segmented.probe(f"{server.base_url}/media/x.mp4?size=4096", {}) == 4096
+    finally:
+        server.shutdown()
+
+
+@pytest.fixture
+def media_ranges(monkeypatch):
+    """Range headers of the media requests the bench server answered."""
+    seen = []
+    do_get = _Handler.do_GET
+
+    def recording(handler):
+        if handler.path.startswith("/media/"):
+            seen.append(handler.headers.get("Range"))
+        do_get(handler)
+
+    monkeypatch.setattr(_Handler, "do_GET", recording)
+    return seen
+
+
+@pytest.mark.parametrize("ranges", [True, False])
+def test_download_uses_segments_or_falls_back(ranges, media_ranges, tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "OUT_DIR", tmp_path)
+    monkeypatch.setattr(segmented, "MIN_SIZE", 0)
+    monkeypatch.setattr(segmented, "SEGMENTS", 4)
+    fallbacks = key("vd_segmented_fallbacks_total", host="127.0.0.1")
+    before = REGISTRY._counters.get(fallbacks, 0)
+    server = BenchServer(ranges=ranges).start()
+    try:
+        r = _download_one(build_ydl_opts(), server.video_url(f"seg-{ranges:d}", size=200_000))
+    finally:
+        server.shutdown()
+    assert r.ok, r.error
+    [path] = r.files
+    assert os.path.getsize(path) == 200_000
+    if ranges:
+        assert media_ranges[0] == "bytes=0-0"
+        assert sorted(media_ranges[1:]) == sorted(f"bytes={a}-{b}" for a, b in segmented.split(200_000, 4))
+        assert REGISTRY._counters.get(fallbacks, 0) == before
+    else:
+        assert REGISTRY._counters.get(fallbacks, 0) == before + 1
@@ -0,0 +1,127 @@
+# tests/test_sync.py
+import json
+
+import pytest
+
+import batch
+import downloader
+from accounts import NEW, QUEUED, AccountStore
+from downloader import ItemResult, sync_account
+
+ACCOUNT = "https://www.instagram.com/someone/"
+
+
+def _post(n: int, ts: float = None) -> dict:
+    return {"id": str(n), "url": f"https://www.instagram.com/p/{n}/", "title": f"post {n}",
+            "timestamp": 1_000_000 + n if ts is None else ts}
+
+
+@pytest.fixture
+def accounts(tmp_path, monkeypatch):
+    store = AccountStore(tmp_path / "accounts.sqlite")
+    monkeypatch.setattr(downloader, "ACCOUNTS", store)
+    monkeypatch.setattr(batch, "ACCOUNTS", store)
+    return store
+
+
+@pytest.fixture
+def feed(monkeypatch):
+    """The profile's entries, newest first (pinned ones on top); records how many each sync pulled."""
+    posts, pulled = [], []
+
+    class FakeCursor:
+        def __init__(self, url, cookie):
+            self.header = {"title": "Someone"}
+            pulled.append(0)
+
+            def entries():
+                for e in list(posts):
+                    pulled[-1] += 1
+                    yield dict(e)
+            self.entries = entries()
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(downloader, "_Cursor", FakeCursor)
+    return posts, pulled
+
+
+def _ids(posts):
+    return [p["id"] for p in posts]
+
+
+def test_first_sync_records_a_baseline(accounts, feed, monkeypatch):
+    posts, pulled = feed
+    monkeypatch.setattr(downloader, "SYNC_FIRST", 5)
+    posts[:] = [_post(n) for n in range(20, 0, -1)]
+    assert sync_account(ACCOUNT) == []
+    assert pulled == [5]
+    assert accounts.seen_ids(ACCOUNT) == {str(n) for n in range(16, 21)}
+    assert accounts.get(ACCOUNT)["title"] == "Someone"
+    assert accounts.get(ACCOUNT)["newest_ts"] == 1_000_020
+
+
+def test_next_sync_stops_at_the_watermark(accounts, feed, monkeypatch):
+    posts, pulled = feed
+    monkeypatch.setattr(downloader, "SYNC_FIRST", 5)
+    posts[:] = [_post(n) for n in range(20, 0, -1)]
+    sync_account(ACCOUNT)
+    posts[:0] = [_post(22), _post(21)]
+    assert _ids(sync_account(ACCOUNT)) == ["22", "21"]
+    assert pulled[-1] == 4  # the new posts, then known ones up to the first past the pinned slots
+    # nothing new: the posts stay NEW until queued
+    posts[:2] = [_post(22), _post(21)]
+    assert _ids(sync_account(ACCOUNT)) == ["22", "21"]
+    assert accounts.get(ACCOUNT)["newest_ts"] == 1_000_022
+
+
+def test_an_unseen_post_older_than_the_watermark_stops_the_sync(accounts, feed, monkeypatch):
+    posts, pulled = feed
+    monkeypatch.setattr(downloader, "SYNC_FIRST", 2)
+    posts[:] = [_post(10), _post(9)]
+    sync_account(ACCOUNT)
+    # 5 and 4 were never seen (outside the baseline) but are older than the watermark
+    posts[:] = [_post(11), _post(5), _post(4), _post(3), _post(2)]
+    assert _ids(sync_account(ACCOUNT)) == ["11"]
+    assert pulled[-1] == 4
+
+
+def test_pinned_known_posts_do_not_stop_the_sync(accounts, feed, monkeypatch):
+    posts, pulled = feed
+    monkeypatch.setattr(downloader, "SYNC_FIRST", 3)
+    posts[:] = [_post(30), _post(20), _post(10)]
+    sync_account(ACCOUNT)
+    # 10 and 20 are pinned above the newer posts; known, but within SYNC_PINNED
+    posts[:] = [_post(10), _post(20), _post(32), _post(31), _post(30), _post(29, ts=0)]
+    assert _ids(sync_account(ACCOUNT)) == ["32", "31"]
+    assert pulled[-1] == 5
+
+
+def test_max_age_skips_a_recent_sync(accounts, feed):
+    posts, pulled = feed
+    posts[:] = [_post(1)]
+    sync_account(ACCOUNT)
+    sync_account(ACCOUNT, max_age=3600)
+    assert len(pulled) == 1
+
+
+def test_tracked_batch_marks_archive_hits_queued(accounts, tmp_path, monkeypatch):
+    accounts.track(ACCOUNT)
+    accounts.record(ACCOUNT, [_post(1), _post(2)], NEW)
+    done = tmp_path / "1.mp4"
+    done.write_bytes(b"x")
+    monkeypatch.setattr(batch, "sync_due", lambda interval, workers, per_host: {ACCOUNT: accounts.new_posts(ACCOUNT)})
+
+    def download(ydl_opts, url, hooks=None, info=None):
+        # an archive hit from a bare URL carries no info dict; post 2 fails
+        return ItemResult(url, files=[str(done)]) if "/1/" in url else ItemResult(url, error="gone")
+
+    monkeypatch.setattr(batch, "_video_download", lambda infos: download)
+    manifest = tmp_path / "run.jsonl"
+    assert batch.main(["--tracked", "-q", "-o", str(manifest)]) == 1
+    assert _ids(accounts.new_posts(ACCOUNT)) == ["2"]  # the failed post stays new
+    states = dict(accounts._db.execute("SELECT id, state FROM posts").fetchall())
+    assert states == {"1": QUEUED, "2": NEW}
+    records = {r["url"]: r for r in map(json.loads, manifest.read_text().splitlines())}
+    assert records["https://www.instagram.com/p/1/"]["id"] == "1"
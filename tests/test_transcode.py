@@ -0,0 +1,47 @@
+# tests/test_transcode.py
+import pytest
+
+import transcode
+
+
+@pytest.fixture
+def no_ffmpeg(tmp_path, monkeypatch):
+    empty = tmp_path / "bin"
+    empty.mkdir()
+    monkeypatch.setenv("PATH", str(empty))
+
+
+@pytest.fixture
+def source(tmp_path):
+    item = tmp_path / ".audio-src" / "item"
+    item.mkdir(parents=True)
+    src = item / "clip.m4a"
+    src.write_bytes(b"not really audio")
+    return src
+
+
+def test_missing_ffmpeg_removes_an_owned_source(no_ffmpeg, source, tmp_path):
+    with pytest.raises(RuntimeError, match="ffmpeg"):
+        transcode.convert(str(source), "mp3", 192, acodec="aac", dest_dir=str(tmp_path), remove_source=True)
+    assert not source.exists() and not source.parent.exists()
+    assert list(tmp_path.glob("clip.mp3*")) == []
+
+
+def test_missing_ffmpeg_keeps_a_shared_source(no_ffmpeg, source, tmp_path):
+    with pytest.raises(RuntimeError, match="ffmpeg"):
+        transcode.convert(str(source), "mp3", 192, acodec="aac", dest_dir=str(tmp_path))
+    assert source.exists()
+
+
+def test_failed_conversion_removes_an_owned_source(source, tmp_path, monkeypatch):
+    monkeypatch.setattr(transcode.subprocess, "run",
+                        lambda *a, **kw: transcode.subprocess.CompletedProcess(a, 1, "", "Invalid data found\n"))
+    with pytest.raises(RuntimeError, match="ffmpeg: Invalid data found"):
+        transcode.convert(str(source), "mp3", 192, acodec="aac", dest_dir=str(tmp_path), remove_source=True)
+    assert not source.exists()
+
+
+def test_same_format_is_kept_without_ffmpeg(no_ffmpeg, source, tmp_path):
+    dst, mode, _ = transcode.convert(str(source), "m4a", 192, acodec="mp4a.40.2", dest_dir=str(tmp_path), remove_source=True)
+    assert mode == "keep" and open(dst, "rb").read() == b"not really audio"
+    assert not source.parent.exists()
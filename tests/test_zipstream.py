@@ -0,0 +1,124 @@
+# tests/test_zipstream.py
+import io
+import threading
+import time
+import urllib.request
+import zipfile
+
+import pytest
+
+from fileserve import FileServer
+from jobqueue import DONE, JobQueue
+from library import Library
+from zipstream import iter_zip
+
+
+def _zip(paths, **kwargs) -> zipfile.ZipFile:
+    return zipfile.ZipFile(io.BytesIO(b"".join(iter_zip(paths, **kwargs))))
+
+
+def test_archive_is_valid_and_complete(tmp_path):
+    video = tmp_path / "clip.mp4"
+    video.write_bytes(bytes(range(256)) * 4096)
+    notes = tmp_path / "notes.txt"
+    notes.write_text("hello " * 1000)
+    zf = _zip([str(video), str(notes)], chunk_size=4096)
+    assert zf.testzip() is None
+    assert zf.namelist() == ["clip.mp4", "notes.txt"]
+    assert zf.read("clip.mp4") == video.read_bytes()
+    assert zf.read("notes.txt") == notes.read_bytes()
+
+
+def test_media_is_stored_and_the_rest_deflated(tmp_path):
+    for name in ("a.MP4", "b.jpg", "c.json"):
+        (tmp_path / name).write_bytes(b"x" * 10000)
+    zf = _zip([str(tmp_path / n) for n in ("a.MP4", "b.jpg", "c.json")])
+    kinds = {i.filename: i.compress_type for i in zf.infolist()}
+    assert kinds == {"a.MP4": zipfile.ZIP_STORED, "b.jpg": zipfile.ZIP_STORED, "c.json": zipfile.ZIP_DEFLATED}
+    assert zf.getinfo("c.json").compress_size < 10000
+
+
+def test_duplicate_names_are_numbered_and_missing_files_skipped(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    for d in ("a", "b"):
+        (tmp_path / d / "v.mp4").write_bytes(d.encode())
+    zf = _zip([str(tmp_path / "a" / "v.mp4"), str(tmp_path / "gone.mp4"), str(tmp_path / "b" / "v.mp4")])
+    assert zf.namelist() == ["v.mp4", "v (2).mp4"]
+    assert zf.read("v (2).mp4") == b"b"
+
+
+def test_chunks_stay_near_the_chunk_size(tmp_path):
+    big = tmp_path / "big.mp4"
+    big.write_bytes(b"\0" * (1024 * 1024))
+    chunks = list(iter_zip([str(big)], chunk_size=8192))
+    assert max(len(c) for c in chunks) <= 8192 + 1024  # one chunk plus a local header / descriptor
+
+
+def test_entries_are_sent_before_the_next_path_is_known(tmp_path):
+    first = tmp_path / "1.mp4"
+    first.write_bytes(b"1" * 5000)
+    asked = []
+
+    def paths():
+        asked.append(1)
+        yield str(first)
+        asked.append(2)
+
+    chunks = iter_zip(paths())
+    data = next(chunks)
+    assert asked == [1] and b"1.mp4" in data
+    assert len(b"".join([data, *chunks])) > 5000 and asked == [1, 2]
+
+
+def test_iter_files_follows_a_running_job(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.sqlite")
+    job_id = queue.submit({})
+    queue.claim(1)
+    queue.set_progress(job_id, {"items": [], "files": ["a"]})
+    files = queue.iter_files(job_id, poll=0.01)
+    assert next(files) == "a"
+
+    def finish():
+        time.sleep(0.05)
+        queue.set_progress(job_id, {"items": [], "files": ["a", "b"]})
+        time.sleep(0.05)
+        queue.finish(job_id, DONE, {"files": ["a", "b", "c"], "errors": [], "zip_name": "z.zip"})
+
+    threading.Thread(target=finish).start()
+    assert list(files) == ["b", "c"]
+
+
+def test_file_server_sends_a_running_jobs_zip(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.sqlite")
+    job_id = queue.submit({})
+    queue.claim(1)
+    done = []
+    for n in range(3):
+        p = tmp_path / f"{n}.mp4"
+        p.write_bytes(str(n).encode() * 20000)
+        done.append(str(p))
+
+    def stream(rest):
+        return ("sel.zip", iter_zip(queue.iter_files(rest, poll=0.01))) if rest == job_id else None
+
+    server = FileServer(Library(tmp_path / "library.sqlite"), host="127.0.0.1", port=0, streams={"/zip/": stream}).start()
+    try:
+        def worker():
+            for n in range(1, 4):
+                time.sleep(0.05)
+                if n < 3:
+                    queue.set_progress(job_id, {"items": [], "files": done[:n]})
+            queue.finish(job_id, DONE, {"files": done, "errors": [], "zip_name": "sel.zip"})
+
+        threading.Thread(target=worker).start()
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/zip/{job_id}", timeout=10) as resp:
+            assert "sel.zip" in resp.headers["Content-Disposition"]
+            body = resp.read()
+        with pytest.raises(OSError):
+            urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/zip/nope", timeout=10)
+    finally:
+        server.shutdown()
+    zf = zipfile.ZipFile(io.BytesIO(body))
+    assert zf.testzip() is None
+    assert zf.namelist() == ["0.mp4", "1.mp4", "2.mp4"]
@@ -0,0 +1,161 @@
+# thumbs.py
+"""
+Thumbnail proxy: remote thumbnails are fetched once over pooled connections, downscaled to the
+size they are shown at, re-encoded as JPEG and kept in a content-addressed disk cache with an
+LRU byte budget. Pages render the local file instead of the full-size CDN image.
+"""
+import hashlib
+import io
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+GRID_WIDTH = 300  # .grid-thumb slot
+MAX_HEIGHT = 600
+JPEG_QUALITY = 82
+FETCH_TIMEOUT = 10
+MAX_SOURCE_BYTES = 15 * 1024 * 1024
+
+# signature / expiry params: they change on every extraction but not the image
+_VOLATILE_PARAMS = ("x-expires", "x-signature", "expires", "signature", "oe", "oh", "_nc_", "ccb", "efg", "edm")
+
+
+def thumb_key(url: str, width: int) -> str:
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if not k.lower().startswith(_VOLATILE_PARAMS)]
+    stable = urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, urlencode(sorted(query)), ""))
+    return hashlib.sha256(f"{stable}@{width}".encode()).hexdigest()
+
+
+def _downscale(data: bytes, width: int) -> bytes:
+    with Image.open(io.BytesIO(data)) as im:
+        im.draft("RGB", (width, MAX_HEIGHT))  # JPEG sources decode at reduced scale directly
+        im = im.convert("RGB")
+        im.thumbnail((width, MAX_HEIGHT), Image.LANCZOS)
+        out = io.BytesIO()
+        im.save(out, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+class ThumbnailService:
+    """Process-wide; safe to call from any session's script thread."""
+
+    def __init__(self, cache_dir: Path, max_bytes: int = 128 * 1024 * 1024, workers: int = 12):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=workers, max_retries=1)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._session.headers["User-Agent"] = "Mozilla/5.0 (compatible; thumbnail-proxy)"
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbs")
+        self._lock = threading.RLock()  # done-callbacks may fire while it is held
+        self._inflight: Dict[str, Future] = {}
+        self._db = sqlite3.connect(str(self.cache_dir / "index.sqlite"), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS thumbs (key TEXT PRIMARY KEY, digest TEXT NOT NULL, accessed REAL NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER NOT NULL)")
+        self.hits = self.misses = self.failures = 0
+
+    def _path(self, digest: str) -> Path:
+        return self.cache_dir / digest[:2] / f"{digest}.jpg"
+
+    def _lookup(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT digest FROM thumbs WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            path = self._path(row[0])
+            if not path.exists():
+                self._db.execute("DELETE FROM thumbs WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE thumbs SET accessed = ? WHERE key = ?", (time.time(), key))
+            return str(path)
+
+    def _store(self, key: str, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            tmp = path.with_suffix(".part")
+            tmp.write_bytes(data)
+            tmp.replace(path)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO blobs (digest, size) VALUES (?, ?)", (digest, len(data)))
+            self._db.execute("INSERT OR REPLACE INTO thumbs (key, digest, accessed) VALUES (?, ?, ?)", (key, digest, time.time()))
+            self._evict()
+        return str(path)
+
+    def _evict(self) -> None:
+        # caller holds self._lock; drop least-recently used blobs until under budget
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute(
+            "SELECT b.digest, b.size FROM blobs b LEFT JOIN thumbs t ON t.digest = b.digest "
+            "GROUP BY b.digest ORDER BY COALESCE(MAX(t.accessed), 0)"
+        ).fetchall()
+        for digest, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM thumbs WHERE digest = ?", (digest,))
+            self._db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            self._path(digest).unlink(missing_ok=True)
+            total -= size
+
+    def _fetch(self, url: str, key: str, width: int) -> Optional[str]:
+        try:
+            with self._session.get(url, timeout=FETCH_TIMEOUT, stream=True) as resp:
+                resp.raise_for_status()
+                data = resp.raw.read(MAX_SOURCE_BYTES + 1, decode_content=True)
+            if len(data) > MAX_SOURCE_BYTES:
+                raise ValueError("thumbnail too large")
+            return self._store(key, _downscale(data, width))
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            return None
+
+    def _submit(self, url: str, width: int) -> Future:
+        key = thumb_key(url, width)
+        cached = self._lookup(key)
+        done: Future = Future()
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            done.set_result(cached)
+            return done
+        with self._lock:
+            self.misses += 1
+            fut = self._inflight.get(key)
+            if fut is None:
+                fut = self._inflight[key] = self._pool.submit(self._fetch, url, key, width)
+                fut.add_done_callback(lambda _f, k=key: self._forget(k))
+        return fut
+
+    def _forget(self, key: str) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def get_many(self, urls: List[Optional[str]], width: int = GRID_WIDTH) -> List[Optional[str]]:
+        """Local cached file path per URL (fetched concurrently as needed); None where unavailable."""
+        futures = [self._submit(u, width) if u else None for u in urls]
+        return [f.result() if f is not None else None for f in futures]
+
+    def get(self, url: Optional[str], width: int = GRID_WIDTH) -> Optional[str]:
+        return self.get_many([url], width)[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            return {"hits": self.hits, "misses": self.misses, "failures": self.failures, "files": count, "bytes": size}
@@ -0,0 +1,128 @@
+# transcode.py
+"""
+Audio extraction off the download threads. A finished download is handed to a process pool
+(one FFmpeg at a time per core) and the download slot is free for the next item at once.
+Sources that already carry the target codec are stream-copied (or kept as they are) instead of
+re-encoded. Results are recorded in the download archive (library.py) by (extractor, id, format,
+quality), so asking for the same audio again costs nothing.
+"""
+import multiprocessing
+import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+DEFAULT_FORMAT = "mp3"
+DEFAULT_QUALITY = 192  # kbps, when re-encoding
+TRANSCODE_WORKERS = int(os.environ.get("VD_TRANSCODE_WORKERS", str(os.cpu_count() or 2)))
+
+# target -> (source format preference, ffmpeg encoder, ffmpeg muxer, codecs that need no re-encode)
+FORMATS: Dict[str, Tuple[str, str, str, Tuple[str, ...]]] = {
+    "mp3": ("bestaudio[acodec=mp3]/bestaudio/best", "libmp3lame", "mp3", ("mp3",)),
+    "m4a": ("bestaudio[ext=m4a]/bestaudio[acodec^=mp4a]/bestaudio/best", "aac", "ipod", ("aac", "mp4a")),
+    "opus": ("bestaudio[acodec=opus]/bestaudio/best", "libopus", "opus", ("opus",)),
+}
+
+
+def source_format(target: str) -> str:
+    """yt-dlp format selector that prefers a source the target can be stream-copied from."""
+    return FORMATS[target][0]
+
+
+def _probe_codec(path: str) -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=codec_name", "-of", "csv=p=0", path],
+            capture_output=True, text=True, timeout=60,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return out.stdout.strip() or None
+
+
+def _remove_source(src: str) -> None:
+    """Deletes an extracted source and its per-item directory once that is empty."""
+    for remove, path in ((os.unlink, src), (os.rmdir, Path(src).parent)):
+        try:
+            remove(path)
+        except OSError:
+            pass
+
+
+def convert(src: str, target: str, quality: int, acodec: Optional[str] = None, dest_dir: Optional[str] = None,
+            remove_source: bool = False) -> Tuple[str, str, float]:
+    """
+    Runs in the pool: src -> <dest_dir (default: src's)>/<src stem>.<target>. Returns (path, mode,
+    seconds) where mode is "keep" (already the target format), "copy" (remuxed) or "encode".
+    With remove_source (only for a source the caller downloaded itself), src is deleted afterwards.
+    """
+    t0 = time.perf_counter()
+    _, encoder, muxer, copyable = FORMATS[target]
+    codec = (acodec if acodec and acodec != "none" else None) or _probe_codec(src) or ""
+    copy = codec.split(".")[0].lower() in copyable
+    dst = str(Path(dest_dir or Path(src).parent) / (Path(src).stem + "." + target))
+    if copy and Path(src).suffix == "." + target:
+        if dst != src:
+            if remove_source:
+                os.replace(src, dst)
+                _remove_source(src)  # only the emptied directory is left
+            else:
+                shutil.copyfile(src, dst + ".part")
+                os.replace(dst + ".part", dst)
+        return dst, "keep", time.perf_counter() - t0
+    args = ["-c:a", "copy"] if copy else ["-c:a", encoder, "-b:a", f"{quality}k"]
+    if muxer == "ipod":
+        args += ["-movflags", "+faststart"]
+    part = dst + ".part"
+    try:
+        proc = subprocess.run(
+            ["ffmpeg", "-y", "-nostdin", "-v", "error", "-i", src, "-vn", "-map", "0:a:0", *args, "-f", muxer, part],
+            capture_output=True, text=True,
+        )
+        error = None if proc.returncode == 0 else (proc.stderr.strip().splitlines() or ["exit %d" % proc.returncode])[-1]
+    except OSError as e:  # ffmpeg not installed (or not executable)
+        error = str(e)
+    if error is not None:
+        try:
+            os.unlink(part)
+        except OSError:
+            pass
+        if remove_source:
+            _remove_source(src)  # a retry downloads it again
+        raise RuntimeError(f"ffmpeg: {error}")
+    os.replace(part, dst)
+    if remove_source:
+        _remove_source(src)
+    return dst, "copy" if copy else "encode", time.perf_counter() - t0
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(replace_broken: bool = False) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if replace_broken and _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+        if _pool is None:
+            # spawn, not fork: the downloading process is multi-threaded
+            _pool = ProcessPoolExecutor(max(1, TRANSCODE_WORKERS), mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def submit(src: str, target: str, quality: int, acodec: Optional[str] = None, dest_dir: Optional[str] = None,
+           remove_source: bool = False) -> Future:
+    """Future of convert()'s (path, mode, seconds)."""
+    args = (convert, src, target, quality, acodec, dest_dir, remove_source)
+    try:
+        return get_pool().submit(*args)
+    except BrokenProcessPool:  # a worker died (OOM kill...): start a new pool
+        return get_pool(replace_broken=True).submit(*args)
+
@@ -0,0 +1,129 @@
+# ydlpool.py
+"""
+Process-wide pool of configured YoutubeDL instances, keyed by their options (hooks excluded).
+Building a YoutubeDL loads the extractor table, reads the cookie file and sets up its HTTP
+handlers; a pooled instance skips all of that and keeps its connections alive between calls.
+
+A YoutubeDL is not thread-safe, so an instance is lent to one caller at a time. The caller's
+progress / postprocessor hooks are attached for the length of the loan only.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Iterator, List
+
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadError
+
+MAX_IDLE = int(os.environ.get("VD_YDL_POOL_IDLE", "8"))  # idle instances kept per option set
+MAX_KEYS = 16  # option sets kept; the least recently used one is closed beyond that
+
+_HOOK_KEYS = ("progress_hooks", "postprocessor_hooks")
+
+
+def options_key(opts: dict) -> str:
+    return json.dumps({k: v for k, v in opts.items() if k not in _HOOK_KEYS}, sort_keys=True, default=repr)
+
+
+class _Pooled:
+    """One YoutubeDL whose hooks forward to the current borrower's."""
+
+    def __init__(self, opts: dict):
+        self.progress_hooks: List[Callable[[dict], None]] = []
+        self.postprocessor_hooks: List[Callable[[dict], None]] = []
+        base = {k: v for k, v in opts.items() if k not in _HOOK_KEYS}
+        self.ydl = YoutubeDL(dict(base, progress_hooks=[self._progress], postprocessor_hooks=[self._postprocessor]))
+
+    def _progress(self, d: dict) -> None:
+        for hook in self.progress_hooks:
+            hook(d)
+
+    def _postprocessor(self, d: dict) -> None:
+        for hook in self.postprocessor_hooks:
+            hook(d)
+
+    def close(self) -> None:
+        try:
+            self.ydl.close()
+        except Exception:
+            pass
+
+
+class YdlPool:
+    def __init__(self, max_idle: int = MAX_IDLE, max_keys: int = MAX_KEYS):
+        self.max_idle = max(1, max_idle)
+        self.max_keys = max(1, max_keys)
+        self._lock = threading.Lock()
+        self._idle: "OrderedDict[str, List[_Pooled]]" = OrderedDict()
+        self.created = self.reused = 0
+
+    @contextmanager
+    def borrow(self, opts: dict) -> Iterator[YoutubeDL]:
+        """
+        ``with pool.borrow(opts) as ydl:`` -- a YoutubeDL configured with opts, for this caller only.
+        It goes back to the pool afterwards unless the block raised something other than a
+        DownloadError (a cancelled download, a bug...), in which case it is closed.
+        """
+        key = options_key(opts)
+        with self._lock:
+            idle = self._idle.get(key)
+            item = idle.pop() if idle else None
+            if item is not None:
+                self.reused += 1
+                self._idle.move_to_end(key)
+        if item is None:
+            item = _Pooled(opts)
+            with self._lock:
+                self.created += 1
+        item.progress_hooks = list(opts.get("progress_hooks") or [])
+        item.postprocessor_hooks = list(opts.get("postprocessor_hooks") or [])
+        keep = True
+        try:
+            yield item.ydl
+        except DownloadError:
+            raise
+        except BaseException:
+            keep = False
+            raise
+        finally:
+            item.progress_hooks = []
+            item.postprocessor_hooks = []
+            if keep:
+                self._give_back(key, item)
+            else:
+                item.close()
+
+    def warm(self, opts: dict, count: int = 1) -> None:
+        """Builds instances for opts ahead of the first request (e.g. at startup, off the UI thread)."""
+        key = options_key(opts)
+        for _ in range(count):
+            with self._lock:
+                if len(self._idle.get(key, [])) >= min(count, self.max_idle):
+                    return
+                self.created += 1
+            self._give_back(key, _Pooled(opts))
+
+    def _give_back(self, key: str, item: _Pooled) -> None:
+        closing: List[_Pooled] = []
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            self._idle.move_to_end(key)
+            if len(idle) < self.max_idle:
+                idle.append(item)
+            else:
+                closing.append(item)
+            while len(self._idle) > self.max_keys:
+                closing.extend(self._idle.popitem(last=False)[1])
+        for it in closing:
+            it.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "created": self.created,
+                "reused": self.reused,
+                "idle": sum(len(v) for v in self._idle.values()),
+                "option_sets": len(self._idle),
+            }